@@ -0,0 +1,227 @@
+# coding=utf-8
+"""Benchmarks the hot paths of pyhanabi and rl_env.
+
+For every preset of `rl_env.make` and every number of players, seeded random
+games are played while the time of each call below is accumulated:
+
+  pyhanabi: HanabiState.apply_move, HanabiState.deal_random_card,
+            HanabiState.legal_moves, HanabiState.observation (which constructs
+            a HanabiObservation) and ObservationEncoder.encode.
+  rl_env:   HanabiEnv.reset, HanabiEnv.step and
+            HanabiEnv._make_observation_all_players.
+
+A shorter, untimed run of the environment under tracemalloc then records the
+peak traced memory and the memory blocks left allocated. Results are written
+as JSON, and can be compared with a saved baseline:
+
+  python benchmarks/engine_benchmark.py --output baseline.json
+  python benchmarks/engine_benchmark.py --compare baseline.json
+
+The comparison exits with status 1 if any call got slower than the threshold.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from hanabi_learning_environment import pyhanabi
+from hanabi_learning_environment import rl_env
+
+PRESETS = ("Hanabi-Full", "Hanabi-Full-CardKnowledge", "Hanabi-Full-Minimal",
+           "Hanabi-Small", "Hanabi-Very-Small")
+PLAYERS = (2, 3, 4, 5)
+
+
+class _Timer(object):
+  """Accumulates the number and total duration of calls of each operation."""
+
+  def __init__(self):
+    self.calls = {}
+    self.seconds = {}
+
+  def call(self, name, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    self.calls[name] = self.calls.get(name, 0) + 1
+    self.seconds[name] = self.seconds.get(name, 0.0) + elapsed
+    return result
+
+  def results(self):
+    return {name: {"calls": self.calls[name],
+                   "us_per_call": 1e6 * self.seconds[name] / self.calls[name]}
+            for name in self.calls}
+
+
+def make_env(preset, num_players, seed):
+  """Returns the environment of a preset with a fixed deck seed."""
+  env = rl_env.make(preset, num_players)
+  # rl_env.make seeds the game from the system random device, so the game is
+  # rebuilt from its parameters with the seed replaced.
+  config = dict(line.split("=", 1)
+                for line in env.game.parameter_string().splitlines() if line)
+  config["seed"] = seed
+  return rl_env.HanabiEnv(config=config)
+
+
+def benchmark_state(game, encoder, rng, num_moves):
+  """Times the pyhanabi calls over random games until num_moves are applied."""
+  timer = _Timer()
+  moves = 0
+  while moves < num_moves:
+    state = game.new_initial_state()
+    while not state.is_terminal() and moves < num_moves:
+      if state.cur_player() == pyhanabi.CHANCE_PLAYER_ID:
+        timer.call("deal_random_card", state.deal_random_card)
+        continue
+      observation = timer.call("observation", state.observation,
+                               state.cur_player())
+      timer.call("encode", encoder.encode, observation)
+      legal_moves = timer.call("legal_moves", state.legal_moves)
+      timer.call("apply_move", state.apply_move, rng.choice(legal_moves))
+      moves += 1
+  return timer.results()
+
+
+def _legal_moves(observation):
+  """Returns the legal moves of the current player."""
+  current_player = observation["current_player"]
+  return observation["player_observations"][current_player]["legal_moves"]
+
+
+def benchmark_env(env, rng, num_steps):
+  """Times the rl_env calls over random games until num_steps are taken."""
+  timer = _Timer()
+  make_observation = env._make_observation_all_players  # pylint: disable=protected-access
+  steps = 0
+  while steps < num_steps:
+    observation = timer.call("reset", env.reset)
+    done = False
+    while not done and steps < num_steps:
+      action = rng.choice(_legal_moves(observation))
+      observation, _, done, _ = timer.call("step", env.step, action)
+      timer.call("make_observation_all_players", make_observation)
+      steps += 1
+  results = timer.results()
+  env_seconds = timer.seconds["reset"] + timer.seconds["step"]
+  results["steps_per_sec"] = steps / env_seconds
+  return results
+
+
+def measure_allocations(env, rng, num_steps):
+  """Runs the environment under tracemalloc and returns its allocations."""
+  tracemalloc.start()
+  start_blocks = sys.getallocatedblocks()
+  steps = 0
+  while steps < num_steps:
+    observation = env.reset()
+    done = False
+    while not done and steps < num_steps:
+      action = rng.choice(_legal_moves(observation))
+      observation, _, done, _ = env.step(action)
+      steps += 1
+  del observation
+  net_blocks = sys.getallocatedblocks() - start_blocks
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return {"steps": steps, "peak_bytes": peak, "net_blocks": net_blocks}
+
+
+def run(presets, players, num_moves, num_steps, num_alloc_steps, seed):
+  """Returns the results of every preset and number of players."""
+  results = {}
+  for preset in presets:
+    for num_players in players:
+      env = make_env(preset, num_players, seed)
+      rng = random.Random(seed)
+      key = "{}/{}p".format(preset, num_players)
+      results[key] = {
+          "pyhanabi": benchmark_state(env.game, env.observation_encoder, rng,
+                                      num_moves),
+          "rl_env": benchmark_env(env, rng, num_steps),
+          "allocations": measure_allocations(env, rng, num_alloc_steps),
+      }
+      print("{:32s} {:10.0f} env steps/s".format(
+          key, results[key]["rl_env"]["steps_per_sec"]))
+  return results
+
+
+def compare(results, baseline, threshold):
+  """Prints the change of every call against a baseline.
+
+  Args:
+    results: dict, results of this run.
+    baseline: dict, results of a previous run.
+    threshold: float, relative slowdown above which a call regressed.
+
+  Returns:
+    The list of regressions, as (configuration, call, relative change).
+  """
+  regressions = []
+  for key, result in sorted(results.items()):
+    if key not in baseline:
+      continue
+    for group in ("pyhanabi", "rl_env"):
+      for name, stats in sorted(result[group].items()):
+        old_stats = baseline[key][group].get(name)
+        if not isinstance(stats, dict) or not old_stats:
+          continue
+        change = stats["us_per_call"] / old_stats["us_per_call"] - 1
+        flag = ""
+        if change > threshold:
+          regressions.append((key, name, change))
+          flag = "  REGRESSION"
+        print("{:32s} {:30s} {:9.2f} -> {:9.2f} us  {:+7.1%}{}".format(
+            key, name, old_stats["us_per_call"], stats["us_per_call"], change,
+            flag))
+  return regressions
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--presets", nargs="+", default=PRESETS,
+                      choices=PRESETS, help="rl_env presets to benchmark.")
+  parser.add_argument("--players", nargs="+", type=int, default=PLAYERS,
+                      help="Numbers of players to benchmark.")
+  parser.add_argument("--num_moves", type=int, default=20000,
+                      help="Moves applied per pyhanabi benchmark.")
+  parser.add_argument("--num_steps", type=int, default=5000,
+                      help="Environment steps per rl_env benchmark.")
+  parser.add_argument("--num_alloc_steps", type=int, default=500,
+                      help="Environment steps run under tracemalloc.")
+  parser.add_argument("--seed", type=int, default=0,
+                      help="Seed of the decks and of the random players.")
+  parser.add_argument("--output", help="JSON file for the results.")
+  parser.add_argument("--compare", help="JSON results to compare against.")
+  parser.add_argument("--threshold", type=float, default=0.1,
+                      help="Relative slowdown reported as a regression.")
+  args = parser.parse_args()
+
+  results = run(args.presets, args.players, args.num_moves, args.num_steps,
+                args.num_alloc_steps, args.seed)
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump({"python": platform.python_version(),
+                 "machine": platform.machine(),
+                 "seed": args.seed,
+                 "results": results}, f, indent=2, sort_keys=True)
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+      print("{} calls regressed by more than {:.0%}.".format(
+          len(regressions), args.threshold))
+      sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,112 @@
+# coding=utf-8
+"""Measures how long the rainbow agent modules take to import.
+
+Every module is imported in a fresh interpreter, the way an actor process
+would import it, and the script reports the median wall time over the
+repetitions together with the heavy dependencies the import pulled in:
+
+  python benchmarks/startup_benchmark.py --repeats 5 --output startup.json
+
+Modules whose import fails, e.g. because TensorFlow is not installed, are
+reported with their error instead of a time.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RAINBOW_DIR = os.path.join(REPO_DIR, "hanabi_learning_environment", "agents",
+                           "rainbow")
+DEFAULT_MODULES = (
+    "hanabi_learning_environment.rl_env",
+    "environment_utils",
+    "small_hanabi_conventions_encoder",
+    "hanabi_conventions_encoder",
+    "run_experiment",
+    "dqn_agent",
+    "rainbow_agent",
+)
+HEAVY_MODULES = ("tensorflow", "torch", "pandas")
+
+# Run in the child interpreter; prints the import time and loaded modules.
+_CHILD_SCRIPT = """
+import json, sys, time
+sys.path[:0] = {paths!r}
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed,
+                  "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def time_import(module):
+  """Imports a module in a fresh interpreter.
+
+  Args:
+    module: str, name of the module to import.
+
+  Returns:
+    A dict with the import time in seconds and the heavy modules it loaded, or
+    with the error if the import failed.
+  """
+  script = _CHILD_SCRIPT.format(paths=[REPO_DIR, RAINBOW_DIR], module=module,
+                                heavy=HEAVY_MODULES)
+  process = subprocess.run([sys.executable, "-c", script],
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                           universal_newlines=True, cwd=RAINBOW_DIR)
+  if process.returncode:
+    lines = process.stderr.strip().splitlines()
+    return {"error": lines[-1] if lines else "exit code {}".format(
+        process.returncode)}
+  return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def benchmark(modules, repeats):
+  """Returns the startup results of each module, keyed by module name."""
+  results = {}
+  for module in modules:
+    runs = [time_import(module) for _ in range(repeats)]
+    errors = [run["error"] for run in runs if "error" in run]
+    if errors:
+      results[module] = {"error": errors[0]}
+      continue
+    results[module] = {
+        "median_seconds": statistics.median(run["seconds"] for run in runs),
+        "loaded": runs[0]["loaded"],
+    }
+  return results
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES,
+                      help="Modules to import.")
+  parser.add_argument("--repeats", type=int, default=5,
+                      help="Number of fresh imports of every module.")
+  parser.add_argument("--output", help="Optional JSON file for the results.")
+  args = parser.parse_args()
+
+  results = benchmark(args.modules, args.repeats)
+  for module, result in results.items():
+    if "error" in result:
+      print("{:40s} failed: {}".format(module, result["error"]))
+    else:
+      print("{:40s} {:8.3f} s  loads: {}".format(
+          module, result["median_seconds"],
+          ", ".join(result["loaded"]) or "-"))
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+  main()
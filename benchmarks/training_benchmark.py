@@ -0,0 +1,275 @@
+# coding=utf-8
+"""Breaks down the time of the rainbow training loop by stage.
+
+For every agent type and number of players, a freshly seeded agent plays
+`--warmup_steps` training steps to fill its replay memory, after which
+`--num_steps` steps of `run_experiment.run_one_phase` are timed. The calls
+making up the loop are wrapped to attribute the wall time to these stages:
+
+  env_step               HanabiEnv.step
+  parse_observations     run_experiment.parse_observations
+  available_conventions  convention encoder available_conventions
+  encode_action          convention encoder encode_action
+  select_action          DQNAgent._select_action
+  record_transition      DQNAgent._record_transition
+  replay_add             DQNAgent._post_transitions
+  replay_sampling        OutOfGraphReplayMemory.sample_transition_batch, and
+                         the session calls only staging a batch
+  train_op               session calls running the train op
+  target_sync            session calls syncing the target network
+  other                  the rest of the loop
+
+Stage times are exclusive: sampling happening within a train op session call,
+through the replay py_func, counts towards replay_sampling only. With a
+prefetch queue (WrappedReplayMemory.prefetch_depth), batches are sampled on the
+replay producer thread while the loop runs, so that time is reported apart,
+under background_stages, and is not part of the loop's stages.
+
+  python benchmarks/training_benchmark.py --output training.json
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RAINBOW_DIR = os.path.join(REPO_DIR, "hanabi_learning_environment", "agents",
+                           "rainbow")
+sys.path.insert(0, RAINBOW_DIR)
+
+# pylint: disable=g-import-not-at-top,wrong-import-position
+from engine_benchmark import make_env
+from hanabi_conventions_encoder import simple_official_rules_based_encoder
+import replay_memory
+import run_experiment
+import tensorflow as tf
+from third_party.dopamine import iteration_statistics
+# pylint: enable=g-import-not-at-top,wrong-import-position
+
+AGENT_TYPES = ("DQN", "Rainbow")
+PLAYERS = (2, 3, 4, 5)
+STAGES = ("env_step", "parse_observations", "available_conventions",
+          "encode_action", "select_action", "record_transition", "replay_add",
+          "replay_sampling", "train_op", "target_sync")
+# Threads running concurrently with the training loop, as named by
+# WrappedReplayMemory.
+BACKGROUND_THREADS = ("replay_producer",)
+
+
+class StageTimer(object):
+  """Accumulates the exclusive wall time of nested, named stages."""
+
+  def __init__(self, background_threads=()):
+    """Initializes the timer.
+
+    Args:
+      background_threads: names of the threads running concurrently with the
+        timed loop, whose stages are accumulated apart, in
+        background_seconds and background_calls.
+    """
+    self.enabled = False
+    self.seconds = collections.defaultdict(float)
+    self.calls = collections.defaultdict(int)
+    self.background_seconds = collections.defaultdict(float)
+    self.background_calls = collections.defaultdict(int)
+    self._background_threads = frozenset(background_threads)
+    # Time spent in the child stages of each open stage. The replay py_func
+    # runs on a TensorFlow thread while the main thread waits in the session
+    # call, so a single stack is shared by all threads but the background
+    # ones, which each have their own.
+    self._children = []
+    self._background = threading.local()
+
+  def _accounts(self):
+    """Returns the stack and totals the calling thread's stages go to."""
+    if threading.current_thread().name not in self._background_threads:
+      return self._children, self.seconds, self.calls
+    if not hasattr(self._background, "children"):
+      self._background.children = []
+    return (self._background.children, self.background_seconds,
+            self.background_calls)
+
+  def time(self, stage, fn, *args, **kwargs):
+    """Calls fn, charging its duration to stage."""
+    if not self.enabled:
+      return fn(*args, **kwargs)
+    children, seconds, calls = self._accounts()
+    children.append(0.0)
+    start = time.perf_counter()
+    try:
+      return fn(*args, **kwargs)
+    finally:
+      elapsed = time.perf_counter() - start
+      seconds[stage] += elapsed - children.pop()
+      calls[stage] += 1
+      if children:
+        children[-1] += elapsed
+
+  def wrap(self, stage, fn):
+    """Returns fn with its calls charged to stage."""
+    def timed(*args, **kwargs):
+      return self.time(stage, fn, *args, **kwargs)
+    return timed
+
+
+class _NullMetrics(object):
+  """Discards the episode scores the training loop records."""
+
+  def record_episode(self, score):
+    pass
+
+
+def _instrument_session(timer, agent):
+  """Charges the agent's training session calls to their stages."""
+  session_run = agent._sess.run  # pylint: disable=protected-access
+
+  def run(fetches, *args, **kwargs):
+    if fetches is agent._sync_qt_ops:  # pylint: disable=protected-access
+      stage = "target_sync"
+    elif fetches is agent._replay.prefetch_batch:  # pylint: disable=protected-access
+      stage = "replay_sampling"
+    elif (isinstance(fetches, list) and
+          any(fetch is agent._train_op for fetch in fetches)):  # pylint: disable=protected-access
+      stage = "train_op"
+    else:
+      return session_run(fetches, *args, **kwargs)
+    return timer.time(stage, session_run, fetches, *args, **kwargs)
+
+  agent._sess.run = run  # pylint: disable=protected-access
+
+
+def benchmark(agent_type, num_players, game_type, warmup_steps, num_steps,
+              seed):
+  """Returns the stage breakdown of one configuration."""
+  tf.reset_default_graph()
+  tf.set_random_seed(seed)
+  random.seed(seed)
+  np.random.seed(seed)
+  timer = StageTimer(BACKGROUND_THREADS)
+
+  environment = make_env(game_type, num_players, seed)
+  environment.step = timer.wrap("env_step", environment.step)
+  obs_stacker = run_experiment.create_obs_stacker(environment)
+  encoder = simple_official_rules_based_encoder(environment)
+  encoder.available_conventions = timer.wrap("available_conventions",
+                                             encoder.available_conventions)
+  encoder.encode_action = timer.wrap("encode_action", encoder.encode_action)
+
+  # The replay py_func holds on to the bound method, so the class is patched
+  # while the agent is built.
+  memory_class = replay_memory.OutOfGraphReplayMemory
+  sample_transition_batch = memory_class.sample_transition_batch
+  memory_class.sample_transition_batch = timer.wrap("replay_sampling",
+                                                    sample_transition_batch)
+  try:
+    agent = run_experiment.create_agent(environment, obs_stacker, encoder,
+                                        agent_type=agent_type)
+  finally:
+    memory_class.sample_transition_batch = sample_transition_batch
+  # pylint: disable=protected-access
+  agent._select_action = timer.wrap("select_action", agent._select_action)
+  agent._record_transition = timer.wrap("record_transition",
+                                        agent._record_transition)
+  agent._post_transitions = timer.wrap("replay_add", agent._post_transitions)
+  # pylint: enable=protected-access
+  _instrument_session(timer, agent)
+
+  parse_observations = run_experiment.parse_observations
+  run_experiment.parse_observations = timer.wrap("parse_observations",
+                                                 parse_observations)
+  try:
+    statistics = iteration_statistics.IterationStatistics()
+    run_experiment.run_one_phase(agent, environment, obs_stacker, warmup_steps,
+                                 statistics, "train", _NullMetrics(), encoder)
+    timer.enabled = True
+    start = time.perf_counter()
+    steps, _, episodes = run_experiment.run_one_phase(
+        agent, environment, obs_stacker, num_steps, statistics, "train",
+        _NullMetrics(), encoder)
+    wall_seconds = time.perf_counter() - start
+    timer.enabled = False
+  finally:
+    run_experiment.parse_observations = parse_observations
+    agent.stop_prefetching()
+    agent._sess.close()  # pylint: disable=protected-access
+
+  stages = {}
+  for stage in STAGES:
+    stages[stage] = {"calls": timer.calls[stage],
+                     "seconds": timer.seconds[stage],
+                     "percent": 100 * timer.seconds[stage] / wall_seconds}
+  other = wall_seconds - sum(timer.seconds.values())
+  stages["other"] = {"calls": 0, "seconds": other,
+                     "percent": 100 * other / wall_seconds}
+  background_stages = {}
+  for stage, seconds in timer.background_seconds.items():
+    background_stages[stage] = {"calls": timer.background_calls[stage],
+                                "seconds": seconds,
+                                "percent": 100 * seconds / wall_seconds}
+  return {"steps": steps, "episodes": episodes, "wall_seconds": wall_seconds,
+          "steps_per_sec": steps / wall_seconds, "stages": stages,
+          "background_stages": background_stages}
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--agent_types", nargs="+", default=AGENT_TYPES,
+                      choices=AGENT_TYPES, help="Agents to benchmark.")
+  parser.add_argument("--players", nargs="+", type=int, default=PLAYERS,
+                      help="Numbers of players to benchmark.")
+  parser.add_argument("--game_type", default="Hanabi-Full-CardKnowledge",
+                      help="rl_env preset to play.")
+  parser.add_argument("--warmup_steps", type=int, default=1000,
+                      help="Untimed steps filling the replay memory.")
+  parser.add_argument("--num_steps", type=int, default=5000,
+                      help="Timed training steps per configuration.")
+  parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+  parser.add_argument(
+      "--gin_files", nargs="*",
+      default=[os.path.join(RAINBOW_DIR, "configs", "hanabi_rainbow.gin")],
+      help="Gin configuration files of the agents.")
+  parser.add_argument("--gin_bindings", nargs="*", default=[],
+                      help="Gin bindings overriding the configuration files.")
+  parser.add_argument("--output", help="JSON file for the results.")
+  args = parser.parse_args()
+
+  run_experiment.load_gin_configs(args.gin_files, args.gin_bindings)
+  results = {}
+  for agent_type in args.agent_types:
+    for num_players in args.players:
+      key = "{}/{}p".format(agent_type, num_players)
+      result = benchmark(agent_type, num_players, args.game_type,
+                         args.warmup_steps, args.num_steps, args.seed)
+      results[key] = result
+      print("{}: {:.1f} steps/s".format(key, result["steps_per_sec"]))
+      for stage, stats in sorted(result["stages"].items(),
+                                 key=lambda item: -item[1]["seconds"]):
+        print("  {:24s} {:8.3f} s {:6.1f}%".format(stage, stats["seconds"],
+                                                   stats["percent"]))
+      for stage, stats in sorted(result["background_stages"].items()):
+        print("  {:24s} {:8.3f} s {:6.1f}% (background)".format(
+            stage, stats["seconds"], stats["percent"]))
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump({"game_type": args.game_type,
+                 "warmup_steps": args.warmup_steps,
+                 "num_steps": args.num_steps,
+                 "seed": args.seed,
+                 "gin_files": args.gin_files,
+                 "gin_bindings": args.gin_bindings,
+                 "results": results}, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,187 @@
+# coding=utf-8
+"""Chunked, multi-threaded checkpoint files for large numpy arrays.
+
+An array is split into fixed-size blocks which are compressed with zlib on a
+thread pool (zlib releases the GIL, so the blocks really are compressed in
+parallel) and written one after the other. The file ends with a manifest
+holding the array layout and the length and CRC-32 of every block, followed by
+the manifest length and a magic string:
+
+  block 0 | block 1 | ... | manifest (JSON) | manifest length | magic
+
+A partially written file lacks the trailer, or does not have the size the
+manifest announces, which `verify` detects without reading any block.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+from concurrent import futures
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+import tensorflow as tf
+
+
+# Bytes of array data per block.
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+MAGIC = b'HANABIC1'
+# Manifest length (unsigned 64-bit little-endian) followed by MAGIC.
+_TRAILER = struct.Struct('<Q8s')
+
+
+def _compress_block(block, compression_level):
+  """Returns the compressed bytes of a block and their CRC-32."""
+  data = zlib.compress(block, compression_level)
+  return data, zlib.crc32(data) & 0xffffffff
+
+
+def _stored_blocks(blocks, compression_level, num_threads):
+  """Yields the stored data of each block and its CRC-32, in order.
+
+  Uncompressed blocks are the views of the array themselves. Otherwise at most
+  2 * num_threads blocks are compressed ahead of the one being written, so
+  that a disk slower than the compression does not pile up a compressed copy
+  of the array in memory.
+  """
+  if not compression_level:
+    for block in blocks:
+      yield block, zlib.crc32(block) & 0xffffffff
+    return
+  with futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+    pending = collections.deque()
+    for block in blocks:
+      pending.append(
+          executor.submit(_compress_block, block, compression_level))
+      if len(pending) >= 2 * num_threads:
+        yield pending.popleft().result()
+    while pending:
+      yield pending.popleft().result()
+
+
+def save_array(filename, array, compression_level=6,
+               block_size=DEFAULT_BLOCK_SIZE, num_threads=None):
+  """Writes a numpy array to a chunked checkpoint file.
+
+  Args:
+    filename: str, path of the file to write.
+    array: `np.array`, the array to save. Object arrays are not supported.
+    compression_level: int, zlib compression level between 0 and 9. Level 0
+      stores the blocks uncompressed.
+    block_size: int, number of bytes of array data per block.
+    num_threads: int, number of compression threads, or None for one per CPU.
+  """
+  if num_threads is None:
+    num_threads = os.cpu_count() or 1
+  shape = np.shape(array)
+  array = np.ascontiguousarray(array)
+  data = memoryview(array.reshape(-1).view(np.uint8))
+  blocks = [data[start:start + block_size]
+            for start in range(0, len(data), block_size)]
+  manifest = {
+      'dtype': array.dtype.str,
+      'shape': list(shape),
+      'compression_level': compression_level,
+      'blocks': [],
+  }
+  with tf.gfile.Open(filename, 'wb') as f:
+    for block, (stored, crc) in zip(
+        blocks, _stored_blocks(blocks, compression_level, num_threads)):
+      # GFile only writes bytes, so an uncompressed block is copied here, one
+      # block at a time.
+      f.write(bytes(stored))
+      manifest['blocks'].append([len(stored), len(block), crc])
+    encoded = json.dumps(manifest).encode('utf-8')
+    f.write(encoded)
+    f.write(_TRAILER.pack(len(encoded), MAGIC))
+
+
+def _read_manifest(f, filename):
+  """Reads and checks the manifest at the end of an open chunked file.
+
+  Raises:
+    DataLossError: if the file is truncated or is not a chunked checkpoint.
+  """
+  f.seek(0, 2)
+  file_size = f.tell()
+  if file_size < _TRAILER.size:
+    raise tf.errors.DataLossError(None, None,
+                                  'Truncated checkpoint: {}'.format(filename))
+  f.seek(file_size - _TRAILER.size)
+  manifest_size, magic = _TRAILER.unpack(f.read(_TRAILER.size))
+  blocks_size = file_size - _TRAILER.size - manifest_size
+  if magic != MAGIC or blocks_size < 0:
+    raise tf.errors.DataLossError(None, None,
+                                  'Truncated checkpoint: {}'.format(filename))
+  f.seek(blocks_size)
+  manifest = json.loads(f.read(manifest_size).decode('utf-8'))
+  if sum(block[0] for block in manifest['blocks']) != blocks_size:
+    raise tf.errors.DataLossError(
+        None, None, 'Checkpoint size does not match its manifest: {}'.format(
+            filename))
+  return manifest
+
+
+def verify(filename):
+  """Checks that a chunked file was completely written, without reading it.
+
+  Args:
+    filename: str, path of the chunked file.
+
+  Raises:
+    DataLossError: if the file is truncated or is not a chunked checkpoint.
+  """
+  with tf.gfile.Open(filename, 'rb') as f:
+    _read_manifest(f, filename)
+
+
+def load_array(filename, num_threads=None):
+  """Reads an array written by `save_array`.
+
+  Args:
+    filename: str, path of the chunked file.
+    num_threads: int, number of decompression threads, or None for the
+      `concurrent.futures` default.
+
+  Returns:
+    The saved `np.array`.
+
+  Raises:
+    DataLossError: if the file is truncated or a block fails its checksum.
+  """
+  with tf.gfile.Open(filename, 'rb') as f:
+    manifest = _read_manifest(f, filename)
+    array = np.empty(manifest['shape'], dtype=np.dtype(manifest['dtype']))
+    output = array.reshape(-1).view(np.uint8)
+    compression_level = manifest['compression_level']
+
+    def decompress(args):
+      stored, offset, size, crc = args
+      if zlib.crc32(stored) & 0xffffffff != crc:
+        raise tf.errors.DataLossError(
+            None, None, 'Checksum mismatch at byte {} of {}'.format(
+                offset, filename))
+      if compression_level:
+        stored = zlib.decompress(stored)
+      if len(stored) != size:
+        raise tf.errors.DataLossError(
+            None, None, 'Block size mismatch at byte {} of {}'.format(
+                offset, filename))
+      output[offset:offset + size] = np.frombuffer(stored, dtype=np.uint8)
+
+    f.seek(0)
+    with futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+      pending = []
+      offset = 0
+      for stored_size, size, crc in manifest['blocks']:
+        pending.append(executor.submit(
+            decompress, (f.read(stored_size), offset, size, crc)))
+        offset += size
+      for future in pending:
+        future.result()
+  return array
@@ -0,0 +1,102 @@
+# coding=utf-8
+"""Tests for chunked_checkpoint."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import chunked_checkpoint
+import numpy as np
+import tensorflow as tf
+
+
+class ChunkedCheckpointTest(tf.test.TestCase):
+
+  def _filename(self):
+    return os.path.join(self.get_temp_dir(), 'array.chunks')
+
+  def _save(self, array, **kwargs):
+    filename = self._filename()
+    chunked_checkpoint.save_array(filename, array, **kwargs)
+    return filename
+
+  def testArraysRoundTrip(self):
+    rng = np.random.RandomState(0)
+    arrays = [rng.randint(0, 2, (100, 37)).astype(np.uint8),
+              rng.uniform(size=(10, 3, 7)).astype(np.float32),
+              np.array([-np.inf, 0.0, 1.5], dtype=np.float32),
+              np.arange(5, dtype=np.int64),
+              np.array(7),
+              np.empty((0, 4), dtype=np.int32)]
+    for array in arrays:
+      for compression_level in (0, 6):
+        # Blocks of 64 bytes split most arrays into several of them.
+        filename = self._save(array, compression_level=compression_level,
+                              block_size=64, num_threads=3)
+        chunked_checkpoint.verify(filename)
+        loaded = chunked_checkpoint.load_array(filename, num_threads=3)
+        self.assertEqual(loaded.dtype, array.dtype)
+        self.assertEqual(loaded.shape, array.shape)
+        np.testing.assert_array_equal(loaded, array)
+
+  def testNonContiguousArraysRoundTrip(self):
+    array = np.arange(60, dtype=np.int32).reshape(6, 10)[:, ::3]
+    filename = self._save(array, block_size=16)
+    np.testing.assert_array_equal(chunked_checkpoint.load_array(filename),
+                                  array)
+
+  def testCompressionStaysBoundedAheadOfTheWrites(self):
+    compressed = []
+    compress_block = chunked_checkpoint._compress_block
+
+    def recording_compress_block(block, compression_level):
+      compressed.append(block)
+      return compress_block(block, compression_level)
+
+    chunked_checkpoint._compress_block = recording_compress_block
+    self.addCleanup(setattr, chunked_checkpoint, '_compress_block',
+                    compress_block)
+    blocks = [memoryview(bytes(64))] * 100
+    stored = chunked_checkpoint._stored_blocks(blocks, 6, num_threads=2)
+    next(stored)
+    self.assertLessEqual(len(compressed), 4)
+    self.assertEqual(len(list(stored)), 99)
+    self.assertEqual(len(compressed), 100)
+
+  def testUncompressedBlocksAreNotCopied(self):
+    data = memoryview(np.arange(64, dtype=np.uint8))
+    blocks = [data[:32], data[32:]]
+    stored = list(chunked_checkpoint._stored_blocks(blocks, 0, num_threads=2))
+    for block, (stored_block, _) in zip(blocks, stored):
+      self.assertIs(stored_block, block)
+
+  def testTruncatedFilesFailVerification(self):
+    filename = self._save(np.arange(1000, dtype=np.int32), block_size=256)
+    with open(filename, 'rb') as f:
+      data = f.read()
+    for size in (0, 4, len(data) // 2, len(data) - 1):
+      with open(filename, 'wb') as f:
+        f.write(data[:size])
+      with self.assertRaises(tf.errors.DataLossError):
+        chunked_checkpoint.verify(filename)
+      with self.assertRaises(tf.errors.DataLossError):
+        chunked_checkpoint.load_array(filename)
+
+  def testCorruptedBlocksFailTheirChecksum(self):
+    filename = self._save(np.arange(1000, dtype=np.int32),
+                          compression_level=0, block_size=256)
+    with open(filename, 'r+b') as f:
+      f.seek(300)
+      byte = f.read(1)
+      f.seek(300)
+      f.write(bytes([byte[0] ^ 0xff]))
+    # The layout is intact, so only reading the blocks detects the damage.
+    chunked_checkpoint.verify(filename)
+    with self.assertRaises(tf.errors.DataLossError):
+      chunked_checkpoint.load_array(filename)
+
+
+if __name__ == '__main__':
+  tf.test.main()
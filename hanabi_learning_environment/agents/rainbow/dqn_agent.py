@@ -25,20 +25,24 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
+import hashlib
 import math
 import os
 import random
 
 import gin.tf
+from hanabi_learning_environment import instrumentation
 import numpy as np
 import replay_memory
+import resources
 import tensorflow as tf
 
 
 slim = tf.contrib.slim
 
-Transition = collections.namedtuple(
-    'Transition', ['reward', 'observation', 'legal_actions', 'action', 'begin'])
+# Number of moves per player that the episode trajectory buffers initially
+# hold. They grow if a player makes more moves in an episode.
+INITIAL_TRAJECTORY_LENGTH = 64
 
 
 def linearly_decaying_epsilon(decay_period, step, warmup_steps, epsilon):
@@ -76,7 +80,9 @@ def dqn_template(state, num_actions, layer_size=512, num_layers=2):
       factor=1.0 / np.sqrt(3.0), mode='FAN_IN', uniform=True)
 
   net = tf.cast(state, tf.float32)
-  net = tf.squeeze(net, axis=2)
+  # Flatten the stack with the oldest frame first, the same layout produced
+  # by ObservationStacker. For a single frame this is a plain squeeze.
+  net = slim.flatten(tf.transpose(net, [0, 2, 1]))
   for _ in range(num_layers):
     net = slim.fully_connected(net, layer_size,
                                activation_fn=tf.nn.relu)
@@ -112,7 +118,9 @@ class DQNAgent(object):
                    decay=0.95,
                    momentum=0.0,
                    epsilon=1e-6,
-                   centered=True)):
+                   centered=True),
+               action_cache_size=0,
+               updates_per_call=1):
     """Initializes the agent and constructs its graph.
 
     Args:
@@ -124,7 +132,10 @@ class DQNAgent(object):
         n-step update.
       min_replay_history: int, number of stored transitions before training.
       update_period: int, period between DQN updates.
-      stack_size: int, number of observations to use as state.
+      stack_size: int, number of observations to use as state. When larger
+        than 1 the replay memory stores single frames and rebuilds the history
+        at sample time, so the environment should feed unstacked observations
+        (i.e. `create_obs_stacker.history_size = 1`).
       target_update_period: Update period for the target network.
       epsilon_fn: Function expecting 4 parameters: (decay_period, step,
         warmup_steps, epsilon), and which returns the epsilon value used for
@@ -137,6 +148,14 @@ class DQNAgent(object):
       use_staging: bool, when True use a staging area to prefetch the next
         sampling batch.
       optimizer: Optimizer instance used for learning.
+      action_cache_size: int, number of greedy actions kept in an LRU cache
+        keyed by a hash of the stacked frames and the legal actions, or 0 to
+        disable it. The cache is dropped whenever the online weights change,
+        so it mostly pays off in evaluation.
+      updates_per_call: int, number of minibatch updates run by each training
+        session call, each on its own batch of a single staged sample. The
+        agent trains every update_period steps, so it makes
+        updates_per_call / update_period updates per environment step.
     """
 
     tf.logging.info('Creating %s agent with the following parameters:',
@@ -145,6 +164,7 @@ class DQNAgent(object):
     tf.logging.info('\t update_horizon: %f', update_horizon)
     tf.logging.info('\t min_replay_history: %d', min_replay_history)
     tf.logging.info('\t update_period: %d', update_period)
+    tf.logging.info('\t stack_size: %d', stack_size)
     tf.logging.info('\t target_update_period: %d', target_update_period)
     tf.logging.info('\t epsilon_train: %f', epsilon_train)
     tf.logging.info('\t epsilon_eval: %f', epsilon_eval)
@@ -152,6 +172,8 @@ class DQNAgent(object):
     tf.logging.info('\t tf_device: %s', tf_device)
     tf.logging.info('\t use_staging: %s', use_staging)
     tf.logging.info('\t optimizer: %s', optimizer)
+    tf.logging.info('\t action_cache_size: %d', action_cache_size)
+    tf.logging.info('\t updates_per_call: %d', updates_per_call)
 
     # Global variables.
     self.num_actions = num_actions
@@ -167,10 +189,19 @@ class DQNAgent(object):
     self.epsilon_eval = epsilon_eval
     self.epsilon_decay_period = epsilon_decay_period
     self.update_period = update_period
+    self.stack_size = stack_size
     self.eval_mode = False
     self.training_steps = 0
     self.batch_staged = False
     self.optimizer = optimizer
+    self.action_cache_size = action_cache_size
+    self.updates_per_call = updates_per_call
+    # Greedy actions by digest of the state and legal actions, computed with
+    # the online weights of version _action_cache_version. The weights version
+    # changes with every train op and checkpoint restore.
+    self._action_cache = collections.OrderedDict()
+    self._action_cache_version = 0
+    self._weights_version = 0
 
     with tf.device(tf_device):
       # Calling online_convnet will generate a new graph as defined in
@@ -189,25 +220,65 @@ class DQNAgent(object):
       self._q = online_convnet(
           state=self.state_ph, num_actions=self.num_actions)
       self._replay = self._build_replay_memory(use_staging)
-      self._replay_qs = online_convnet(self._replay.states, self.num_actions)
-      self._replay_next_qt = target_convnet(self._replay.next_states,
-                                            self.num_actions)
-      self._train_op = self._build_train_op()
+      self._train_op = self._build_train_ops(online_convnet, target_convnet)
       self._sync_qt_ops = self._build_sync_op()
 
       self._q_argmax = tf.argmax(self._q + self.legal_actions_ph, axis=1)[0]
 
-    # Set up a session and initialize variables.
-    self._sess = tf.Session(
-        '', config=tf.ConfigProto(allow_soft_placement=True))
+      # Greedy actions of a batch of states, e.g. for an inference server.
+      self._batch_state_ph = tf.placeholder(
+          tf.uint8, (None, observation_size, stack_size), name='batch_state_ph')
+      self._batch_legal_actions_ph = tf.placeholder(
+          tf.float32, [None, self.num_actions], name='batch_legal_actions_ph')
+      batch_q = self._q_values(
+          online_convnet(self._batch_state_ph, self.num_actions))
+      self._batch_q_argmax = tf.argmax(
+          batch_q + self._batch_legal_actions_ph, axis=1)
+
+    # Set up a session within the CPU budget configured in gin, and
+    # initialize variables. The calling thread keeps its CPUs, run_experiment
+    # pins it to the environment's.
+    resource_config = resources.ResourceConfig()
+    resource_config.log_layout()
+    self._sess = resource_config.create_session()
+    self._actor_run_options = resource_config.actor_run_options()
     self._init_op = tf.global_variables_initializer()
     self._sess.run(self._init_op)
 
     self._saver = tf.train.Saver(max_to_keep=3)
 
-    # This keeps tracks of the observed transitions during play, for each
-    # player.
-    self.transitions = [[] for _ in range(num_players)]
+    # Columnar buffers keeping track of the observed transitions during play,
+    # for each player. Row t of a player holds its t-th move of the episode
+    # and, once known, the reward received until its next move.
+    self._trajectory_lengths = np.zeros(num_players, dtype=np.int64)
+    self._trajectory_observations = np.zeros(
+        (num_players, INITIAL_TRAJECTORY_LENGTH, observation_size),
+        dtype=np.uint8)
+    self._trajectory_legal_actions = np.zeros(
+        (num_players, INITIAL_TRAJECTORY_LENGTH, num_actions), dtype=np.float32)
+    self._trajectory_actions = np.zeros(
+        (num_players, INITIAL_TRAJECTORY_LENGTH), dtype=np.int32)
+    self._trajectory_rewards = np.zeros(
+        (num_players, INITIAL_TRAJECTORY_LENGTH), dtype=np.float32)
+    self._trajectory_terminals = np.zeros(
+        (num_players, INITIAL_TRAJECTORY_LENGTH), dtype=np.uint8)
+    # The most recent stack_size observations of each player, oldest first.
+    self._player_frames = np.zeros((num_players, observation_size, stack_size),
+                                   dtype=np.uint8)
+    # The uint8 frames self.state was last set to.
+    self._state_frames = self._player_frames[0]
+
+  def _q_values(self, network_output):
+    """Returns the q-values of the actions given the online network's output.
+
+    Args:
+      network_output: tensor returned by the graph template for a batch of
+        states.
+
+    Returns:
+      A tensor of shape (batch_size, num_actions).
+    """
+    return network_output
 
   def _build_replay_memory(self, use_staging):
     """Creates the replay memory used by the agent.
@@ -222,10 +293,35 @@ class DQNAgent(object):
         num_actions=self.num_actions,
         observation_size=self.observation_size,
         batch_size=32,
-        stack_size=1,
+        stack_size=self.stack_size,
         use_staging=use_staging,
         update_horizon=self.update_horizon,
-        gamma=self.gamma)
+        gamma=self.gamma,
+        num_batches=self.updates_per_call)
+
+  def _build_train_ops(self, online_convnet, target_convnet):
+    """Builds the op running `updates_per_call` training steps.
+
+    Each update trains on its own batch of the sampled transitions, and runs
+    after the previous one so that it sees the weights it updated.
+
+    Args:
+      online_convnet: `tf.make_template` of the online network.
+      target_convnet: `tf.make_template` of the target network.
+
+    Returns:
+      train_op: The op of the last update, as returned by `_build_train_op`.
+    """
+    train_op = []
+    for index in range(self.updates_per_call):
+      with tf.control_dependencies(tf.nest.flatten(train_op)):
+        if self.updates_per_call > 1:
+          self._replay.select_batch(index)
+        self._replay_qs = online_convnet(self._replay.states, self.num_actions)
+        self._replay_next_qt = target_convnet(self._replay.next_states,
+                                              self.num_actions)
+        train_op = self._build_train_op()
+    return train_op
 
   def _build_target_q_op(self):
     """Build an op to be used as a target for the Q-value.
@@ -294,6 +390,7 @@ class DQNAgent(object):
     """
     self._train_step()
 
+    self._update_state(current_player, observation, begin=True)
     self.action = self._select_action(observation, legal_actions)
     self._record_transition(current_player, 0, observation, legal_actions,
                             self.action, begin=True)
@@ -316,6 +413,7 @@ class DQNAgent(object):
     """
     self._train_step()
 
+    self._update_state(current_player, observation)
     self.action = self._select_action(observation, legal_actions)
     self._record_transition(current_player, reward, observation, legal_actions,
                             self.action)
@@ -349,11 +447,30 @@ class DQNAgent(object):
       action: int, the selected action.
       begin: bool, if True, this is the beginning of an episode.
     """
-    self.transitions[current_player].append(
-        Transition(reward, np.array(observation, dtype=np.uint8, copy=True),
-                   np.array(legal_actions, dtype=np.float32, copy=True),
-                   action, begin))
-
+    index = self._trajectory_lengths[current_player]
+    if index == self._trajectory_actions.shape[1]:
+      self._grow_trajectories()
+    if index > 0 and not begin:
+      # The reward received since the player's last move completes the
+      # previous transition.
+      self._trajectory_rewards[current_player, index - 1] = reward
+    self._trajectory_observations[current_player, index] = observation
+    self._trajectory_legal_actions[current_player, index] = legal_actions
+    self._trajectory_actions[current_player, index] = action
+    self._trajectory_lengths[current_player] = index + 1
+
+  def _grow_trajectories(self):
+    """Doubles the number of moves the trajectory buffers can hold."""
+    for name in ('_trajectory_observations', '_trajectory_legal_actions',
+                 '_trajectory_actions', '_trajectory_rewards',
+                 '_trajectory_terminals'):
+      array = self.__dict__[name]
+      grown = np.zeros((array.shape[0], 2 * array.shape[1]) + array.shape[2:],
+                       dtype=array.dtype)
+      grown[:, :array.shape[1]] = array
+      self.__dict__[name] = grown
+
+  @instrumentation.timed('agent/post_transitions')
   def _post_transitions(self, terminal_rewards):
     """Posts this episode to the replay memory.
 
@@ -364,29 +481,54 @@ class DQNAgent(object):
     """
     # We store each player's episode consecutively in the replay memory.
     for player in range(self.num_players):
-      num_transitions = len(self.transitions[player])
-
-      for index, transition in enumerate(self.transitions[player]):
-        # Add: o_t, l_t, a_t, r_{t+1}, term_{t+1}
-        final_transition = index == num_transitions - 1
-        if final_transition:
-          reward = terminal_rewards[player]
-        else:
-          reward = self.transitions[player][index + 1].reward
-
-        self._store_transition(transition.observation, transition.action,
-                               reward, final_transition,
-                               transition.legal_actions)
-
-      # Now that this episode has been stored, drop it from the transitions
-      # buffer.
-      self.transitions[player] = []
+      length = self._trajectory_lengths[player]
+      if not length:
+        continue
+      # Add: o_t, l_t, a_t, r_{t+1}, term_{t+1}
+      self._trajectory_rewards[player, length - 1] = terminal_rewards[player]
+      self._trajectory_terminals[player, length - 1] = 1
+      if not self.eval_mode:
+        with self._replay.lock:
+          self._replay.memory.add_batch(
+              self._trajectory_observations[player, :length],
+              self._trajectory_actions[player, :length],
+              self._trajectory_rewards[player, :length],
+              self._trajectory_terminals[player, :length],
+              self._trajectory_legal_actions[player, :length])
+
+      # Now that this episode has been stored, drop it from the trajectory
+      # buffers.
+      self._trajectory_terminals[player, length - 1] = 0
+      self._trajectory_lengths[player] = 0
+
+  def _update_state(self, current_player, observation, begin=False):
+    """Pushes the player's latest observation onto its frame ring.
+
+    The agent's state is then set to that player's stacked frames, so it
+    matches the stacks the replay memory rebuilds at sample time.
 
+    Args:
+      current_player: int, the player whose turn it is.
+      observation: `np.array`, the player's latest observation.
+      begin: bool, if True, this is the first move of the episode and the
+        frames of every player are cleared, as the replay memory pads each
+        player's episode with zeros.
+    """
+    if begin:
+      self._player_frames.fill(0)
+    frames = self._player_frames[current_player]
+    frames[:, :-1] = frames[:, 1:]
+    frames[:, -1] = observation
+    self.state[0] = frames
+    self._state_frames = frames
+
+  @instrumentation.timed('agent/select_action')
   def _select_action(self, observation, legal_actions):
     """Select an action from the set of allowed actions.
 
     Chooses an action randomly with probability self._calculate_epsilon(), and
-    will otherwise choose greedily from the current q-value estimates.
+    will otherwise choose greedily from the current q-value estimates, using
+    the state set by `_update_state`.
 
     Args:
       observation: `np.array`, the current observation.
@@ -406,17 +548,58 @@ class DQNAgent(object):
       # Choose a random action with probability epsilon.
       legal_action_indices = np.where(legal_actions == 0.0)
       return np.random.choice(legal_action_indices[0])
+    elif self.action_cache_size:
+      return self._cached_greedy_action(legal_actions)
     else:
-      # Convert observation into a batch-based format.
-      self.state[0, :, 0] = observation
-
-      # Choose the action maximizing the q function for the current state.
-      action = self._sess.run(self._q_argmax,
-                              {self.state_ph: self.state,
-                               self.legal_actions_ph: legal_actions})
-      assert legal_actions[action] == 0.0, 'Expected legal action.'
-      return action
+      return self._greedy_action(legal_actions)
+
+  def _greedy_action(self, legal_actions):
+    """Returns the legal action maximizing the q function for the state."""
+    action = self._sess.run(self._q_argmax,
+                            {self.state_ph: self.state,
+                             self.legal_actions_ph: legal_actions},
+                            options=self._actor_run_options)
+    assert legal_actions[action] == 0.0, 'Expected legal action.'
+    return action
+
+  def greedy_actions(self, states, legal_actions):
+    """Returns the greedy legal actions of a batch of states.
 
+    Args:
+      states: `np.array` of uint8 of shape (batch_size, observation_size,
+        stack_size), with the oldest frame first.
+      legal_actions: `np.array` of shape (batch_size, num_actions), with 0 for
+        the legal actions and -inf for the others.
+
+    Returns:
+      `np.array` of int64 of shape (batch_size,).
+    """
+    return self._sess.run(self._batch_q_argmax,
+                          {self._batch_state_ph: states,
+                           self._batch_legal_actions_ph: legal_actions},
+                          options=self._actor_run_options)
+
+  def _cached_greedy_action(self, legal_actions):
+    """Returns `_greedy_action`, looked up in the action cache first."""
+    if self._action_cache_version != self._weights_version:
+      self._action_cache.clear()
+      self._action_cache_version = self._weights_version
+    digest = hashlib.blake2b(self._state_frames.tobytes(), digest_size=16)
+    digest.update(np.asarray(legal_actions, dtype=np.float32).tobytes())
+    key = digest.digest()
+    action = self._action_cache.get(key)
+    if action is not None:
+      self._action_cache.move_to_end(key)
+      instrumentation.increment('agent/action_cache_hits')
+      return action
+    instrumentation.increment('agent/action_cache_misses')
+    action = self._greedy_action(legal_actions)
+    self._action_cache[key] = action
+    if len(self._action_cache) > self.action_cache_size:
+      self._action_cache.popitem(last=False)
+    return action
+
+  @instrumentation.timed('agent/train_step')
   def _train_step(self):
     """Runs a single training step.
 
@@ -433,40 +616,30 @@ class DQNAgent(object):
     # Run a training op.
     if (self._replay.memory.add_count >= self.min_replay_history and
         not self.batch_staged):
-      self._sess.run(self._replay.prefetch_batch)
+      self._replay.start_prefetching(self._sess)
       self.batch_staged = True
     if (self._replay.memory.add_count > self.min_replay_history and
         self.training_steps % self.update_period == 0):
-      self._sess.run([self._train_op, self._replay.prefetch_batch])
+      self._run_train_op()
+      self._weights_version += 1
+      instrumentation.increment('agent/train_ops')
     # Sync weights.
     if self.training_steps % self.target_update_period == 0:
       self._sess.run(self._sync_qt_ops)
+      instrumentation.increment('agent/target_syncs')
     self.training_steps += 1
 
-  def _store_transition(self, observation, action, reward, is_terminal,
-                        legal_actions):
-    """Stores a transition during training mode.
+  def _run_train_op(self):
+    """Runs the train op, along with the prefetching of the next batch."""
+    self._sess.run([self._train_op, self._replay.prefetch_batch])
 
-    Executes a tf session and executes replay memory ops in order to store the
-    following tuple in the replay buffer (last_observation, action, reward,
-    is_terminal).
+  def stop_prefetching(self):
+    """Stops the thread prefetching replay batches, if any.
 
-    Args:
-      observation: `np.array`, observation.
-      action: int, the action taken.
-      reward: float, the reward.
-      is_terminal: bool, indicating if the current state is a terminal state.
-      legal_actions: Legal actions from the current state.
+    The prefetch queue is closed for good, so the agent cannot be trained
+    afterwards.
     """
-    if not self.eval_mode:
-      self._sess.run(
-          self._replay.add_transition_op, {
-              self._replay.add_obs_ph: observation,
-              self._replay.add_action_ph: action,
-              self._replay.add_reward_ph: reward,
-              self._replay.add_terminal_ph: is_terminal,
-              self._replay.add_legal_actions_ph: legal_actions
-          })
+    self._replay.stop_prefetching(self._sess)
 
   def bundle_and_checkpoint(self, checkpoint_dir, iteration_number):
     """Returns a self-contained bundle of the agent's state.
@@ -490,11 +663,39 @@ class DQNAgent(object):
         os.path.join(checkpoint_dir, 'tf_ckpt'),
         global_step=iteration_number)
     self._replay.save(checkpoint_dir, iteration_number)
+    return self._bundle_dictionary()
+
+  def bundle_and_snapshot(self, checkpoint_dir, iteration_number):
+    """Returns a bundle of the agent's state and a deferred replay writer.
+
+    Like `bundle_and_checkpoint`, but the replay memory is only copied so that
+    its files can be written later, e.g. from a background thread. The
+    TensorFlow checkpoint is small and is still saved immediately.
+
+    Args:
+      checkpoint_dir: str, directory where TensorFlow objects will be saved.
+      iteration_number: int, iteration number for naming the checkpoint file.
+
+    Returns:
+      A tuple (bundle_dictionary, write_replay), where write_replay is a
+        function writing the replay memory's checkpoint files. Both are None
+        if the checkpoint directory does not exist.
+    """
+    if not tf.gfile.Exists(checkpoint_dir):
+      return None, None
+    self._saver.save(
+        self._sess,
+        os.path.join(checkpoint_dir, 'tf_ckpt'),
+        global_step=iteration_number)
+    write_replay = self._replay.snapshot(checkpoint_dir, iteration_number)
+    return self._bundle_dictionary(), write_replay
+
+  def _bundle_dictionary(self):
+    """Returns the agent's non-TensorFlow objects to checkpoint."""
     bundle_dictionary = {}
-    bundle_dictionary['state'] = self.state
+    bundle_dictionary['state'] = np.copy(self.state)
     bundle_dictionary['eval_mode'] = self.eval_mode
     bundle_dictionary['training_steps'] = self.training_steps
-    bundle_dictionary['batch_staged'] = self.batch_staged
     return bundle_dictionary
 
   def unbundle(self, checkpoint_dir, iteration_number, bundle_dictionary):
@@ -522,5 +723,14 @@ class DQNAgent(object):
     for key in self.__dict__:
       if key in bundle_dictionary:
         self.__dict__[key] = bundle_dictionary[key]
-    self._saver.restore(self._sess, tf.train.latest_checkpoint(checkpoint_dir))
+    # Nothing is staged in a new session, and older bundles may say otherwise.
+    self.batch_staged = False
+    # Restore the weights saved with this iteration. A newer TensorFlow
+    # checkpoint may exist if a later checkpoint was left incomplete.
+    tf_checkpoint = os.path.join(checkpoint_dir,
+                                 'tf_ckpt-{}'.format(iteration_number))
+    if not tf.train.checkpoint_exists(tf_checkpoint):
+      tf_checkpoint = tf.train.latest_checkpoint(checkpoint_dir)
+    self._saver.restore(self._sess, tf_checkpoint)
+    self._weights_version += 1
     return True
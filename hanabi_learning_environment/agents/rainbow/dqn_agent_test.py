@@ -0,0 +1,125 @@
+# coding=utf-8
+"""Tests for dqn_agent."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+
+import dqn_agent
+import gin.tf
+import numpy as np
+import tensorflow as tf
+
+NUM_ACTIONS = 4
+OBSERVATION_SIZE = 8
+NUM_PLAYERS = 2
+
+
+def play_episode(agent, num_moves=6):
+  """Plays an episode of random observations, alternating the players."""
+  legal_actions = np.zeros(NUM_ACTIONS, dtype=np.float32)
+  observation = np.random.randint(0, 2, OBSERVATION_SIZE)
+  agent.begin_episode(0, legal_actions, observation)
+  for move in range(1, num_moves):
+    observation = np.random.randint(0, 2, OBSERVATION_SIZE)
+    agent.step(0.0, move % NUM_PLAYERS, legal_actions, observation)
+  agent.end_episode(np.ones(NUM_PLAYERS))
+
+
+class DQNAgentTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(DQNAgentTest, self).setUp()
+    tf.reset_default_graph()
+    gin.clear_config()
+
+  def tearDown(self):
+    gin.clear_config()
+    super(DQNAgentTest, self).tearDown()
+
+  def _create_agent(self):
+    return dqn_agent.DQNAgent(
+        num_actions=NUM_ACTIONS,
+        observation_size=OBSERVATION_SIZE,
+        num_players=NUM_PLAYERS,
+        min_replay_history=8,
+        update_period=1,
+        target_update_period=4)
+
+  def _assert_trains(self, agent):
+    """Asserts a train step runs instead of waiting for a batch forever."""
+    step = threading.Thread(target=agent._train_step)
+    step.daemon = True
+    step.start()
+    step.join(60)
+    self.assertFalse(step.is_alive(), 'The train step waits for a batch.')
+
+  def testActingStatesMatchTheReplayStacks(self):
+    stack_size = 3
+    agent = dqn_agent.DQNAgent(
+        num_actions=NUM_ACTIONS,
+        observation_size=OBSERVATION_SIZE,
+        num_players=NUM_PLAYERS,
+        stack_size=stack_size,
+        min_replay_history=1000)
+    memory = agent._replay.memory
+    legal_actions = np.zeros(NUM_ACTIONS, dtype=np.float32)
+    # The first episode leaves different frames in each player's ring.
+    for num_moves in (7, 6):
+      states = [[] for _ in range(NUM_PLAYERS)]
+      start = int(memory.add_count)
+      for move in range(num_moves):
+        player = move % NUM_PLAYERS
+        observation = np.random.randint(0, 2, OBSERVATION_SIZE)
+        if move == 0:
+          agent.begin_episode(player, legal_actions, observation)
+        else:
+          agent.step(0.0, player, legal_actions, observation)
+        states[player].append(agent.state[0].copy())
+      agent.end_episode(np.ones(NUM_PLAYERS))
+      # Each player's episode is posted in turn, after its padding frames.
+      index = start
+      for player_states in states:
+        index += stack_size - 1
+        for state in player_states:
+          np.testing.assert_array_equal(state,
+                                        memory.get_observation_stack(index))
+          index += 1
+
+  def testResumeWithPrefetchQueueRestartsTheProducer(self):
+    gin.bind_parameter('WrappedReplayMemory.prefetch_depth', 2)
+    agent = self._create_agent()
+    for _ in range(4):
+      play_episode(agent)
+    self.assertTrue(agent.batch_staged)
+    checkpoint_dir = self.get_temp_dir()
+    bundle = agent.bundle_and_checkpoint(checkpoint_dir, 0)
+    self.assertNotIn('batch_staged', bundle)
+    agent.stop_prefetching()
+
+    tf.reset_default_graph()
+    resumed = self._create_agent()
+    # Bundles written before batch_staged was dropped still hold it.
+    bundle['batch_staged'] = True
+    self.assertTrue(resumed.unbundle(checkpoint_dir, 0, bundle))
+    self.assertFalse(resumed.batch_staged)
+    self._assert_trains(resumed)
+    self.assertTrue(resumed.batch_staged)
+    resumed.stop_prefetching()
+
+  def testStartPrefetchingKeepsTheRunningProducer(self):
+    gin.bind_parameter('WrappedReplayMemory.prefetch_depth', 2)
+    agent = self._create_agent()
+    for _ in range(4):
+      play_episode(agent)
+    producer = agent._replay._producer
+    agent._replay.start_prefetching(agent._sess)
+    self.assertIs(agent._replay._producer, producer)
+    agent.stop_prefetching()
+    self.assertIsNone(agent._replay._producer)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,246 @@
+# coding=utf-8
+# Copyright 2018 The Dopamine Authors and Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+#
+# This file is a fork of the original Dopamine code incorporating changes for
+# the multiplayer setting and the Hanabi Learning Environment.
+#
+"""Environment-side helpers of the experiment loop.
+
+These only depend on the Hanabi environment, so that processes which only step
+environments or run the convention encoders do not import TensorFlow. They are
+also available from run_experiment.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import gin
+from hanabi_learning_environment import rl_env
+import numpy as np
+
+
+class ObservationStacker(object):
+  """Class for stacking agent observations.
+
+  The last history_size frames of each player are kept in a preallocated uint8
+  ring of 2 * history_size rows, in which every frame is written twice, at
+  positions i and i + history_size. The stack of the last history_size frames,
+  oldest first, is then always a contiguous slice of the ring, so it can be
+  returned as a view without copying. Several games can be stacked at once,
+  e.g. for a vectorized environment.
+  """
+
+  def __init__(self, history_size, observation_size, num_players, num_games=1):
+    """Initializer for observation stacker.
+
+    Args:
+      history_size: int, number of time steps to stack.
+      observation_size: int, size of observation vector on one time step.
+      num_players: int, number of players.
+      num_games: int, number of games played in parallel.
+    """
+    self._history_size = history_size
+    self._observation_size = observation_size
+    self._num_players = num_players
+    self._num_games = num_games
+    self._frames = np.zeros(
+        (num_games, num_players, 2 * history_size, observation_size),
+        dtype=np.uint8)
+    # Ring position of the oldest frame in each stack.
+    self._start = np.zeros((num_games, num_players), dtype=np.int64)
+    self._history_offsets = np.arange(history_size)
+
+  def add_observation(self, observation, current_player, game=0):
+    """Adds observation for the current player.
+
+    Args:
+      observation: observation vector for current player.
+      current_player: int, current player id.
+      game: int, index of the game the observation belongs to.
+    """
+    start = self._start[game, current_player]
+    frames = self._frames[game, current_player]
+    frames[start] = observation
+    frames[start + self._history_size] = observation
+    self._start[game, current_player] = (start + 1) % self._history_size
+
+  def get_observation_stack(self, current_player, game=0, out=None):
+    """Returns the stacked observation for current player.
+
+    Args:
+      current_player: int, current player id.
+      game: int, index of the game.
+      out: `np.array`, if given the stack is copied into it and returned.
+
+    Returns:
+      A uint8 vector of history_size * observation_size values, oldest frame
+        first. Unless out is given, it is a view that is only valid until the
+        next observation is added for this player.
+    """
+    start = self._start[game, current_player]
+    stack = self._frames[game, current_player,
+                         start:start + self._history_size].reshape(-1)
+    if out is None:
+      return stack
+    np.copyto(out, stack)
+    return out
+
+  def add_observations(self, observations, current_players):
+    """Adds one observation per game.
+
+    Args:
+      observations: array of shape (num_games, observation_size).
+      current_players: int array of shape (num_games,), the player each
+        observation belongs to.
+    """
+    games = np.arange(self._num_games)
+    start = self._start[games, current_players]
+    self._frames[games, current_players, start] = observations
+    self._frames[games, current_players, start + self._history_size] = (
+        observations)
+    self._start[games, current_players] = (start + 1) % self._history_size
+
+  def get_observation_stacks(self, current_players, out=None):
+    """Returns the stacked observations of one player per game.
+
+    Args:
+      current_players: int array of shape (num_games,), the player whose
+        stack is returned for each game.
+      out: `np.array` of shape (num_games, history_size * observation_size),
+        if given the stacks are copied into it.
+
+    Returns:
+      A uint8 array of shape (num_games, history_size * observation_size).
+    """
+    games = np.arange(self._num_games)
+    rows = (self._start[games, current_players][:, None] +
+            self._history_offsets)
+    stacks = self._frames[games[:, None], np.asarray(current_players)[:, None],
+                          rows]
+    stacks = stacks.reshape(self._num_games, -1)
+    if out is None:
+      return stacks
+    np.copyto(out, stacks)
+    return out
+
+  def reset_stack(self, game=None):
+    """Resets the observation stacks to all zero.
+
+    Args:
+      game: int, if not None only the stacks of this game are reset.
+    """
+    if game is None:
+      self._frames.fill(0)
+      self._start.fill(0)
+    else:
+      self._frames[game].fill(0)
+      self._start[game].fill(0)
+
+  @property
+  def history_size(self):
+    """Returns number of steps to stack."""
+    return self._history_size
+
+  def observation_size(self):
+    """Returns the size of the observation vector after history stacking."""
+    return self._observation_size * self._history_size
+
+
+@gin.configurable
+def create_environment(game_type='Hanabi-Full', num_players=2):
+  """Creates the Hanabi environment.
+
+  Args:
+    game_type: Type of game to play. Currently the following are supported:
+      Hanabi-Full: Regular game.
+      Hanabi-Small: The small version of Hanabi, with 2 cards and 2 colours.
+    num_players: Int, number of players to play this game.
+
+  Returns:
+    A Hanabi environment.
+  """
+  return rl_env.make(
+      environment_name=game_type, num_players=num_players, pyhanabi_path=None)
+
+
+@gin.configurable
+def create_obs_stacker(environment, history_size=4):
+  """Creates an observation stacker.
+
+  Args:
+    environment: environment object.
+    history_size: int, number of steps to stack.
+
+  Returns:
+    An observation stacker object.
+  """
+
+  return ObservationStacker(history_size,
+                            environment.vectorized_observation_shape()[0],
+                            environment.players)
+
+
+def format_legal_moves(legal_moves, action_dim):
+  """Returns formatted legal moves.
+
+  This function takes a list of actions and converts it into a fixed size vector
+  of size action_dim. If an action is legal, its position is set to 0 and -Inf
+  otherwise.
+  Ex: legal_moves = [0, 1, 3], action_dim = 5
+      returns [0, 0, -Inf, 0, -Inf]
+
+  Args:
+    legal_moves: list of legal actions.
+    action_dim: int, number of actions.
+
+  Returns:
+    a vector of size action_dim.
+  """
+  new_legal_moves = np.full(action_dim, -float('inf'))
+  if legal_moves:
+    new_legal_moves[legal_moves] = 0
+  return new_legal_moves
+
+
+def parse_observations(observations, num_actions, obs_stacker):
+  """Deconstructs the rich observation data into relevant components.
+
+  Args:
+    observations: dict, containing full observations.
+    num_actions: int, The number of available actions.
+    obs_stacker: Observation stacker object.
+
+  Returns:
+    current_player: int, Whose turn it is.
+    legal_moves: `np.array` of floats, of length num_actions, whose elements
+      are -inf for indices corresponding to illegal moves and 0, for those
+      corresponding to legal moves.
+    observation_vector: Vectorized observation for the current player.
+  """
+  current_player = observations['current_player']
+  current_player_observation = (
+      observations['player_observations'][current_player])
+
+  legal_moves = current_player_observation['legal_moves_as_int']
+  legal_moves = format_legal_moves(legal_moves, num_actions)
+
+  observation_vector = current_player_observation['vectorized']
+  obs_stacker.add_observation(observation_vector, current_player)
+  observation_vector = obs_stacker.get_observation_stack(current_player)
+
+  return current_player, legal_moves, observation_vector
@@ -10,6 +10,7 @@
 #   basic conventions defined by H-group and make sure you do their 'quizez' to understand some of the more niche and tricky parts of each convention.
 
 import numpy as np
+from hanabi_learning_environment import instrumentation
 from hanabi_learning_environment import rl_env
 
 def format_legal_moves(legal_moves, action_dim):
@@ -66,6 +67,7 @@ class simple_official_rules_based_encoder_2p():
     def reset(self):
         self.previous_action = 0     
 
+    @instrumentation.timed("conventions/encode_action")
     def encode_action(self, agent_action, env):   
         # This function is the output layer after an agent chooses a convention and before the action is sent to the environment. 
         # It translates the chosen action/convention into an environment action based on the convention principles.
@@ -263,6 +265,7 @@ class simple_official_rules_based_encoder_2p():
 
         return environment_action
     
+    @instrumentation.timed("conventions/available_conventions")
     def available_conventions(self, env):
         # This function is at the input of the network to extract the current available conventions based on the current observation of a player. 
         # It also incorporates action masking and formatting to allow for the Dopamine agent to interpret it correctly.
@@ -419,6 +422,7 @@ class simple_official_rules_based_encoder_2p():
 
         return legal_conventions
     
+    @instrumentation.timed("conventions/make_env_usable")
     def make_env_usable(self, env):
         # This function extracts all the needed information from the current state and player observation to determine which conventions are available.
         # It receives the entire env as input to extract all the needed game features, but never gives an agent more information than it already
@@ -572,6 +576,7 @@ class simple_official_rules_based_encoder():
         self.previous_action = 0     
         self.previous_actions = [0] * (self.number_of_players-1)  #for more than 2p
 
+    @instrumentation.timed("conventions/encode_action")
     def encode_action(self, agent_action, env): 
         # This function is the output layer after an agent chooses a convention and before the action is sent to the environment. 
         # It translates the chosen action/convention into an environment action based on the convention principles. 
@@ -876,6 +881,7 @@ class simple_official_rules_based_encoder():
 
         return environment_action
     
+    @instrumentation.timed("conventions/available_conventions")
     def available_conventions(self, env):
         # This function is at the input of the network to extract the current available conventions based on the current observation of a player. 
         # It also incorporates action masking and formatting to allow for the Dopamine agent to interpret it correctly.
@@ -1206,6 +1212,7 @@ class simple_official_rules_based_encoder():
 
         return legal_conventions
     
+    @instrumentation.timed("conventions/make_env_usable")
     def make_env_usable(self, env):         #Extracts the needed info from env and translates it into my style of card representation
         # This function extracts all the needed information from the current state and player observation to determine which conventions are available.
         # It receives the entire env as input to extract all the needed game features, but never gives an agent more information than it already
@@ -0,0 +1,281 @@
+# coding=utf-8
+"""Serves the greedy policy of a trained agent to many local game processes.
+
+`InferenceServer` listens on a Unix socket. It gathers the (state, legal
+actions) requests of its clients into batches of up to `max_batch_size`
+requests, waiting at most `max_latency` seconds after the first request of a
+batch, and answers each batch with a single forward pass of the agent. The
+model is thus kept once in memory while the clients share its throughput.
+
+`InferenceClient` is an `rl_env.Agent` forwarding its `act` calls to a server.
+It only depends on numpy and the environment, so game processes do not import
+TensorFlow. A server for a checkpoint is started with:
+
+  python inference_server.py --gin_files configs/hanabi_rainbow.gin \
+      --checkpoint_dir /path/to/base_dir/checkpoints \
+      --address /tmp/hanabi_inference.sock
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+from multiprocessing import connection
+import struct
+import threading
+import time
+
+from environment_utils import format_legal_moves
+from environment_utils import ObservationStacker
+from hanabi_learning_environment import instrumentation
+from hanabi_learning_environment import rl_env
+import numpy as np
+
+# Actions are answered as little-endian int32.
+_ACTION = struct.Struct('<i')
+
+
+class InferenceServer(object):
+  """Answers the action requests of clients in batches."""
+
+  def __init__(self, agent, address, max_batch_size=64, max_latency=0.001):
+    """Initializes the server and starts listening.
+
+    Args:
+      agent: `DQNAgent` or `RainbowAgent` whose greedy actions are served.
+      address: str, path of the Unix socket.
+      max_batch_size: int, maximum number of requests in a forward pass.
+      max_latency: float, maximum number of seconds a request waits for
+        others to be batched with it.
+    """
+    self._agent = agent
+    self._max_batch_size = max_batch_size
+    self._max_latency = max_latency
+    self._state_shape = (agent.observation_size, agent.stack_size)
+    self._state_bytes = agent.observation_size * agent.stack_size
+    self._listener = connection.Listener(address, family='AF_UNIX')
+    self._connections = []
+    self._new_connections = []
+    self._lock = threading.Lock()
+    self._closed = threading.Event()
+    self._accept_thread = threading.Thread(target=self._accept,
+                                           name='inference_accept')
+    self._accept_thread.daemon = True
+    self._accept_thread.start()
+
+  @property
+  def address(self):
+    return self._listener.address
+
+  def _accept(self):
+    """Accepts clients and sends them the shapes of their requests."""
+    spec = (self._agent.observation_size, self._agent.stack_size,
+            self._agent.num_actions)
+    while not self._closed.is_set():
+      try:
+        client = self._listener.accept()
+        client.send(spec)
+      except (OSError, EOFError):
+        continue
+      with self._lock:
+        self._new_connections.append(client)
+
+  def serve_forever(self):
+    """Answers requests until `close` is called."""
+    while not self._closed.is_set():
+      with self._lock:
+        self._connections.extend(self._new_connections)
+        self._new_connections = []
+      if not self._connections:
+        self._closed.wait(0.01)
+        continue
+      requests = self._collect_batch()
+      if requests:
+        self._answer(requests)
+
+  def _collect_batch(self):
+    """Returns a batch of (connection, message) requests."""
+    requests = []
+    deadline = None
+    while len(requests) < self._max_batch_size:
+      if deadline is None:
+        timeout = 0.01
+      else:
+        timeout = deadline - time.time()
+        if timeout <= 0:
+          break
+      ready = connection.wait(self._connections, timeout)
+      if not ready and deadline is None:
+        break
+      for client in ready:
+        try:
+          requests.append((client, client.recv_bytes()))
+        except (OSError, EOFError):
+          self._drop(client)
+      if requests and deadline is None:
+        deadline = time.time() + self._max_latency
+    return requests
+
+  def _answer(self, requests):
+    """Runs one forward pass for a batch of requests and sends the actions."""
+    states = np.empty((len(requests),) + self._state_shape, dtype=np.uint8)
+    legal_actions = np.empty((len(requests), self._agent.num_actions),
+                             dtype=np.float32)
+    for i, (_, message) in enumerate(requests):
+      states[i] = np.frombuffer(message, np.uint8, self._state_bytes).reshape(
+          self._state_shape)
+      legal_actions[i] = np.frombuffer(message, np.float32,
+                                       offset=self._state_bytes)
+    actions = self._agent.greedy_actions(states, legal_actions)
+    instrumentation.increment('inference/batches')
+    instrumentation.increment('inference/requests', len(requests))
+    for (client, _), action in zip(requests, actions):
+      try:
+        client.send_bytes(_ACTION.pack(action))
+      except (OSError, EOFError):
+        self._drop(client)
+
+  def _drop(self, client):
+    if client in self._connections:
+      self._connections.remove(client)
+    client.close()
+
+  def close(self):
+    """Stops serving and closes the socket and the client connections."""
+    self._closed.set()
+    self._listener.close()
+    with self._lock:
+      self._connections.extend(self._new_connections)
+      self._new_connections = []
+    for client in self._connections:
+      client.close()
+    self._connections = []
+
+
+class InferenceClient(rl_env.Agent):
+  """Agent playing the actions of an `InferenceServer`.
+
+  The client stacks its player's observations like the training loop, with an
+  `ObservationStacker` whose history size is inferred from the agent's
+  observation size, and keeps the agent's last stack_size stacks, so its
+  states match those the served agent was trained on.
+  """
+
+  def __init__(self, config, convention_encoder=None, environment=None):
+    """Connects to a server.
+
+    Args:
+      config: dict, with the `address` of the server's Unix socket.
+      convention_encoder: if the agent was trained on a convention encoder's
+        action space, the encoder, which then gives the legal actions and the
+        moves of the actions.
+      environment: `HanabiEnv` the convention encoder is applied to.
+    """
+    self.config = config
+    self._encoder = convention_encoder
+    self._environment = environment
+    self._connection = connection.Client(config['address'], family='AF_UNIX')
+    observation_size, stack_size, self._num_actions = self._connection.recv()
+    self._frames = np.zeros((observation_size, stack_size), dtype=np.uint8)
+    self._obs_stacker = None
+
+  def reset(self, config):
+    """Forgets the frames of the previous game."""
+    del config  # The server is kept.
+    self._frames[:] = 0
+    if self._obs_stacker is not None:
+      self._obs_stacker.reset_stack()
+
+  def _create_obs_stacker(self, vectorized_size):
+    """Returns a stacker of the observations the agent was trained on.
+
+    Args:
+      vectorized_size: int, size of the environment's vectorized observations.
+
+    Raises:
+      ValueError: If the agent's observation size is not a multiple of
+        vectorized_size.
+    """
+    observation_size = self._frames.shape[0]
+    if observation_size % vectorized_size:
+      raise ValueError(
+          'The agent observes {} values, which is not a history of '
+          'observations of size {}.'.format(observation_size, vectorized_size))
+    return ObservationStacker(observation_size // vectorized_size,
+                              vectorized_size, num_players=1)
+
+  def act(self, observation):
+    """Returns the served agent's move, or None if it is not our turn."""
+    if observation['current_player_offset'] != 0:
+      return None
+    vectorized = observation['vectorized']
+    if self._obs_stacker is None:
+      self._obs_stacker = self._create_obs_stacker(len(vectorized))
+    self._obs_stacker.add_observation(vectorized, 0)
+    # Push the stack, keeping the oldest one first.
+    self._frames[:, :-1] = self._frames[:, 1:]
+    self._frames[:, -1] = self._obs_stacker.get_observation_stack(0)
+    if self._encoder is not None:
+      legal_moves = self._encoder.available_conventions(self._environment)
+    else:
+      legal_moves = observation['legal_moves_as_int']
+    legal_actions = format_legal_moves(legal_moves, self._num_actions)
+    self._connection.send_bytes(
+        self._frames.tobytes() + legal_actions.astype(np.float32).tobytes())
+    action, = _ACTION.unpack(self._connection.recv_bytes())
+    if self._encoder is not None:
+      return self._encoder.encode_action(action, self._environment)
+    return observation['legal_moves'][
+        observation['legal_moves_as_int'].index(action)]
+
+  def close(self):
+    self._connection.close()
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--gin_files', nargs='*', default=[],
+                      help='Gin configuration files of the experiment.')
+  parser.add_argument('--gin_bindings', nargs='*', default=[],
+                      help='Gin bindings overriding the configuration.')
+  parser.add_argument('--checkpoint_dir', required=True,
+                      help='Directory of the TensorFlow checkpoints.')
+  parser.add_argument('--address', default='/tmp/hanabi_inference.sock',
+                      help='Path of the Unix socket.')
+  parser.add_argument('--max_batch_size', type=int, default=64)
+  parser.add_argument('--max_latency', type=float, default=0.001,
+                      help='Seconds a request waits to be batched.')
+  args = parser.parse_args()
+
+  # pylint: disable=g-import-not-at-top
+  from hanabi_conventions_encoder import simple_official_rules_based_encoder
+  import run_experiment
+  import tensorflow as tf
+  # pylint: enable=g-import-not-at-top
+  checkpoint = tf.train.latest_checkpoint(args.checkpoint_dir)
+  if checkpoint is None:
+    parser.error('no TensorFlow checkpoint in {}'.format(args.checkpoint_dir))
+  run_experiment.load_gin_configs(args.gin_files, args.gin_bindings)
+  environment = run_experiment.create_environment()
+  obs_stacker = run_experiment.create_obs_stacker(environment)
+  encoder = simple_official_rules_based_encoder(environment)
+  agent = run_experiment.create_agent(environment, obs_stacker, encoder)
+  agent.eval_mode = True
+  # pylint: disable=protected-access
+  agent._saver.restore(agent._sess, checkpoint)
+  # pylint: enable=protected-access
+
+  server = InferenceServer(agent, args.address, args.max_batch_size,
+                           args.max_latency)
+  tf.logging.info('Serving %s on %s.', args.checkpoint_dir, server.address)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.close()
+
+
+if __name__ == '__main__':
+  main()
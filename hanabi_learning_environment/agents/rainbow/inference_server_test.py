@@ -0,0 +1,104 @@
+# coding=utf-8
+"""Tests for inference_server."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from environment_utils import ObservationStacker
+from hanabi_learning_environment import rl_env
+import inference_server
+import numpy as np
+
+GAME_CONFIG = {'colors': 2, 'ranks': 5, 'players': 2, 'hand_size': 3,
+               'max_information_tokens': 3, 'max_life_tokens': 1, 'seed': 1}
+
+
+class FirstLegalActionAgent(object):
+  """Stands for a trained agent, answering the first legal actions."""
+
+  def __init__(self, observation_size, stack_size, num_actions):
+    self.observation_size = observation_size
+    self.stack_size = stack_size
+    self.num_actions = num_actions
+    self.states = []
+
+  def greedy_actions(self, states, legal_actions):
+    self.states.extend(np.copy(states))
+    return np.argmax(legal_actions == 0, axis=1)
+
+
+class InferenceServerTest(unittest.TestCase):
+
+  def setUp(self):
+    self._dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self._dir)
+    self._address = os.path.join(self._dir, 'inference.sock')
+    self._environment = rl_env.HanabiEnv(GAME_CONFIG)
+    self._vectorized_size = (
+        self._environment.vectorized_observation_shape()[0])
+
+  def _serve(self, agent):
+    server = inference_server.InferenceServer(agent, self._address)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.addCleanup(thread.join)
+    self.addCleanup(server.close)
+
+  def testClientStacksObservationsLikeTraining(self):
+    history_size, stack_size = 2, 3
+    agent = FirstLegalActionAgent(history_size * self._vectorized_size,
+                                  stack_size, self._environment.num_moves())
+    self._serve(agent)
+    client = inference_server.InferenceClient({'address': self._address})
+    self.addCleanup(client.close)
+    # The stacks of the training loop, pushed onto the agent's frames.
+    obs_stacker = ObservationStacker(history_size, self._vectorized_size, 1)
+    frames = np.zeros((agent.observation_size, stack_size), dtype=np.uint8)
+    expected_states = []
+    for _ in range(2):
+      observations = self._environment.reset()
+      client.reset(None)
+      obs_stacker.reset_stack()
+      frames[:] = 0
+      done = False
+      while not done:
+        player = observations['current_player']
+        observation = observations['player_observations'][player]
+        if player == 0:
+          move = client.act(observation)
+          self.assertIn(move, observation['legal_moves'])
+          obs_stacker.add_observation(observation['vectorized'], 0)
+          frames[:, :-1] = frames[:, 1:]
+          frames[:, -1] = obs_stacker.get_observation_stack(0)
+          expected_states.append(frames.copy())
+        else:
+          self.assertIsNone(
+              client.act(observations['player_observations'][0]))
+          move = observation['legal_moves'][0]
+        observations, _, done, _ = self._environment.step(move)
+    self.assertEqual(len(agent.states), len(expected_states))
+    for state, expected_state in zip(agent.states, expected_states):
+      np.testing.assert_array_equal(state, expected_state)
+
+  def testClientRejectsAnObservationSizeOfAnotherEnvironment(self):
+    self._serve(FirstLegalActionAgent(self._vectorized_size + 1, 1,
+                                      self._environment.num_moves()))
+    client = inference_server.InferenceClient({'address': self._address})
+    self.addCleanup(client.close)
+    observations = self._environment.reset()
+    player = observations['current_player']
+    observation = observations['player_observations'][player]
+    with self.assertRaises(ValueError):
+      client.act(observation)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,254 @@
+# coding=utf-8
+"""Reports where the memory of a training process goes.
+
+`memory_report` lists the bytes held by the numpy arrays of the replay memory,
+the levels of its sum tree, the agent's trajectory buffers, the observation
+stacker and the logger's in-memory data. The C++ allocations of pyhanabi are
+not measured: only the number of live move and observation wrappers is given,
+as a sign of leaked references. `project_memory` computes the same arrays for
+a configuration from its parameters alone, without allocating them or
+importing TensorFlow, which can also be run from the command line:
+
+  python memory_report.py --replay_capacity 1000000 --num_players 5
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import math
+import sys
+
+from environment_utils import create_environment
+from environment_utils import ObservationStacker
+from hanabi_learning_environment import pyhanabi
+import numpy as np
+
+# The initial number of moves of the agent's trajectory buffers, as in
+# dqn_agent, which is not imported so that projections do not load TensorFlow.
+INITIAL_TRAJECTORY_LENGTH = 64
+
+
+def _array_bytes(obj):
+  """Returns the bytes of each numpy array attribute of an object.
+
+  Memory-mapped arrays live in the page cache rather than in the process heap,
+  so their names are suffixed with ' (memmap)'.
+  """
+  arrays = {}
+  for name, value in sorted(vars(obj).items()):
+    if isinstance(value, np.memmap):
+      arrays[name + ' (memmap)'] = value.nbytes
+    elif isinstance(value, np.ndarray):
+      arrays[name] = value.nbytes
+  return arrays
+
+
+def _deep_size(obj, seen=None):
+  """Estimates the bytes held by a structure of containers and arrays."""
+  if seen is None:
+    seen = set()
+  if id(obj) in seen:
+    return 0
+  seen.add(id(obj))
+  if isinstance(obj, np.ndarray):
+    return obj.nbytes
+  size = sys.getsizeof(obj)
+  if isinstance(obj, dict):
+    size += sum(_deep_size(key, seen) + _deep_size(value, seen)
+                for key, value in obj.items())
+  elif isinstance(obj, (list, tuple, set, frozenset)):
+    size += sum(_deep_size(item, seen) for item in obj)
+  return size
+
+
+def _sum_tree_bytes(replay_capacity):
+  """Returns the bytes of each level of the sum tree of a replay capacity."""
+  tree_depth = int(math.ceil(np.log2(replay_capacity)))
+  itemsize = np.dtype(np.float64).itemsize
+  return {'level_{}'.format(depth): itemsize * 2**depth
+          for depth in range(tree_depth + 1)}
+
+
+def _replay_bytes(replay_capacity, observation_size, num_actions, stack_size,
+                  batch_size, update_horizon, pack_observations,
+                  pack_legal_actions):
+  """Returns the bytes of the arrays of an `OutOfGraphReplayMemory`."""
+  if pack_observations:
+    observation_width = int(math.ceil(observation_size / 8.0))
+  else:
+    observation_width = observation_size
+  if pack_legal_actions:
+    legal_actions_width = int(math.ceil(num_actions / 8.0))
+  else:
+    legal_actions_width = num_actions * np.dtype(np.float32).itemsize
+  state_batch = batch_size * observation_size * stack_size
+  return {
+      'observations': replay_capacity * observation_width,
+      'actions': replay_capacity * np.dtype(np.int32).itemsize,
+      'rewards': replay_capacity * np.dtype(np.float32).itemsize,
+      'terminals': replay_capacity,
+      'legal_actions': replay_capacity * legal_actions_width,
+      '_state_batch': state_batch,
+      '_next_state_batch': state_batch,
+      '_cumulative_discount_vector': (
+          update_horizon * np.dtype(np.float32).itemsize),
+      'add_count': np.dtype(np.int64).itemsize,
+      'invalid_range': stack_size * np.dtype(np.float64).itemsize,
+  }
+
+
+def _total(report):
+  """Returns the sum of the byte counts of a nested report."""
+  if isinstance(report, dict):
+    return sum(_total(value) for key, value in report.items()
+               if key != 'pyhanabi_live_objects')
+  return report
+
+
+def memory_report(agent=None, obs_stacker=None, experiment_logger=None):
+  """Returns the bytes held by the main structures of a training process.
+
+  Args:
+    agent: `DQNAgent` or `RainbowAgent`, whose replay memory and trajectory
+      buffers are reported.
+    obs_stacker: `ObservationStacker`.
+    experiment_logger: `Logger` or `StreamingLogger`, whose entries not yet
+      written to disk are reported.
+
+  Returns:
+    A nested dict of byte counts, with the sum of the byte counts under
+    `total_bytes`. The live pyhanabi object counts are under
+    `pyhanabi_live_objects`; their native bytes are not included.
+  """
+  report = {}
+  if agent is not None:
+    memory = agent._replay.memory  # pylint: disable=protected-access
+    report['replay'] = _array_bytes(memory)
+    if hasattr(memory, 'sum_tree'):
+      levels = memory.sum_tree.nodes
+      report['sum_tree'] = {'level_{}'.format(depth): level.nbytes
+                            for depth, level in enumerate(levels)}
+    report['agent'] = _array_bytes(agent)
+  if obs_stacker is not None:
+    report['obs_stacker'] = _array_bytes(obs_stacker)
+  if experiment_logger is not None:
+    # The dopamine Logger keeps all the statistics so far in `data`, while
+    # the StreamingLogger only keeps those of the current iteration.
+    data = getattr(experiment_logger, 'data', None)
+    if data is None:
+      data = experiment_logger._pending  # pylint: disable=protected-access
+    report['logger'] = {'data': _deep_size(data)}
+  report['pyhanabi_live_objects'] = pyhanabi.live_object_counts()
+  report['total_bytes'] = _total(report)
+  return report
+
+
+def project_memory(replay_capacity, observation_size, num_actions,
+                   num_players, stack_size=1, history_size=1, batch_size=32,
+                   update_horizon=1, pack_observations=False,
+                   pack_legal_actions=False, prioritized=True):
+  """Computes `memory_report` for a configuration, without allocating it.
+
+  Args:
+    replay_capacity: int, capacity of the replay memory.
+    observation_size: int, size of a single environment observation.
+    num_actions: int, number of actions of the agent.
+    num_players: int, number of players.
+    stack_size: int, the agent's stack size.
+    history_size: int, history size of the observation stacker.
+    batch_size: int, replay batch size.
+    update_horizon: int, the agent's update horizon.
+    pack_observations: bool, as in `OutOfGraphReplayMemory`.
+    pack_legal_actions: bool, as in `OutOfGraphReplayMemory`.
+    prioritized: bool, whether the replay memory is prioritized (Rainbow).
+
+  Returns:
+    A nested dict of byte counts, as returned by `memory_report`. The
+    trajectory buffers are given at their initial length, which doubles
+    whenever an episode has more moves.
+  """
+  stacked_size = observation_size * history_size
+  report = {'replay': _replay_bytes(
+      replay_capacity, stacked_size, num_actions, stack_size, batch_size,
+      update_horizon, pack_observations, pack_legal_actions)}
+  if prioritized:
+    report['sum_tree'] = _sum_tree_bytes(replay_capacity)
+  rows = num_players * INITIAL_TRAJECTORY_LENGTH
+  report['agent'] = {
+      '_trajectory_observations': rows * stacked_size,
+      '_trajectory_legal_actions': rows * num_actions * 4,
+      '_trajectory_actions': rows * 4,
+      '_trajectory_rewards': rows * 4,
+      '_trajectory_terminals': rows,
+      '_trajectory_lengths': num_players * 8,
+      '_player_frames': num_players * stacked_size * stack_size,
+      'state': stacked_size * stack_size * 8,
+  }
+  report['obs_stacker'] = _array_bytes(
+      ObservationStacker(history_size, observation_size, num_players))
+  report['total_bytes'] = _total(report)
+  return report
+
+
+def flatten(report, prefix='memory'):
+  """Flattens a report to `prefix/section/name` keys, e.g. for logging."""
+  flat = {}
+  for key, value in report.items():
+    name = '{}/{}'.format(prefix, key)
+    if isinstance(value, dict):
+      flat.update(flatten(value, name))
+    else:
+      flat[name] = value
+  return flat
+
+
+def format_report(report, indent=''):
+  """Returns a report as indented lines, with sizes in MiB."""
+  lines = []
+  for key, value in sorted(report.items()):
+    if key == 'pyhanabi_live_objects':
+      lines.append('{}{}: {}'.format(indent, key, value))
+    elif isinstance(value, dict):
+      lines.append('{}{}:'.format(indent, key))
+      lines.append(format_report(value, indent + '  '))
+    else:
+      lines.append('{}{}: {:.1f} MiB'.format(indent, key, value / 2.0**20))
+  return '\n'.join(lines)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--game_type', default='Hanabi-Full-CardKnowledge',
+                      help='rl_env preset.')
+  parser.add_argument('--num_players', type=int, default=2)
+  parser.add_argument('--replay_capacity', type=int, default=50000)
+  parser.add_argument('--agent_type', default='Rainbow',
+                      choices=('DQN', 'Rainbow'))
+  parser.add_argument('--stack_size', type=int, default=1)
+  parser.add_argument('--history_size', type=int, default=1)
+  parser.add_argument('--batch_size', type=int, default=32)
+  parser.add_argument('--update_horizon', type=int, default=1)
+  parser.add_argument('--pack_observations', action='store_true')
+  parser.add_argument('--pack_legal_actions', action='store_true')
+  args = parser.parse_args()
+
+  # pylint: disable=g-import-not-at-top
+  from hanabi_conventions_encoder import simple_official_rules_based_encoder
+  # pylint: enable=g-import-not-at-top
+  environment = create_environment(args.game_type, args.num_players)
+  encoder = simple_official_rules_based_encoder(environment)
+  report = project_memory(
+      args.replay_capacity, environment.vectorized_observation_shape()[0],
+      encoder.convention_action_space, args.num_players,
+      stack_size=args.stack_size, history_size=args.history_size,
+      batch_size=args.batch_size, update_horizon=args.update_horizon,
+      pack_observations=args.pack_observations,
+      pack_legal_actions=args.pack_legal_actions,
+      prioritized=args.agent_type == 'Rainbow')
+  print(format_report(report))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,60 @@
+# coding=utf-8
+"""Tests for memory_report."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+
+import memory_report
+import replay_memory
+import tensorflow as tf
+from third_party.dopamine import sum_tree
+
+NUM_ACTIONS = 21
+OBSERVATION_SIZE = 30
+REPLAY_CAPACITY = 1000
+
+
+class ProjectMemoryTest(tf.test.TestCase):
+
+  def testReplayMatchesAllocatedMemory(self):
+    for pack_observations in (False, True):
+      for pack_legal_actions in (False, True):
+        memory = replay_memory.OutOfGraphReplayMemory(
+            NUM_ACTIONS, 2 * OBSERVATION_SIZE, 3, REPLAY_CAPACITY,
+            batch_size=16, update_horizon=2,
+            pack_observations=pack_observations,
+            pack_legal_actions=pack_legal_actions)
+        report = memory_report.project_memory(
+            REPLAY_CAPACITY, OBSERVATION_SIZE, NUM_ACTIONS, num_players=2,
+            stack_size=3, history_size=2, batch_size=16, update_horizon=2,
+            pack_observations=pack_observations,
+            pack_legal_actions=pack_legal_actions)
+        self.assertEqual(report['replay'], memory_report._array_bytes(memory))
+
+  def testSumTreeMatchesAllocatedTree(self):
+    tree = sum_tree.SumTree(REPLAY_CAPACITY)
+    report = memory_report.project_memory(REPLAY_CAPACITY, OBSERVATION_SIZE,
+                                          NUM_ACTIONS, num_players=2)
+    self.assertEqual(sorted(report['sum_tree'].values()),
+                     sorted(level.nbytes for level in tree.nodes))
+
+  def testTrajectoryLengthMatchesAgent(self):
+    import dqn_agent  # pylint: disable=g-import-not-at-top
+    self.assertEqual(memory_report.INITIAL_TRAJECTORY_LENGTH,
+                     dqn_agent.INITIAL_TRAJECTORY_LENGTH)
+
+  def testProjectionDoesNotImportTensorFlow(self):
+    script = ('import sys, memory_report\n'
+              'memory_report.project_memory(1000, 30, 21, 2)\n'
+              'sys.exit("tensorflow" in sys.modules)\n')
+    subprocess.check_call([sys.executable, '-c', script],
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,157 @@
+# coding=utf-8
+"""Buffered writer for per-episode training metrics.
+
+The training loop records each episode's score into a preallocated array.
+Every `flush_every_n_episodes` episodes the filled array is handed to a
+background thread, which writes the per-episode TensorBoard scalars, summaries
+of the last `window_size` episodes and the scores CSV, so that the training
+loop itself does no I/O and a crash loses at most one batch of scores.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import queue
+import threading
+
+import gin.tf
+import numpy as np
+import tensorflow as tf
+
+
+@gin.configurable
+class MetricsWriter(object):
+  """Aggregates episode scores and writes them on a background thread."""
+
+  def __init__(self,
+               summary_writer,
+               scores_file,
+               flush_every_n_episodes=500,
+               window_size=1000,
+               percentiles=(10, 50, 90)):
+    """Initializes the writer and starts its background thread.
+
+    Args:
+      summary_writer: `SummaryWriter`, TensorBoard writer for the summaries.
+      scores_file: str, CSV file to which every episode's score is appended.
+      flush_every_n_episodes: int, number of episodes per batch handed to the
+        background thread.
+      window_size: int, number of most recent episodes that the mean,
+        percentiles and histogram summaries are computed over.
+      percentiles: tuple of ints, percentiles of the window to write.
+    """
+    self._summary_writer = summary_writer
+    self._window_size = window_size
+    self._percentiles = percentiles
+    self._num_episodes = 0
+
+    # Two score buffers: one being filled by the training loop, the other
+    # being written by the background thread.
+    self._free_buffers = queue.Queue()
+    self._free_buffers.put(np.empty(flush_every_n_episodes, dtype=np.float32))
+    self._buffer = np.empty(flush_every_n_episodes, dtype=np.float32)
+    self._size = 0
+    self._batches = queue.Queue()
+    self._error = None
+
+    # Only used by the background thread.
+    self._window = np.empty(window_size, dtype=np.float32)
+    self._window_count = 0
+    scores_dir = os.path.dirname(scores_file)
+    if scores_dir:
+      tf.gfile.MakeDirs(scores_dir)
+    self._scores_file = tf.gfile.GFile(scores_file, 'w')
+    # Same layout as a single column pandas DataFrame written with to_csv.
+    self._scores_file.write(',0\n')
+
+    self._thread = threading.Thread(target=self._run, name='metrics_writer')
+    self._thread.daemon = True
+    self._thread.start()
+
+  def record_episode(self, score):
+    """Records the score of a training episode.
+
+    Args:
+      score: float, score of the episode.
+    """
+    self._buffer[self._size] = score
+    self._size += 1
+    self._num_episodes += 1
+    if self._size == len(self._buffer):
+      self._submit()
+
+  def _submit(self):
+    if self._error is not None:
+      error, self._error = self._error, None
+      raise error
+    self._batches.put((self._num_episodes - self._size, self._buffer,
+                       self._size))
+    # Blocks if the background thread is a full batch behind.
+    self._buffer = self._free_buffers.get()
+    self._size = 0
+
+  def _run(self):
+    while True:
+      batch = self._batches.get()
+      if batch is None:
+        return
+      first_episode, scores, size = batch
+      try:
+        self._write(first_episode, scores[:size])
+      except Exception as e:  # pylint: disable=broad-except
+        self._error = e
+      self._free_buffers.put(scores)
+
+  def _write(self, first_episode, scores):
+    """Writes a batch of scores, episodes being numbered from 1."""
+    lines = []
+    for i, score in enumerate(scores):
+      episode = first_episode + i + 1
+      self._summary_writer.add_scalar('score/eps', score, episode)
+      lines.append('{},{:g}\n'.format(episode - 1, score))
+    self._scores_file.write(''.join(lines))
+    self._scores_file.flush()
+
+    # Add the batch to the window of recent scores, a circular buffer.
+    recent = scores[-self._window_size:]
+    self._window[(self._window_count + np.arange(len(recent))) %
+                 self._window_size] = recent
+    self._window_count += len(recent)
+    window = self._window[:min(self._window_count, self._window_size)]
+    last_episode = first_episode + len(scores)
+    self._summary_writer.add_scalar('score/window_mean', np.mean(window),
+                                    last_episode)
+    for percentile, value in zip(self._percentiles,
+                                 np.percentile(window, self._percentiles)):
+      self._summary_writer.add_scalar('score/window_p{}'.format(percentile),
+                                      value, last_episode)
+    self._summary_writer.add_histogram('score/window', window, last_episode)
+    self._summary_writer.flush()
+
+  def write_scalars(self, scalars, step):
+    """Writes scalars to TensorBoard right away, from the calling thread.
+
+    Args:
+      scalars: dict, mapping tags to values.
+      step: int, global step of the values.
+    """
+    for tag, value in sorted(scalars.items()):
+      self._summary_writer.add_scalar(tag, value, step)
+    self._summary_writer.flush()
+
+  def close(self):
+    """Writes the remaining scores and stops the background thread.
+
+    Raises:
+      Exception: the error raised while writing metrics, if any.
+    """
+    if self._size:
+      self._submit()
+    self._batches.put(None)
+    self._thread.join()
+    self._scores_file.close()
+    if self._error is not None:
+      error, self._error = self._error, None
+      raise error
@@ -29,8 +29,12 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import queue
+import threading
+
 from third_party.dopamine import sum_tree
 import gin.tf
+from hanabi_learning_environment import instrumentation
 import numpy as np
 import replay_memory
 import tensorflow as tf
@@ -45,7 +49,10 @@ class OutOfGraphPrioritizedReplayMemory(replay_memory.OutOfGraphReplayMemory):
   """
 
   def __init__(self, num_actions, observation_size, stack_size, replay_capacity,
-               batch_size, update_horizon=1, gamma=1.0):
+               batch_size, update_horizon=1, gamma=1.0,
+               pack_observations=False, pack_legal_actions=False,
+               memmap_dir=None, full_checkpoint_period=None,
+               chunked_checkpoints=False, checkpoint_compression_level=9):
     """This data structure does the heavy lifting in the replay memory.
 
     Args:
@@ -56,15 +63,38 @@ class OutOfGraphPrioritizedReplayMemory(replay_memory.OutOfGraphReplayMemory):
       batch_size: int, batch size.
       update_horizon: int, length of update ('n' in n-step update).
       gamma: int, the discount factor.
+      pack_observations: bool, if True observations are stored as packed bits.
+      pack_legal_actions: bool, if True legal actions are stored as packed bits.
+      memmap_dir: str, if not None, directory in which the circular buffers
+        are kept as memory-mapped files.
+      full_checkpoint_period: int, if set, checkpoints save only the rows
+        and the priorities written since the previous one, with a full
+        checkpoint every full_checkpoint_period checkpoints.
+      chunked_checkpoints: bool, if True arrays are checkpointed in the
+        chunked, multi-threaded format of `chunked_checkpoint`.
+      checkpoint_compression_level: int, zlib compression level of the
+        checkpoint files, from 0 (no compression) to 9.
     """
     super(OutOfGraphPrioritizedReplayMemory, self).__init__(
         num_actions=num_actions,
         observation_size=observation_size, stack_size=stack_size,
         replay_capacity=replay_capacity, batch_size=batch_size,
-        update_horizon=update_horizon, gamma=gamma)
+        update_horizon=update_horizon, gamma=gamma,
+        pack_observations=pack_observations,
+        pack_legal_actions=pack_legal_actions,
+        memmap_dir=memmap_dir,
+        full_checkpoint_period=full_checkpoint_period,
+        chunked_checkpoints=chunked_checkpoints,
+        checkpoint_compression_level=checkpoint_compression_level)
 
     self.sum_tree = sum_tree.SumTree(replay_capacity)
+    # Leaves of the sum tree set since the last checkpoint, which delta
+    # checkpoints save.
+    self._dirty_priorities = None
+    if full_checkpoint_period:
+      self._dirty_priorities = np.zeros(replay_capacity, dtype=bool)
 
+  @instrumentation.timed('replay/add')
   def add(self, observation, action, reward, terminal, legal_actions):
     """Adds a transition to the replay memory.
 
@@ -101,6 +131,41 @@ class OutOfGraphPrioritizedReplayMemory(replay_memory.OutOfGraphReplayMemory):
         observation, action, reward, terminal, legal_actions)
 
     self.sum_tree.set(new_element_index, priority)
+    self._mark_dirty(new_element_index)
+
+  def _add_rows(self, observations, actions, rewards, terminals, legal_actions,
+                padding=False):
+    """Writes consecutive transitions and sets their priorities as in `add`."""
+    positions = super(OutOfGraphPrioritizedReplayMemory, self)._add_rows(
+        observations, actions, rewards, terminals, legal_actions)
+    priority = 0.0 if padding else DEFAULT_PRIORITY
+    self.sum_tree.set_batch(positions, np.full(len(positions), priority))
+    self._mark_dirty(positions)
+    return positions
+
+  def _mark_dirty(self, indices):
+    """Records that the priorities of some memory locations changed."""
+    if self._dirty_priorities is not None:
+      self._dirty_priorities[indices] = True
+
+  def _delta_attributes(self):
+    return self._buffer_names + ['sum_tree']
+
+  def _extend_delta(self, delta):
+    """Adds the priorities set since the last checkpoint to a delta."""
+    if delta is not None:
+      leaves = np.flatnonzero(self._dirty_priorities)
+      delta['priorities'] = {
+          'indices': leaves,
+          'values': self.sum_tree.nodes[-1][leaves],
+          'max_recorded_priority': self.sum_tree.max_recorded_priority}
+    self._dirty_priorities[:] = False
+
+  def _apply_delta(self, delta):
+    super(OutOfGraphPrioritizedReplayMemory, self)._apply_delta(delta)
+    priorities = delta['priorities']
+    self.sum_tree.set_batch(priorities['indices'], priorities['values'])
+    self.sum_tree.max_recorded_priority = priorities['max_recorded_priority']
 
   def sample_index_batch(self, batch_size):
     """Returns a batch of valid indices.
@@ -140,8 +205,8 @@ class OutOfGraphPrioritizedReplayMemory(replay_memory.OutOfGraphReplayMemory):
     """
     assert indices.dtype == np.int32, ('Indices must be integers, '
                                        'given: {}'.format(indices.dtype))
-    for i, memory_index in enumerate(indices):
-      self.sum_tree.set(memory_index, priorities[i])
+    self.sum_tree.set_batch(indices, priorities)
+    self._mark_dirty(indices)
 
   def get_priority(self, indices, batch_size=None):
     """Fetches the priorities correspond to a batch of memory indices.
@@ -150,32 +215,123 @@ class OutOfGraphPrioritizedReplayMemory(replay_memory.OutOfGraphReplayMemory):
 
     Args:
       indices: `np.array` of indices in range [0, replay_capacity).
-      batch_size: int, requested number of items.
+      batch_size: int, requested number of items, by default the number of
+        indices.
     Returns:
       The corresponding priorities.
     """
     if batch_size is None:
-      batch_size = self._batch_size
-    if batch_size != self._state_batch.shape[0]:
-      self.reset_state_batch_arrays(batch_size)
+      batch_size = len(indices)
 
     priority_batch = np.empty((batch_size), dtype=np.float32)
 
     assert indices.dtype == np.int32, ('Indices must be integers, '
                                        'given: {}'.format(indices.dtype))
-    for i, memory_index in enumerate(indices):
-      priority_batch[i] = self.sum_tree.get(memory_index)
+    # The leaves of the sum tree are the priorities of the memory locations.
+    priority_batch[:len(indices)] = self.sum_tree.nodes[-1][indices]
 
     return priority_batch
 
 
+class PriorityUpdater(object):
+  """Sets the priorities computed by the train op in batches.
+
+  The indices and new priorities of each update are gathered and set together
+  every `update_period` updates, either from the calling thread or from a
+  background thread, so that the train op never calls back into Python to
+  update the sum tree. An error setting priorities on the background thread
+  is raised by the next call to `add` or `flush`, and the thread carries on
+  with the later updates.
+  """
+
+  def __init__(self, memory, lock, update_period=1, background=False):
+    """Initializes the updater.
+
+    Args:
+      memory: `OutOfGraphPrioritizedReplayMemory` whose priorities are set.
+      lock: `threading.Lock` held while the priorities are set.
+      update_period: int, number of updates whose priorities are set together.
+      background: bool, if True the priorities are set on a background thread.
+    """
+    self._memory = memory
+    self._lock = lock
+    self._update_period = update_period
+    self._indices = []
+    self._priorities = []
+    self._batches = None
+    # First error raised on the background thread, not raised again yet.
+    self._error = None
+    if background:
+      self._batches = queue.Queue()
+      thread = threading.Thread(target=self._run, name='replay_priorities')
+      thread.daemon = True
+      thread.start()
+
+  def add(self, indices, priorities):
+    """Gathers the new priorities of the transitions of an update.
+
+    Args:
+      indices: `np.array` of indices (int32) in range [0, replay_capacity).
+      priorities: `np.array` of the corresponding priorities.
+
+    Raises:
+      Exception: the error raised while setting earlier priorities on the
+        background thread, if any.
+    """
+    self._indices.append(indices)
+    self._priorities.append(priorities)
+    if len(self._indices) >= self._update_period:
+      self.flush()
+
+  def flush(self, wait=False):
+    """Sets the gathered priorities.
+
+    Args:
+      wait: bool, if True and the priorities are set on a background thread,
+        waits until all the priorities gathered so far are set.
+
+    Raises:
+      Exception: the error raised while setting priorities on the background
+        thread, if any.
+    """
+    if self._indices:
+      indices = np.concatenate(self._indices)
+      priorities = np.concatenate(self._priorities)
+      self._indices = []
+      self._priorities = []
+      if self._batches is None:
+        self._set_priority(indices, priorities)
+      else:
+        self._batches.put((indices, priorities))
+    if wait and self._batches is not None:
+      self._batches.join()
+    if self._error is not None:
+      error, self._error = self._error, None
+      raise error
+
+  def _set_priority(self, indices, priorities):
+    with self._lock:
+      self._memory.set_priority(indices, priorities)
+
+  def _run(self):
+    while True:
+      indices, priorities = self._batches.get()
+      try:
+        self._set_priority(indices, priorities)
+      except Exception as e:  # pylint: disable=broad-except
+        if self._error is None:
+          self._error = e
+      finally:
+        self._batches.task_done()
+
+
 @gin.configurable(denylist=['observation_size', 'stack_size'])
 class WrappedPrioritizedReplayMemory(replay_memory.WrappedReplayMemory):
   """In graph wrapper for the python Replay Memory.
 
   Usage:
-    To add a transition:  run the operation add_transition_op
-                          (and feed all the placeholders in add_transition_ph)
+    To add transitions:   call memory.add_batch (or memory.add) while holding
+                          self.lock.
 
     To sample a batch:    Construct operations that depend on any of the
                           sampling tensors. Every sess.run using any of these
@@ -195,12 +351,9 @@ class WrappedPrioritizedReplayMemory(replay_memory.WrappedReplayMemory):
     next_states
     terminals
 
-    add_transition_op:    tf operation to add a transition to the replay
-                          memory. All the following placeholders need to be fed.
-    add_obs_ph
-    add_action_ph
-    add_reward_ph
-    add_terminal_ph
+    memory:               the `OutOfGraphPrioritizedReplayMemory` holding the
+                          transitions.
+    lock:                 lock guarding the memory against concurrent access.
   """
 
   def __init__(self,
@@ -211,7 +364,17 @@ class WrappedPrioritizedReplayMemory(replay_memory.WrappedReplayMemory):
                replay_capacity=1000000,
                batch_size=32,
                update_horizon=1,
-               gamma=1.0):
+               gamma=1.0,
+               pack_observations=False,
+               pack_legal_actions=False,
+               memmap_dir=None,
+               full_checkpoint_period=None,
+               chunked_checkpoints=False,
+               checkpoint_compression_level=9,
+               num_batches=1,
+               prefetch_depth=0,
+               priority_update_period=0,
+               background_priority_updates=False):
     """Initializes a graph wrapper for the python Replay Memory.
 
     Args:
@@ -224,6 +387,32 @@ class WrappedPrioritizedReplayMemory(replay_memory.WrappedReplayMemory):
       batch_size: int.
       update_horizon: int, length of update ('n' in n-step update).
       gamma: int, the discount factor.
+      pack_observations: bool, if True observations are stored as packed bits
+        and only unpacked for sampled batches.
+      pack_legal_actions: bool, if True legal actions are stored as packed bits
+        and only expanded for sampled batches.
+      memmap_dir: str, if not None, local directory (usually the checkpoint
+        directory) in which the replay buffers are kept as memory-mapped files.
+      full_checkpoint_period: int, if set, checkpoints save only the rows
+        and the priorities written since the previous one, with a full
+        checkpoint every full_checkpoint_period checkpoints.
+      chunked_checkpoints: bool, if True arrays are checkpointed in the
+        chunked, multi-threaded format of `chunked_checkpoint`.
+      checkpoint_compression_level: int, zlib compression level of the
+        checkpoint files, from 0 (no compression) to 9.
+      num_batches: int, number of batches sampled together by each sess.run,
+        see `WrappedReplayMemory`.
+      prefetch_depth: int, if positive, number of batches kept ready by a
+        producer thread, see `WrappedReplayMemory`. Priorities are then
+        always deferred, by default with a background thread.
+      priority_update_period: int, if positive, priorities are deferred: the
+        sampled batches also hold the priorities of their transitions at
+        sample time, in `sampled_priorities`, and the new priorities are
+        given to `priority_updater`, which sets them every
+        priority_update_period updates. Otherwise the train op gets and sets
+        the priorities through py_funcs.
+      background_priority_updates: bool, if True deferred priorities are set
+        on a background thread.
 
     Raises:
       ValueError: If update_horizon is not positive.
@@ -232,11 +421,61 @@ class WrappedPrioritizedReplayMemory(replay_memory.WrappedReplayMemory):
     memory = OutOfGraphPrioritizedReplayMemory(num_actions, observation_size,
                                                stack_size, replay_capacity,
                                                batch_size, update_horizon,
-                                               gamma)
+                                               gamma,
+                                               pack_observations,
+                                               pack_legal_actions,
+                                               memmap_dir,
+                                               full_checkpoint_period,
+                                               chunked_checkpoints,
+                                               checkpoint_compression_level)
+    self._deferred_priorities = bool(prefetch_depth or priority_update_period)
     super(WrappedPrioritizedReplayMemory, self).__init__(
         num_actions,
         observation_size, stack_size, use_staging, replay_capacity, batch_size,
-        update_horizon, gamma, wrapped_memory=memory)
+        update_horizon, gamma, wrapped_memory=memory, num_batches=num_batches,
+        prefetch_depth=prefetch_depth)
+    self.priority_updater = None
+    if self._deferred_priorities:
+      self.priority_updater = PriorityUpdater(
+          memory, self.lock, update_period=max(priority_update_period, 1),
+          background=background_priority_updates or bool(prefetch_depth))
+
+  def _transition_spec(self, observation_size, stack_size, num_actions):
+    dtypes, shapes = super(WrappedPrioritizedReplayMemory,
+                           self)._transition_spec(observation_size, stack_size,
+                                                  num_actions)
+    if self._deferred_priorities:
+      dtypes.append(tf.float32)
+      shapes.append([self._sample_size])
+    return dtypes, shapes
+
+  def _set_transition_fields(self, transition):
+    super(WrappedPrioritizedReplayMemory, self)._set_transition_fields(
+        transition)
+    self.sampled_priorities = transition[7] if len(transition) > 7 else None
+
+  def _sample_function(self):
+    sample = super(WrappedPrioritizedReplayMemory, self)._sample_function()
+    if not self._deferred_priorities:
+      return sample
+
+    def sample_with_priorities():
+      batch = sample()
+      return batch + (self.memory.get_priority(batch[5]),)
+
+    return sample_with_priorities
+
+  def save(self, checkpoint_dir, iteration_number):
+    if self.priority_updater is not None:
+      self.priority_updater.flush(wait=True)
+    super(WrappedPrioritizedReplayMemory, self).save(checkpoint_dir,
+                                                     iteration_number)
+
+  def snapshot(self, checkpoint_dir, iteration_number):
+    if self.priority_updater is not None:
+      self.priority_updater.flush(wait=True)
+    return super(WrappedPrioritizedReplayMemory, self).snapshot(
+        checkpoint_dir, iteration_number)
 
   def tf_set_priority(self, indices, losses):
     """Sets the priorities for the given indices.
@@ -250,7 +489,7 @@ class WrappedPrioritizedReplayMemory(replay_memory.WrappedReplayMemory):
        Replay.
     """
     return tf.py_func(
-        self.memory.set_priority, [indices, losses],
+        self._locked(self.memory.set_priority), [indices, losses],
         [],
         name='prioritized_replay_set_priority_py_func')
 
@@ -264,6 +503,6 @@ class WrappedPrioritizedReplayMemory(replay_memory.WrappedReplayMemory):
        A tensor (float32) of priorities.
     """
     return tf.py_func(
-        self.memory.get_priority, [indices],
+        self._locked(self.memory.get_priority), [indices],
         [tf.float32],
         name='prioritized_replay_get_priority_py_func')
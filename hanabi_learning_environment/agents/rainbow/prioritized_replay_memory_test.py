@@ -0,0 +1,127 @@
+# coding=utf-8
+"""Tests for prioritized_replay_memory."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import threading
+
+import numpy as np
+import prioritized_replay_memory
+from replay_memory_test import add_episodes
+from replay_memory_test import NUM_ACTIONS
+from replay_memory_test import OBSERVATION_SIZE
+import tensorflow as tf
+from third_party.dopamine import sum_tree_test
+
+REPLAY_CAPACITY = 64
+
+
+def create_memory(**kwargs):
+  return prioritized_replay_memory.OutOfGraphPrioritizedReplayMemory(
+      NUM_ACTIONS, OBSERVATION_SIZE, 1, REPLAY_CAPACITY, batch_size=8,
+      **kwargs)
+
+
+class OutOfGraphPrioritizedReplayMemoryTest(tf.test.TestCase):
+
+  def testDeltaCheckpointsRestoreThePriorities(self):
+    checkpoint_dir = self.get_temp_dir()
+    rng = np.random.RandomState(0)
+    memory = create_memory(full_checkpoint_period=3)
+    for iteration in range(7):
+      add_episodes(memory, 20, seed=iteration)
+      indices = rng.randint(0, REPLAY_CAPACITY, 10).astype(np.int32)
+      memory.set_priority(indices, rng.uniform(0.0, 200.0, 10))
+      memory.save(checkpoint_dir, iteration)
+      sum_tree_file = os.path.join(checkpoint_dir,
+                                   'sum_tree_ckpt.{}.gz'.format(iteration))
+      self.assertEqual(os.path.exists(sum_tree_file), iteration % 3 == 0)
+      restored = create_memory(full_checkpoint_period=3)
+      restored.load(checkpoint_dir, iteration)
+      for level, expected_level in zip(restored.sum_tree.nodes,
+                                       memory.sum_tree.nodes):
+        np.testing.assert_allclose(level, expected_level, atol=1e-6)
+      self.assertEqual(restored.sum_tree.max_recorded_priority,
+                       memory.sum_tree.max_recorded_priority)
+      np.testing.assert_array_equal(restored.observations, memory.observations)
+
+
+class PriorityUpdaterTest(tf.test.TestCase):
+
+  def _flush(self, updater):
+    """Returns the error of a flush waiting for the background thread."""
+    errors = []
+
+    def flush():
+      try:
+        updater.flush(wait=True)
+      except ValueError as e:
+        errors.append(e)
+
+    thread = threading.Thread(target=flush)
+    thread.daemon = True
+    thread.start()
+    thread.join(60)
+    self.assertFalse(thread.is_alive(), 'The flush waits forever.')
+    return errors[0] if errors else None
+
+  def testBackgroundErrorsAreRaisedByFlush(self):
+    memory = create_memory()
+    add_episodes(memory, 20)
+    # Updates are gathered until flushed.
+    updater = prioritized_replay_memory.PriorityUpdater(
+        memory, threading.Lock(), update_period=10, background=True)
+    indices = np.arange(4, dtype=np.int32)
+    updater.add(indices, np.array([1.0, -1.0, 1.0, 1.0]))
+    self.assertIsInstance(self._flush(updater), ValueError)
+    # The thread carries on, and the error is only raised once.
+    updater.add(indices, np.array([1.0, 2.0, 3.0, 4.0]))
+    self.assertIsNone(self._flush(updater))
+    np.testing.assert_allclose(memory.get_priority(indices),
+                               [1.0, 2.0, 3.0, 4.0])
+
+
+class WrappedPrioritizedReplayMemoryTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(WrappedPrioritizedReplayMemoryTest, self).setUp()
+    tf.reset_default_graph()
+
+  def testBackgroundUpdatesWhileSamplingInPyFunc(self):
+    replay = prioritized_replay_memory.WrappedPrioritizedReplayMemory(
+        NUM_ACTIONS, OBSERVATION_SIZE, 1, use_staging=False,
+        replay_capacity=REPLAY_CAPACITY, batch_size=16,
+        priority_update_period=1, background_priority_updates=True)
+    add_episodes(replay.memory, 2 * REPLAY_CAPACITY)
+    stop = threading.Event()
+
+    def update_priorities():
+      rng = np.random.RandomState(1)
+      while not stop.is_set():
+        indices = rng.randint(0, REPLAY_CAPACITY, 32).astype(np.int32)
+        replay.priority_updater.add(indices, rng.uniform(0.1, 10.0, 32))
+
+    updater = threading.Thread(target=update_priorities)
+    updater.start()
+    try:
+      with tf.Session() as session:
+        for _ in range(200):
+          indices, priorities = session.run(
+              [replay.indices, replay.sampled_priorities])
+          self.assertTrue(np.all(indices >= 0))
+          self.assertTrue(np.all(indices < REPLAY_CAPACITY))
+          self.assertTrue(np.all(priorities > 0.0))
+          with replay.lock:
+            sum_tree_test.assert_consistent(self, replay.memory.sum_tree)
+    finally:
+      stop.set()
+      updater.join()
+    replay.priority_updater.flush(wait=True)
+    sum_tree_test.assert_consistent(self, replay.memory.sum_tree)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,213 @@
+# coding=utf-8
+"""Profiles a window of training steps of a running experiment.
+
+`TrainingProfiler` leaves the agent untouched until it is started. It then
+counts the agent's training steps and, for the requested number of steps,
+samples the Python stack of the training thread and traces the session calls
+of the training steps, i.e. the train and target sync ops. Calls from other
+threads, such as the replay producer's, are not traced. When the window ends
+it writes, to its output directory:
+
+  iter<i>.folded      sampled stacks, one `frame;frame;... count` line per
+                      distinct stack, as read by flamegraph.pl or speedscope.
+  iter<i>.trace.json  the TensorFlow timeline of the traced session calls, to
+                      open in chrome://tracing or Perfetto.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import contextlib
+import os
+import sys
+import threading
+
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+
+class SamplingProfiler(object):
+  """Periodically samples the Python stack of one thread."""
+
+  def __init__(self, thread_id, interval=0.001):
+    """Initializes the profiler.
+
+    Args:
+      thread_id: int, identifier of the thread to sample.
+      interval: float, seconds between two samples.
+    """
+    self._thread_id = thread_id
+    self._interval = interval
+    self._stacks = collections.Counter()
+    self._stop = threading.Event()
+    self._thread = None
+
+  def start(self):
+    """Starts sampling on a background thread."""
+    self._stop.clear()
+    self._thread = threading.Thread(target=self._run, name='sampling_profiler')
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self):
+    """Stops sampling."""
+    self._stop.set()
+    self._thread.join()
+
+  def _run(self):
+    while not self._stop.wait(self._interval):
+      frame = sys._current_frames().get(self._thread_id)  # pylint: disable=protected-access
+      if frame is None:
+        continue
+      stack = []
+      while frame is not None:
+        code = frame.f_code
+        stack.append('{} ({}:{})'.format(code.co_name,
+                                         os.path.basename(code.co_filename),
+                                         code.co_firstlineno))
+        frame = frame.f_back
+      self._stacks[';'.join(reversed(stack))] += 1
+
+  def write_folded(self, filename):
+    """Writes the sampled stacks in the folded format of flame graphs.
+
+    Args:
+      filename: str, path of the file to write.
+    """
+    with tf.gfile.GFile(filename, 'w') as f:
+      for stack, count in self._stacks.most_common():
+        f.write('{} {}\n'.format(stack, count))
+
+
+class SessionTracer(object):
+  """Traces some calls of a session into a single TensorFlow timeline."""
+
+  def __init__(self, session):
+    """Initializes the tracer.
+
+    Args:
+      session: `tf.Session`, whose `run` is patched between `start` and
+        `stop` to trace the calls made within `traced`.
+    """
+    self._session = session
+    self._session_run = None
+    self._run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+    self._run_metadata = tf.RunMetadata()
+    self._lock = threading.Lock()
+    self._local = threading.local()
+
+  def start(self):
+    """Starts tracing the session calls made within `traced`."""
+    self._session_run = self._session.run
+
+    def run(fetches, feed_dict=None, options=None, run_metadata=None):
+      if not getattr(self._local, 'tracing', False):
+        return self._session_run(fetches, feed_dict, options=options,
+                                 run_metadata=run_metadata)
+      del options  # Replaced by the tracing options.
+      metadata = tf.RunMetadata()
+      result = self._session_run(fetches, feed_dict, options=self._run_options,
+                                 run_metadata=metadata)
+      with self._lock:
+        self._run_metadata.step_stats.MergeFrom(metadata.step_stats)
+      if run_metadata is not None:
+        run_metadata.MergeFrom(metadata)
+      return result
+
+    self._session.run = run
+
+  @contextlib.contextmanager
+  def traced(self):
+    """Traces the session calls of the calling thread within the context."""
+    self._local.tracing = True
+    try:
+      yield
+    finally:
+      self._local.tracing = False
+
+  def stop(self):
+    """Stops tracing, restoring the session's `run`."""
+    self._session.run = self._session_run
+
+  def write_chrome_trace(self, filename):
+    """Writes the traced session calls in the Chrome trace format.
+
+    Args:
+      filename: str, path of the file to write.
+    """
+    with self._lock:
+      trace = timeline.Timeline(self._run_metadata.step_stats)
+    with tf.gfile.GFile(filename, 'w') as f:
+      f.write(trace.generate_chrome_trace_format())
+
+
+class TrainingProfiler(object):
+  """Profiles the next `num_steps` training steps of an agent."""
+
+  def __init__(self, agent, output_dir, num_steps, sampling_interval=0.001):
+    """Initializes the profiler.
+
+    Args:
+      agent: `DQNAgent` or `RainbowAgent` to profile.
+      output_dir: str, directory to which the profiles are written.
+      num_steps: int, number of training steps profiled.
+      sampling_interval: float, seconds between two stack samples.
+    """
+    self._agent = agent
+    self._output_dir = output_dir
+    self._num_steps = num_steps
+    self._sampling_interval = sampling_interval
+    self._steps = 0
+    self._iteration = None
+    self._train_step = None
+    self._sampler = None
+    self._tracer = None
+    self.started = False
+    self.active = False
+
+  def start(self, iteration):
+    """Starts profiling from the calling thread's next training step.
+
+    Args:
+      iteration: int, current iteration, used to name the profiles.
+    """
+    tf.logging.info('Profiling %d training steps from iteration %d.',
+                    self._num_steps, iteration)
+    self.started = True
+    self.active = True
+    self._iteration = iteration
+    self._steps = 0
+    self._train_step = self._agent._train_step  # pylint: disable=protected-access
+
+    def profiled_train_step():
+      with self._tracer.traced():
+        self._train_step()
+      if self._agent.eval_mode:
+        return
+      self._steps += 1
+      if self._steps >= self._num_steps:
+        self.stop()
+
+    self._agent._train_step = profiled_train_step  # pylint: disable=protected-access
+    self._tracer = SessionTracer(self._agent._sess)  # pylint: disable=protected-access
+    self._tracer.start()
+    self._sampler = SamplingProfiler(threading.current_thread().ident,
+                                     self._sampling_interval)
+    self._sampler.start()
+
+  def stop(self):
+    """Stops profiling and writes the profiles, if it is still active."""
+    if not self.active:
+      return
+    self.active = False
+    self._sampler.stop()
+    self._tracer.stop()
+    self._agent._train_step = self._train_step  # pylint: disable=protected-access
+    tf.gfile.MakeDirs(self._output_dir)
+    prefix = os.path.join(self._output_dir, 'iter{}'.format(self._iteration))
+    self._sampler.write_folded(prefix + '.folded')
+    self._tracer.write_chrome_trace(prefix + '.trace.json')
+    tf.logging.info('Wrote the profiles of %d training steps to %s.*',
+                    self._steps, prefix)
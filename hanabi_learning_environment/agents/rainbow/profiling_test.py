@@ -0,0 +1,56 @@
+# coding=utf-8
+"""Tests for profiling."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+
+import profiling
+import tensorflow as tf
+
+
+def traced_node_names(tracer):
+  step_stats = tracer._run_metadata.step_stats
+  return set(node.node_name for device in step_stats.dev_stats
+             for node in device.node_stats)
+
+
+class SessionTracerTest(tf.test.TestCase):
+
+  def testOnlyTracesCallsWithinTraced(self):
+    with tf.Graph().as_default():
+      value = tf.placeholder(tf.float32, [])
+      traced_op = tf.identity(value, name='traced_op')
+      untraced_op = tf.identity(value, name='untraced_op')
+      other_thread_op = tf.identity(value, name='other_thread_op')
+      with tf.Session() as session:
+        tracer = profiling.SessionTracer(session)
+        tracer.start()
+        stop = threading.Event()
+
+        def run_other_thread_op():
+          while not stop.is_set():
+            session.run(other_thread_op, {value: 1.0})
+
+        # Stands for the replay producer, running while steps are traced.
+        other_thread = threading.Thread(target=run_other_thread_op)
+        other_thread.start()
+        try:
+          for _ in range(20):
+            with tracer.traced():
+              self.assertEqual(session.run(traced_op, {value: 2.0}), 2.0)
+            session.run(untraced_op, {value: 3.0})
+        finally:
+          stop.set()
+          other_thread.join()
+        tracer.stop()
+    names = traced_node_names(tracer)
+    self.assertIn('traced_op', names)
+    self.assertNotIn('untraced_op', names)
+    self.assertNotIn('other_thread_op', names)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -60,7 +60,8 @@ def rainbow_template(state,
       factor=1.0 / np.sqrt(3.0), mode='FAN_IN', uniform=True)
 
   net = tf.cast(state, tf.float32)
-  net = tf.squeeze(net, axis=2)
+  # Flatten the stack with the oldest frame first, as in dqn_template.
+  net = slim.flatten(tf.transpose(net, [0, 2, 1]))
 
   for _ in range(num_layers):
     net = slim.fully_connected(net, layer_size,
@@ -86,13 +87,16 @@ class RainbowAgent(dqn_agent.DQNAgent):
                update_horizon=1,
                min_replay_history=500,
                update_period=4,
+               stack_size=1,
                target_update_period=500,
                epsilon_train=0.0,
                epsilon_eval=0.0,
                epsilon_decay_period=1000,
                learning_rate=0.000025,
                optimizer_epsilon=0.00003125,
-               tf_device='/cpu:*'):
+               tf_device='/cpu:*',
+               action_cache_size=0,
+               updates_per_call=1):
     """Initializes the agent and constructs its graph.
 
     Args:
@@ -106,6 +110,8 @@ class RainbowAgent(dqn_agent.DQNAgent):
         n-step update.
       min_replay_history: int, number of stored transitions before training.
       update_period: int, period between DQN updates.
+      stack_size: int, number of observations to use as state, stacked by the
+        replay memory from single frames.
       target_update_period: int, update period for the target network.
       epsilon_train: float, final epsilon for training.
       epsilon_eval: float, epsilon during evaluation.
@@ -113,6 +119,10 @@ class RainbowAgent(dqn_agent.DQNAgent):
       learning_rate: float, learning rate for the optimizer.
       optimizer_epsilon: float, epsilon for Adam optimizer.
       tf_device: str, Tensorflow device on which to run computations.
+      action_cache_size: int, number of greedy actions to cache, see
+        `DQNAgent`.
+      updates_per_call: int, number of minibatch updates per training session
+        call, see `DQNAgent`.
     """
     # We need this because some tools convert round floats into ints.
     vmax = float(vmax)
@@ -122,6 +132,9 @@ class RainbowAgent(dqn_agent.DQNAgent):
     self.support = tf.linspace(-vmax, vmax, num_atoms)
     self.learning_rate = learning_rate
     self.optimizer_epsilon = optimizer_epsilon
+    # (indices, priorities) fetched with the train op when the replay memory
+    # defers the priority updates, one pair per update.
+    self._priority_fetches = []
 
     graph_template = functools.partial(rainbow_template, num_atoms=num_atoms)
     super(RainbowAgent, self).__init__(
@@ -132,12 +145,17 @@ class RainbowAgent(dqn_agent.DQNAgent):
         update_horizon=update_horizon,
         min_replay_history=min_replay_history,
         update_period=update_period,
+        stack_size=stack_size,
         target_update_period=target_update_period,
         epsilon_train=epsilon_train,
         epsilon_eval=epsilon_eval,
         epsilon_decay_period=epsilon_decay_period,
         graph_template=graph_template,
-        tf_device=tf_device)
+        tf_device=tf_device,
+        optimizer=tf.train.AdamOptimizer(
+            learning_rate=learning_rate, epsilon=optimizer_epsilon),
+        action_cache_size=action_cache_size,
+        updates_per_call=updates_per_call)
     tf.logging.info('\t learning_rate: %f', learning_rate)
     tf.logging.info('\t optimizer_epsilon: %f', optimizer_epsilon)
 
@@ -155,12 +173,25 @@ class RainbowAgent(dqn_agent.DQNAgent):
     return prioritized_replay_memory.WrappedPrioritizedReplayMemory(
         num_actions=self.num_actions,
         observation_size=self.observation_size,
-        stack_size=1,
+        stack_size=self.stack_size,
         use_staging=use_staging,
         update_horizon=self.update_horizon,
-        gamma=self.gamma)
-
-  def _reshape_networks(self):
+        gamma=self.gamma,
+        num_batches=self.updates_per_call)
+
+  def _q_values(self, network_output):
+    # The network outputs logits of a distribution of returns over the
+    # support, whose expectation is the q-value.
+    probabilities = tf.contrib.layers.softmax(network_output)
+    return tf.reduce_sum(self.support * probabilities, axis=2)
+
+  def _build_train_ops(self, online_convnet, target_convnet):
+    # The online network is reshaped once, the replay networks by each update.
+    self._reshape_online_network()
+    return super(RainbowAgent, self)._build_train_ops(online_convnet,
+                                                      target_convnet)
+
+  def _reshape_online_network(self):
     # self._q is actually logits now, rename things.
     # size of _logits: 1 x num_actions x num_atoms
     self._logits = self._q
@@ -171,6 +202,7 @@ class RainbowAgent(dqn_agent.DQNAgent):
     # Recompute argmax from q values. Ignore illegal actions.
     self._q_argmax = tf.argmax(self._q + self.legal_actions_ph, axis=1)[0]
 
+  def _reshape_replay_networks(self):
     # size of _replay_logits: 1 x num_actions x num_atoms
     self._replay_logits = self._replay_qs
     # size of _replay_next_logits: 1 x num_actions x num_atoms
@@ -179,7 +211,7 @@ class RainbowAgent(dqn_agent.DQNAgent):
     del self._replay_next_qt
 
   def _build_target_distribution(self):
-    self._reshape_networks()
+    self._reshape_replay_networks()
     batch_size = tf.shape(self._replay.rewards)[0]
     # size of rewards: batch_size x 1
     rewards = self._replay.rewards[:, None]
@@ -231,22 +263,36 @@ class RainbowAgent(dqn_agent.DQNAgent):
         labels=target_distribution,
         logits=chosen_action_logits)
 
-    optimizer = tf.train.AdamOptimizer(
-        learning_rate=self.learning_rate,
-        epsilon=self.optimizer_epsilon)
-
-    update_priorities_op = self._replay.tf_set_priority(
-        self._replay.indices, tf.sqrt(loss + 1e-10))
-
-    target_priorities = self._replay.tf_get_priority(self._replay.indices)
+    new_priorities = tf.sqrt(loss + 1e-10)
+    if self._replay.sampled_priorities is not None:
+      # The batch comes with the priorities it was sampled with, and its new
+      # priorities are set outside of the graph.
+      self._priority_fetches.append((self._replay.indices, new_priorities))
+      target_priorities = self._replay.sampled_priorities
+      update_priorities_ops = []
+    else:
+      update_priorities_ops = [self._replay.tf_set_priority(
+          self._replay.indices, new_priorities)]
+      target_priorities = self._replay.tf_get_priority(self._replay.indices)
     target_priorities = tf.math.add(target_priorities, 1e-10)
     target_priorities = 1.0 / tf.sqrt(target_priorities)
     target_priorities /= tf.reduce_max(target_priorities)
 
     weighted_loss = target_priorities * loss
 
-    with tf.control_dependencies([update_priorities_op]):
-      return optimizer.minimize(tf.reduce_mean(weighted_loss)), weighted_loss
+    with tf.control_dependencies(update_priorities_ops):
+      return (self.optimizer.minimize(tf.reduce_mean(weighted_loss)),
+              weighted_loss)
+
+  def _run_train_op(self):
+    """Runs the train op and queues the new priorities of its batches."""
+    if not self._priority_fetches:
+      super(RainbowAgent, self)._run_train_op()
+      return
+    _, _, priority_updates = self._sess.run(
+        [self._train_op, self._replay.prefetch_batch, self._priority_fetches])
+    for indices, priorities in priority_updates:
+      self._replay.priority_updater.add(indices, priorities)
 
 
 def project_distribution(supports, weights, target_support,
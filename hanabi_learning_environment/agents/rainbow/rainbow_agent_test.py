@@ -0,0 +1,64 @@
+# coding=utf-8
+"""Tests for rainbow_agent."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from dqn_agent_test import NUM_ACTIONS
+from dqn_agent_test import NUM_PLAYERS
+from dqn_agent_test import OBSERVATION_SIZE
+from dqn_agent_test import play_episode
+import gin.tf
+import numpy as np
+import rainbow_agent
+import tensorflow as tf
+
+
+class RainbowAgentTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(RainbowAgentTest, self).setUp()
+    tf.reset_default_graph()
+    gin.clear_config()
+
+  def tearDown(self):
+    gin.clear_config()
+    super(RainbowAgentTest, self).tearDown()
+
+  def _create_agent(self, updates_per_call):
+    return rainbow_agent.RainbowAgent(
+        num_actions=NUM_ACTIONS,
+        observation_size=OBSERVATION_SIZE,
+        num_players=NUM_PLAYERS,
+        num_atoms=11,
+        min_replay_history=8,
+        update_period=1,
+        target_update_period=4,
+        updates_per_call=updates_per_call)
+
+  def testOnlineNetworkIsReshapedOnce(self):
+    for updates_per_call in (1, 3):
+      tf.reset_default_graph()
+      agent = self._create_agent(updates_per_call)
+      self.assertEqual(agent._logits.shape.as_list(),
+                       [1, NUM_ACTIONS, agent.num_atoms])
+      self.assertEqual(agent._q.shape.as_list(), [1, NUM_ACTIONS])
+      self.assertEqual(agent._replay_logits.shape.as_list()[1:],
+                       [NUM_ACTIONS, agent.num_atoms])
+
+  def testSeveralUpdatesPerCallTrain(self):
+    agent = self._create_agent(updates_per_call=3)
+    weights = agent._sess.run(tf.trainable_variables('Online'))
+    for _ in range(4):
+      play_episode(agent)
+    self.assertGreater(agent.training_steps, 0)
+    trained_weights = agent._sess.run(tf.trainable_variables('Online'))
+    self.assertFalse(all(np.array_equal(before, after) for before, after
+                         in zip(weights, trained_weights)))
+    q_values = agent._sess.run(agent._q, {agent.state_ph: agent.state})
+    self.assertTrue(np.all(np.isfinite(q_values)))
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -31,12 +31,18 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import copy
+import functools
 import gzip
 import math
 import os
 import pickle
+import threading
 
+import chunked_checkpoint
 import gin.tf
+from hanabi_learning_environment import instrumentation
 import numpy as np
 import tensorflow as tf
 
@@ -45,6 +51,13 @@ import tensorflow as tf
 CHECKPOINT_DURATION = 4
 MAX_SAMPLE_ATTEMPTS = 1000000
 
+# What a replay memory checkpoint writes: the public attributes to save in
+# full, the buffer rows added since the previous checkpoint (or None for a full
+# checkpoint), and the iterations whose files are needed to restore it (or None
+# when delta checkpoints are disabled).
+CheckpointState = collections.namedtuple(
+    'CheckpointState', ['attributes', 'delta', 'chain'])
+
 
 def invalid_range(cursor, replay_capacity, stack_size):
   """Returns an array with all the indices invalidated by cursor.
@@ -71,18 +84,31 @@ class OutOfGraphReplayMemory(object):
   efficiently when the states consist of stacks. The writing behaves like
   a FIFO buffer and the sampling is uniformly random.
 
+  The circular buffers can optionally be memory-mapped .npy files, which lets
+  the capacity exceed physical RAM. Checkpointing then only flushes the files
+  and writes a small metadata file. Note that such a checkpoint is not a
+  point-in-time snapshot: transitions added after the last flush stay in the
+  files and are reused, as the oldest entries, when training resumes.
+
   Attributes:
     add_count:  counter of how many transitions have been added.
-    observations: `np.array`, circular buffer of observations.
+    observations: `np.array`, circular buffer of observations. When
+      observations are packed, each row holds the observation bits packed
+      eight to a byte.
     actions: `np.array`, circular buffer of actions.
     rewards: `np.array`, circular buffer of rewards.
     terminals: `np.array`, circular buffer of terminals.
     legal_actions: `np.array`, circular buffer of legal actions for hanabi.
+      When legal actions are packed, each row holds the legality bits packed
+      eight to a byte instead of the 0/-inf float mask.
     invalid_range: `np.array`, currently invalid indices.
   """
 
   def __init__(self, num_actions, observation_size, stack_size, replay_capacity,
-               batch_size, update_horizon=1, gamma=1.0):
+               batch_size, update_horizon=1, gamma=1.0,
+               pack_observations=False, pack_legal_actions=False,
+               memmap_dir=None, full_checkpoint_period=None,
+               chunked_checkpoints=False, checkpoint_compression_level=9):
     """Data structure doing the heavy lifting.
 
     Args:
@@ -93,14 +119,55 @@ class OutOfGraphReplayMemory(object):
       batch_size: int, batch size.
       update_horizon: int, length of update ('n' in n-step update).
       gamma: float, the discount factor.
+      pack_observations: bool, if True observations are stored as packed bits
+        and only unpacked for sampled batches. Observations must be binary.
+      pack_legal_actions: bool, if True legal actions are stored as packed
+        bits and only expanded to the 0/-inf format for sampled batches.
+      memmap_dir: str, if not None, local directory (usually the checkpoint
+        directory) in which the circular buffers are kept as memory-mapped
+        files. Existing files with a matching layout are reopened, so a
+        resumed run does not need to reload the buffers.
+      full_checkpoint_period: int, if set, checkpoints only save the buffer
+        rows written since the previous checkpoint, and every
+        full_checkpoint_period-th checkpoint saves the full buffers again.
+      chunked_checkpoints: bool, if True arrays are checkpointed in the
+        chunked format of `chunked_checkpoint`, compressed on several threads
+        and checked against per-block checksums when loaded. Checkpoints in
+        either format can be loaded regardless of this setting.
+      checkpoint_compression_level: int, zlib compression level of the
+        checkpoint files, from 0 (no compression) to 9.
+
+    Raises:
+      ValueError: if delta checkpoints are combined with memory-mapped buffers,
+        which are never rewritten in full anyway.
     """
+    if memmap_dir is not None and full_checkpoint_period:
+      raise ValueError('Delta checkpoints are not supported with memory-mapped '
+                       'buffers.')
     self._observation_size = observation_size
+    self._pack_observations = pack_observations
+    self._pack_legal_actions = pack_legal_actions
     self._num_actions = num_actions
     self._replay_capacity = replay_capacity
     self._batch_size = batch_size
     self._stack_size = stack_size
     self._update_horizon = update_horizon
     self._gamma = gamma
+    self._memmap_dir = memmap_dir
+    # Names of the memory-mapped buffers that did not exist before, and so do
+    # not hold any checkpointed data.
+    self._new_memmaps = set()
+    # Names of the circular buffers, which delta checkpoints save by row.
+    self._buffer_names = []
+    self._full_checkpoint_period = full_checkpoint_period
+    # Iterations of the full checkpoint and deltas written so far, and the
+    # add_count at the last checkpoint.
+    self._checkpoint_chain = []
+    self._checkpoint_add_count = None
+    self._chunked_checkpoints = chunked_checkpoints
+    self._checkpoint_compression_level = checkpoint_compression_level
+    if memmap_dir is not None and not os.path.isdir(memmap_dir):
+      os.makedirs(memmap_dir)
 
     # When the horizon is > 1, we compute the sum of discounted rewards as a dot
     # product using the precomputed vector <gamma^0, gamma^1, ..., gamma^{n-1}>.
@@ -108,19 +175,63 @@ class OutOfGraphReplayMemory(object):
         [math.pow(self._gamma, n) for n in range(update_horizon)],
         dtype=np.float32)
 
-    # Create numpy arrays used to store sampled transitions.
-    self.observations = np.empty(
-        (replay_capacity, observation_size), dtype=np.uint8)
-    self.actions = np.empty((replay_capacity), dtype=np.int32)
-    self.rewards = np.empty((replay_capacity), dtype=np.float32)
-    self.terminals = np.empty((replay_capacity), dtype=np.uint8)
-    self.legal_actions = np.empty((replay_capacity, num_actions),
-                                  dtype=np.float32)
+    # Create numpy arrays used to store sampled transitions. Hanabi
+    # observations are binary, so in packed mode each byte holds 8 features.
+    if pack_observations:
+      observation_width = int(math.ceil(observation_size / 8.0))
+    else:
+      observation_width = observation_size
+    self.observations = self._create_buffer(
+        'observations', (replay_capacity, observation_width), np.uint8)
+    self.actions = self._create_buffer('actions', (replay_capacity), np.int32)
+    self.rewards = self._create_buffer('rewards', (replay_capacity),
+                                       np.float32)
+    self.terminals = self._create_buffer('terminals', (replay_capacity),
+                                         np.uint8)
+    if pack_legal_actions:
+      self.legal_actions = self._create_buffer(
+          'legal_actions', (replay_capacity, int(math.ceil(num_actions / 8.0))),
+          np.uint8)
+    else:
+      self.legal_actions = self._create_buffer(
+          'legal_actions', (replay_capacity, num_actions), np.float32)
     self.reset_state_batch_arrays(batch_size)
     self.add_count = np.array(0)
 
     self.invalid_range = np.zeros((self._stack_size))
 
+  def _create_buffer(self, name, shape, dtype):
+    """Allocates one of the circular buffers.
+
+    Args:
+      name: str, name of the attribute holding the buffer.
+      shape: tuple or int, shape of the buffer.
+      dtype: numpy dtype of the buffer.
+
+    Returns:
+      An uninitialized `np.array`, or a `np.memmap` when memmap_dir is set.
+    """
+    self._buffer_names.append(name)
+    if self._memmap_dir is None:
+      return np.empty(shape, dtype=dtype)
+    filename = os.path.join(self._memmap_dir, 'replay_{}.npy'.format(name))
+    if isinstance(shape, int):
+      shape = (shape,)
+    if os.path.exists(filename):
+      try:
+        array = np.lib.format.open_memmap(filename, mode='r+')
+      except ValueError:
+        array = None
+      if (array is not None and array.shape == tuple(shape) and
+          array.dtype == np.dtype(dtype)):
+        return array
+      # The layout changed (e.g. a different capacity), so start afresh.
+      del array
+    self._new_memmaps.add(name)
+    return np.lib.format.open_memmap(filename, mode='w+', dtype=dtype,
+                                     shape=shape)
+
+  @instrumentation.timed('replay/add')
   def add(self, observation, action, reward, terminal, legal_actions):
     """Adds a transition to the replay memory.
 
@@ -146,15 +257,96 @@ class OutOfGraphReplayMemory(object):
 
   def _add(self, observation, action, reward, terminal, legal_actions):
     cursor = self.cursor()
-    self.observations[cursor] = observation
+    if self._pack_observations:
+      self.observations[cursor] = np.packbits(
+          np.asarray(observation, dtype=np.uint8))
+    else:
+      self.observations[cursor] = observation
     self.actions[cursor] = action
     self.rewards[cursor] = reward
     self.terminals[cursor] = terminal
-    self.legal_actions[cursor] = legal_actions
+    if self._pack_legal_actions:
+      self.legal_actions[cursor] = np.packbits(
+          np.asarray(legal_actions) == 0.0)
+    else:
+      self.legal_actions[cursor] = legal_actions
     self.add_count += 1
     self.invalid_range = invalid_range(self.cursor(), self._replay_capacity,
                                        self._stack_size)
 
+  @instrumentation.timed('replay/add_batch')
+  def add_batch(self, observations, actions, rewards, terminals,
+                legal_actions):
+    """Adds a sequence of consecutive transitions to the replay memory.
+
+    This is equivalent to calling `add` for each transition in turn, but each
+    buffer is written with a single assignment per episode.
+
+    Args:
+      observations: `np.array` uint8, (num_transitions, observation_size).
+      actions: `np.array` int, (num_transitions).
+      rewards: `np.array` float, (num_transitions).
+      terminals: `np.array` uint8, (num_transitions), 1 for the last transition
+        of an episode.
+      legal_actions: `np.array` float32, (num_transitions, num_actions), with 0
+        for legal and -inf for illegal actions.
+    """
+    terminals = np.asarray(terminals)
+    if not len(terminals):
+      return
+    instrumentation.increment('replay/transitions_added', len(terminals))
+    start = 0
+    # Episodes are padded as in `add`, so the batch is split after terminals.
+    for end in list(np.flatnonzero(terminals[:-1]) + 1) + [len(terminals)]:
+      if self.is_empty() or self.terminals[self.cursor() - 1] == 1:
+        num_padding = self._stack_size - 1
+        self._add_rows(
+            np.zeros((num_padding, self._observation_size), dtype=np.uint8),
+            np.zeros(num_padding), np.zeros(num_padding),
+            np.zeros(num_padding),
+            np.zeros((num_padding, self._num_actions), dtype=np.float32),
+            padding=True)
+      self._add_rows(observations[start:end], actions[start:end],
+                     rewards[start:end], terminals[start:end],
+                     legal_actions[start:end])
+      start = end
+
+  def _add_rows(self, observations, actions, rewards, terminals, legal_actions,
+                padding=False):
+    """Writes consecutive transitions at the cursor.
+
+    Args:
+      observations: `np.array` uint8, (num_transitions, observation_size).
+      actions: `np.array` int, (num_transitions).
+      rewards: `np.array` float, (num_transitions).
+      terminals: `np.array` uint8, (num_transitions).
+      legal_actions: `np.array` float32, (num_transitions, num_actions).
+      padding: bool, whether these are the dummy transitions preceding an
+        episode.
+
+    Returns:
+      The buffer positions that were written.
+    """
+    positions = ((self.cursor() + np.arange(len(actions))) %
+                 self._replay_capacity)
+    if self._pack_observations:
+      self.observations[positions] = np.packbits(
+          np.asarray(observations, dtype=np.uint8), axis=1)
+    else:
+      self.observations[positions] = observations
+    self.actions[positions] = actions
+    self.rewards[positions] = rewards
+    self.terminals[positions] = terminals
+    if self._pack_legal_actions:
+      self.legal_actions[positions] = np.packbits(
+          np.asarray(legal_actions) == 0.0, axis=1)
+    else:
+      self.legal_actions[positions] = legal_actions
+    self.add_count += len(positions)
+    self.invalid_range = invalid_range(self.cursor(), self._replay_capacity,
+                                       self._stack_size)
+    return positions
+
   def is_empty(self):
     """Is the replay memory empty?"""
     return self.add_count == 0
@@ -194,11 +386,40 @@ class OutOfGraphReplayMemory(object):
 
   def get_observation_stack(self, index):
     state = self.get_stack(self.observations, index)
-    return np.transpose(state, [1, 0])
+    return self._unpack_observation_stacks(state[None])[0]
+
+  def _unpack_observation_stacks(self, stacks):
+    """Converts stored observation stacks into the network's state layout.
+
+    Args:
+      stacks: `np.array` uint8, (batch_size, stack_size, width) rows as stored
+        in `observations`.
+
+    Returns:
+      `np.array` uint8 of shape (batch_size, observation_size, stack_size).
+    """
+    if self._pack_observations:
+      stacks = np.unpackbits(stacks, axis=-1, count=self._observation_size)
+    return np.transpose(stacks, [0, 2, 1])
 
   def get_terminal_stack(self, index):
     return self.get_stack(self.terminals, index)
 
+  def _expand_legal_actions(self, rows):
+    """Converts stored legal action rows into the 0/-inf float format.
+
+    Args:
+      rows: `np.array`, (batch_size, width) rows as stored in `legal_actions`.
+
+    Returns:
+      `np.array` float32 of shape (batch_size, num_actions).
+    """
+    if not self._pack_legal_actions:
+      return rows
+    legal = np.unpackbits(rows, axis=-1, count=self._num_actions)
+    return np.where(legal.astype(np.bool_), np.float32(0.0),
+                    np.float32(-np.inf))
+
   def is_valid_transition(self, index):
     """Checks if the index contains a valid transition.
 
@@ -270,6 +491,7 @@ class OutOfGraphReplayMemory(object):
                       (MAX_SAMPLE_ATTEMPTS, len(indices)))
     return indices
 
+  @instrumentation.timed('replay/sample_transition_batch')
   def sample_transition_batch(self, batch_size=None, indices=None):
     """Returns a batch of transitions.
 
@@ -304,14 +526,21 @@ class OutOfGraphReplayMemory(object):
     reward_batch = np.empty((batch_size), dtype=np.float32)
     terminal_batch = np.empty((batch_size), dtype=np.uint8)
     indices_batch = np.empty((batch_size), dtype=np.int32)
-    next_legal_actions_batch = np.empty((batch_size, self._num_actions),
-                                        dtype=np.float32)
+    next_legal_actions_rows = np.empty(
+        (batch_size, self.legal_actions.shape[1]),
+        dtype=self.legal_actions.dtype)
+    # Observation stacks are gathered in their stored (possibly packed) form
+    # and converted for the whole batch at once.
+    state_stacks = np.empty(
+        (batch_size, self._stack_size, self.observations.shape[1]),
+        dtype=np.uint8)
+    next_state_stacks = np.empty_like(state_stacks)
 
     for batch_element, memory_index in enumerate(indices):
       indices_batch[batch_element] = memory_index
 
-      self._state_batch[batch_element] = self.get_observation_stack(
-          memory_index)
+      state_stacks[batch_element] = self.get_stack(self.observations,
+                                                   memory_index)
 
       # Compute indices in the replay memory up to n steps ahead.
       trajectory_indices = [(memory_index + j) % self._replay_capacity for
@@ -338,11 +567,17 @@ class OutOfGraphReplayMemory(object):
 
       bootstrap_state_index = (
           (memory_index + self._update_horizon) % self._replay_capacity)
-      self._next_state_batch[batch_element] = (
-          self.get_observation_stack(bootstrap_state_index))
-      next_legal_actions_batch[batch_element] = (
+      next_state_stacks[batch_element] = self.get_stack(
+          self.observations, bootstrap_state_index)
+      next_legal_actions_rows[batch_element] = (
           self.legal_actions[bootstrap_state_index])
 
+    self._state_batch[:] = self._unpack_observation_stacks(state_stacks)
+    self._next_state_batch[:] = self._unpack_observation_stacks(
+        next_state_stacks)
+    next_legal_actions_batch = self._expand_legal_actions(
+        next_legal_actions_rows)
+
     return (self._state_batch, action_batch, reward_batch,
             self._next_state_batch, terminal_batch, indices_batch,
             next_legal_actions_batch)
@@ -354,6 +589,10 @@ class OutOfGraphReplayMemory(object):
     """Save the python replay memory attributes into a file.
 
     This method will save all the replay memory's state in a single file.
+    Memory-mapped buffers are only flushed, and the remaining attributes are
+    saved in a single metadata file. With delta checkpoints, only the buffer
+    rows written since the previous checkpoint are saved, except for every
+    full_checkpoint_period-th checkpoint which saves the whole buffers.
 
     Args:
       checkpoint_dir: str, directory where numpy checkpoint files should be
@@ -363,34 +602,273 @@ class OutOfGraphReplayMemory(object):
     """
     if not tf.gfile.Exists(checkpoint_dir):
       return
+    self._write_checkpoint(
+        self._checkpoint_state(iteration_number, copy_values=False),
+        checkpoint_dir, iteration_number)
+
+  def snapshot(self, checkpoint_dir, iteration_number):
+    """Takes a copy of the replay memory's state for a deferred save.
+
+    Args:
+      checkpoint_dir: str, directory where numpy checkpoint files should be
+        saved.
+      iteration_number: int, iteration_number to use as a suffix in naming numpy
+        checkpoint files.
+
+    Returns:
+      A function without arguments which writes the checkpoint files, as
+        `save` would have done at the time of the snapshot. It may be called
+        from another thread while transitions are being added. Returns None if
+        the checkpoint directory does not exist.
+    """
+    if not tf.gfile.Exists(checkpoint_dir):
+      return None
+    return functools.partial(
+        self._write_checkpoint,
+        self._checkpoint_state(iteration_number, copy_values=True),
+        checkpoint_dir, iteration_number)
+
+  def _checkpoint_state(self, iteration_number, copy_values):
+    """Collects what the checkpoint for iteration_number has to write.
+
+    This also advances the delta checkpoint chain, so it must be called once
+    per checkpoint.
+
+    Args:
+      iteration_number: int, iteration number of the checkpoint.
+      copy_values: bool, if True the values are copied, except for memory-mapped
+        buffers, which are flushed in place when written.
+
+    Returns:
+      A `CheckpointState`.
+    """
+    delta = None
+    chain = None
+    if self._full_checkpoint_period:
+      add_count = int(self.add_count)
+      if (self._checkpoint_chain and
+          len(self._checkpoint_chain) < self._full_checkpoint_period and
+          0 <= add_count - self._checkpoint_add_count < self._replay_capacity):
+        positions = (np.arange(self._checkpoint_add_count, add_count) %
+                     self._replay_capacity)
+        # Fancy indexing already copies the rows.
+        rows = dict((name, self.__dict__[name][positions])
+                    for name in self._buffer_names)
+        delta = {'start': self._checkpoint_add_count, 'end': add_count,
+                 'rows': rows}
+        chain = self._checkpoint_chain + [iteration_number]
+      else:
+        chain = [iteration_number]
+      self._extend_delta(delta)
+      self._checkpoint_chain = chain
+      self._checkpoint_add_count = add_count
+
+    attributes = collections.OrderedDict()
+    delta_attributes = self._delta_attributes()
     for attr in self.__dict__:
-      if not attr.startswith('_'):
-        filename = self._generate_filename(checkpoint_dir, attr,
-                                           iteration_number)
-        with tf.gfile.Open(filename, 'wb') as f:
-          with gzip.GzipFile(fileobj=f) as outfile:
-            # Checkpoint numpy arrays directly with np.save to avoid excessive
-            # memory usage. This is particularly important for the observations
-            # data.
-            if isinstance(self.__dict__[attr], np.ndarray):
-              np.save(outfile, self.__dict__[attr], allow_pickle=False)
-            else:
-              pickle.dump(self.__dict__[attr], outfile)
-
-      # After writing a checkpoint file, we garbage collect the checkpoint file
-      # that is four versions old.
-      stale_iteration_number = iteration_number - CHECKPOINT_DURATION
-      if stale_iteration_number >= 0:
-        stale_filename = self._generate_filename(checkpoint_dir, attr,
-                                                 stale_iteration_number)
-        try:
-          tf.gfile.Remove(stale_filename)
-        except tf.errors.NotFoundError:
-          pass
+      if attr.startswith('_'):
+        continue
+      if delta is not None and attr in delta_attributes:
+        continue
+      value = self.__dict__[attr]
+      if copy_values and not isinstance(value, np.memmap):
+        if isinstance(value, np.ndarray):
+          value = np.array(value, copy=True)
+        else:
+          value = copy.deepcopy(value)
+      attributes[attr] = value
+    return CheckpointState(attributes, delta, chain)
+
+  def _delta_attributes(self):
+    """Returns the attributes that delta checkpoints only save in part.
+
+    These attributes are loaded from the full checkpoint at the start of a
+    chain, and updated by each of its deltas.
+    """
+    return self._buffer_names
+
+  def _extend_delta(self, delta):
+    """Adds the changes of subclass attributes to a delta checkpoint.
+
+    Called for every checkpoint, so that subclasses can start tracking the
+    changes saved by the next delta.
+
+    Args:
+      delta: dict, the delta being checkpointed, or None for a full
+        checkpoint.
+    """
+
+  def _apply_delta(self, delta):
+    """Applies a delta checkpoint written by `_checkpoint_state`."""
+    positions = (np.arange(delta['start'], delta['end']) %
+                 self._replay_capacity)
+    for name, rows in delta['rows'].items():
+      self.__dict__[name][positions] = rows
+
+  def _write_checkpoint(self, state, checkpoint_dir, iteration_number):
+    """Writes a `CheckpointState` to files."""
+    if self._memmap_dir is not None:
+      self._save_metadata(state.attributes, checkpoint_dir, iteration_number)
+      return
+    for attr, value in state.attributes.items():
+      self._save_attribute(
+          self._generate_filename(checkpoint_dir, attr, iteration_number),
+          value)
+    if state.delta is not None:
+      self._save_attribute(
+          self._generate_filename(checkpoint_dir, 'delta', iteration_number),
+          state.delta)
+    # The chain file is written last, once the files it refers to exist.
+    chain_filename = self._generate_filename(checkpoint_dir, 'chain',
+                                             iteration_number)
+    if state.chain is not None:
+      self._save_attribute(chain_filename, state.chain)
+    else:
+      self._remove_file(chain_filename)
+    self._remove_stale_checkpoint(checkpoint_dir, iteration_number)
+
+  def _chunked_filename(self, filename):
+    """Returns the file holding an array in the chunked checkpoint format."""
+    return os.path.splitext(filename)[0] + '.chunks'
+
+  def _save_attribute(self, filename, value):
+    """Writes a numpy array or a pickled object to a gzipped file.
+
+    With chunked checkpoints, numpy arrays are written to the corresponding
+    chunked file instead.
+
+    Args:
+      filename: str, name of the gzipped file.
+      value: the attribute value to save.
+    """
+    if self._chunked_checkpoints and isinstance(value, np.ndarray):
+      chunked_checkpoint.save_array(
+          self._chunked_filename(filename), value,
+          compression_level=self._checkpoint_compression_level)
+      return
+    # A chunked file from an earlier run would take precedence when loading.
+    if tf.gfile.Exists(self._chunked_filename(filename)):
+      tf.gfile.Remove(self._chunked_filename(filename))
+    with tf.gfile.Open(filename, 'wb') as f:
+      with gzip.GzipFile(
+          fileobj=f, mode='wb',
+          compresslevel=self._checkpoint_compression_level) as outfile:
+        # Checkpoint numpy arrays directly with np.save to avoid excessive
+        # memory usage. This is particularly important for the observations
+        # data.
+        if isinstance(value, np.ndarray):
+          np.save(outfile, value, allow_pickle=False)
+        else:
+          pickle.dump(value, outfile)
+
+  def _load_attribute(self, filename, attr):
+    """Reads a file written by `_save_attribute` for the given attribute.
+
+    Raises:
+      ValueError: if a checkpointed array does not match this memory's layout.
+    """
+    if tf.gfile.Exists(self._chunked_filename(filename)):
+      array = chunked_checkpoint.load_array(self._chunked_filename(filename))
+    else:
+      with tf.gfile.Open(filename, 'rb') as f:
+        with gzip.GzipFile(fileobj=f) as infile:
+          if not isinstance(self.__dict__.get(attr), np.ndarray):
+            return pickle.load(infile)
+          array = np.load(infile, allow_pickle=False)
+    if array.shape != self.__dict__[attr].shape:
+      raise ValueError(
+          'Checkpointed {} has shape {} but the replay memory expects '
+          '{}.'.format(attr, array.shape, self.__dict__[attr].shape))
+    return array
+
+  def _remove_file(self, filename):
+    for name in (filename, self._chunked_filename(filename)):
+      try:
+        tf.gfile.Remove(name)
+      except tf.errors.NotFoundError:
+        pass
+
+  def _read_chain(self, checkpoint_dir, suffix):
+    """Returns the delta chain of a checkpoint, or None for full checkpoints."""
+    filename = self._generate_filename(checkpoint_dir, 'chain', suffix)
+    if not tf.gfile.Exists(filename):
+      return None
+    return self._load_attribute(filename, 'chain')
+
+  def _remove_stale_checkpoint(self, checkpoint_dir, iteration_number):
+    """Garbage collects the checkpoint that is CHECKPOINT_DURATION versions old.
+
+    Buffers of a full checkpoint, and deltas, are kept for as long as a newer
+    checkpoint's chain still refers to them.
+
+    Args:
+      checkpoint_dir: str, directory holding the checkpoint files.
+      iteration_number: int, iteration number of the latest checkpoint.
+    """
+    stale_iteration_number = iteration_number - CHECKPOINT_DURATION
+    if stale_iteration_number < 0:
+      return
+    attributes = [attr for attr in self.__dict__ if not attr.startswith('_')]
+    stale_chain = self._read_chain(checkpoint_dir, stale_iteration_number)
+    if stale_chain is None:
+      for attr in attributes:
+        self._remove_file(self._generate_filename(checkpoint_dir, attr,
+                                                  stale_iteration_number))
+      return
+
+    self._remove_file(self._generate_filename(checkpoint_dir, 'chain',
+                                              stale_iteration_number))
+    delta_attributes = self._delta_attributes()
+    for attr in attributes:
+      if attr not in delta_attributes:
+        self._remove_file(self._generate_filename(checkpoint_dir, attr,
+                                                  stale_iteration_number))
+    referenced = set()
+    for filename in tf.gfile.Glob(
+        self._generate_filename(checkpoint_dir, 'chain', '*')):
+      referenced.update(self._load_attribute(filename, 'chain'))
+    for chain_iteration in stale_chain:
+      if chain_iteration in referenced:
+        continue
+      for name in delta_attributes + ['delta']:
+        self._remove_file(self._generate_filename(checkpoint_dir, name,
+                                                  chain_iteration))
+
+  def _save_metadata(self, attributes, checkpoint_dir, iteration_number):
+    """Flushes the memory-mapped buffers and saves the other attributes."""
+    metadata = {}
+    for attr, value in attributes.items():
+      if isinstance(value, np.memmap):
+        value.flush()
+      else:
+        metadata[attr] = value
+    self._save_attribute(
+        self._generate_filename(checkpoint_dir, 'metadata', iteration_number),
+        metadata)
+
+    stale_iteration_number = iteration_number - CHECKPOINT_DURATION
+    if stale_iteration_number >= 0:
+      self._remove_file(self._generate_filename(checkpoint_dir, 'metadata',
+                                                stale_iteration_number))
+
+  def _load_metadata(self, checkpoint_dir, suffix):
+    """Restores the attributes saved alongside memory-mapped buffers."""
+    filename = self._generate_filename(checkpoint_dir, 'metadata', suffix)
+    if self._new_memmaps or not tf.gfile.Exists(filename):
+      missing = [os.path.join(self._memmap_dir, 'replay_{}.npy'.format(name))
+                 for name in sorted(self._new_memmaps)]
+      missing.append(filename)
+      raise tf.errors.NotFoundError(None, None,
+                                    'Missing file: {}'.format(missing))
+    for attr, value in self._load_attribute(filename, 'metadata').items():
+      self.__dict__[attr] = value
 
   def load(self, checkpoint_dir, suffix):
     """Restores the object from bundle_dictionary and numpy checkpoints.
 
+    Delta checkpoints are rebuilt from the full checkpoint at the start of
+    their chain followed by each delta in order.
+
     Args:
       checkpoint_dir: str, directory where to read the numpy checkpointed files
         from.
@@ -398,28 +876,51 @@ class OutOfGraphReplayMemory(object):
 
     Raises:
       NotFoundError: if all expected files are not found in directory.
+      DataLossError: if a chunked checkpoint file is truncated or corrupted.
+      ValueError: if a checkpointed array does not match this memory's layout,
+        e.g. when restoring packed observations into an unpacked memory.
     """
-    # We will first make sure we have all the necessary files available to avoid
-    # loading a partially-specified (i.e. corrupted) replay buffer.
+    if self._memmap_dir is not None:
+      # The buffers were mapped from disk at construction time.
+      self._load_metadata(checkpoint_dir, suffix)
+      return
+    chain = self._read_chain(checkpoint_dir, suffix)
+    # The files holding each attribute, and the deltas to apply afterwards.
+    filenames = collections.OrderedDict()
+    delta_filenames = []
+    delta_attributes = self._delta_attributes()
     for attr in self.__dict__:
       if attr.startswith('_'):
         continue
-      filename = self._generate_filename(checkpoint_dir, attr, suffix)
-      if not tf.gfile.Exists(filename):
+      if chain is not None and attr in delta_attributes:
+        filenames[attr] = self._generate_filename(checkpoint_dir, attr,
+                                                  chain[0])
+      else:
+        filenames[attr] = self._generate_filename(checkpoint_dir, attr, suffix)
+    if chain is not None:
+      delta_filenames = [
+          self._generate_filename(checkpoint_dir, 'delta', chain_iteration)
+          for chain_iteration in chain[1:]]
+    # We will first make sure we have all the necessary files available to avoid
+    # loading a partially-specified (i.e. corrupted) replay buffer.
+    # Chunked files are also checked for truncation, which only needs their
+    # trailer to be read.
+    for filename in list(filenames.values()) + delta_filenames:
+      if tf.gfile.Exists(self._chunked_filename(filename)):
+        chunked_checkpoint.verify(self._chunked_filename(filename))
+      elif not tf.gfile.Exists(filename):
         raise tf.errors.NotFoundError(None, None,
                                       'Missing file: {}'.format(filename))
     # If we've reached this point then we have verified that all expected files
     # are available.
-    for attr in self.__dict__:
-      if attr.startswith('_'):
-        continue
-      filename = self._generate_filename(checkpoint_dir, attr, suffix)
-      with tf.gfile.Open(filename, 'rb') as f:
-        with gzip.GzipFile(fileobj=f) as infile:
-          if isinstance(self.__dict__[attr], np.ndarray):
-            self.__dict__[attr] = np.load(infile, allow_pickle=False)
-          else:
-            self.__dict__[attr] = pickle.load(infile)
+    for attr, filename in filenames.items():
+      self.__dict__[attr] = self._load_attribute(filename, attr)
+    for filename in delta_filenames:
+      self._apply_delta(self._load_attribute(filename, 'delta'))
+
+    # Further delta checkpoints extend the chain that was loaded.
+    self._checkpoint_chain = chain or []
+    self._checkpoint_add_count = int(self.add_count)
 
 
 @gin.configurable(denylist=['observation_size', 'stack_size'])
@@ -427,8 +928,8 @@ class WrappedReplayMemory(object):
   """In-graph wrapper for the python replay memory.
 
   Usage:
-    To add a transition:  run the operation add_transition_op
-                          (and feed all the placeholders in add_transition_ph).
+    To add transitions:   call memory.add_batch (or memory.add) while holding
+                          self.lock.
 
     To sample a batch:    Construct operations that depend on any of the
                           sampling tensors. Every sess.run using any of these
@@ -440,12 +941,18 @@ class WrappedReplayMemory(object):
                           Everytime this op is called a new transition batch
                           would be prefetched.
 
+    With a prefetch queue: Call start_prefetching once the memory holds enough
+                          transitions. A producer thread then keeps the queue
+                          filled, and every sess.run using the sampling
+                          tensors dequeues a batch without calling back into
+                          Python. Reads and writes of the memory from other
+                          threads must hold self.lock.
+
   Attributes:
     The following tensors are sampled randomly each sess.run:
       states actions rewards next_states terminals
-    add_transition_op:    tf operation to add a transition to the replay memory.
-    All the following placeholders need to be fed. add_obs_ph add_action_ph
-    add_reward_ph add_terminal_ph
+    memory:               the `OutOfGraphReplayMemory` holding the transitions.
+    lock:                 lock guarding the memory against concurrent access.
   """
 
   def __init__(self,
@@ -457,7 +964,15 @@ class WrappedReplayMemory(object):
                batch_size=32,
                update_horizon=1,
                gamma=1.0,
-               wrapped_memory=None):
+               wrapped_memory=None,
+               pack_observations=False,
+               pack_legal_actions=False,
+               memmap_dir=None,
+               full_checkpoint_period=None,
+               chunked_checkpoints=False,
+               checkpoint_compression_level=9,
+               num_batches=1,
+               prefetch_depth=0):
     """Initializes a graph wrapper for the python replay memory.
 
     Args:
@@ -472,6 +987,28 @@ class WrappedReplayMemory(object):
       gamma: int, the discount factor.
       wrapped_memory: The 'inner' memory data structure. Defaults to None, which
         creates the standard DQN replay memory.
+      pack_observations: bool, whether the standard DQN replay memory stores
+        observations as packed bits. Ignored if wrapped_memory is given.
+      pack_legal_actions: bool, whether the standard DQN replay memory stores
+        legal actions as packed bits. Ignored if wrapped_memory is given.
+      memmap_dir: str, if not None, directory in which the standard DQN replay
+        memory keeps its buffers as memory-mapped files. Ignored if
+        wrapped_memory is given.
+      full_checkpoint_period: int, if set, the standard DQN replay memory
+        writes delta checkpoints with a full checkpoint every
+        full_checkpoint_period checkpoints. Ignored if wrapped_memory is given.
+      chunked_checkpoints: bool, if True the standard DQN replay memory
+        checkpoints arrays in the chunked, multi-threaded format. Ignored if
+        wrapped_memory is given.
+      checkpoint_compression_level: int, zlib compression level of the
+        standard DQN replay memory's checkpoints, from 0 (no compression) to 9.
+        Ignored if wrapped_memory is given.
+      num_batches: int, number of batches of batch_size transitions sampled
+        (and staged) together by each sess.run, to be consumed one at a time
+        through `select_batch`.
+      prefetch_depth: int, if positive, number of sampled batches kept ready
+        in a queue filled by a producer thread, which replaces the py_func
+        sampling and the staging area.
 
     Raises:
       ValueError: If update_horizon is not positive.
@@ -485,6 +1022,14 @@ class WrappedReplayMemory(object):
       raise ValueError('Update horizon must be positive.')
     if not 0.0 <= gamma <= 1.0:
       raise ValueError('Discount factor (gamma) must be in [0, 1].')
+    if num_batches < 1:
+      raise ValueError('Number of batches must be positive.')
+    self._batch_size = batch_size
+    self._sample_size = batch_size * num_batches
+    self.prefetch_depth = prefetch_depth
+    self.lock = threading.Lock()
+    self._producer = None
+    self._stop_producer = threading.Event()
 
     # Allow subclasses to create self.memory.
     if wrapped_memory is not None:
@@ -492,74 +1037,158 @@ class WrappedReplayMemory(object):
     else:
       self.memory = OutOfGraphReplayMemory(
           num_actions, observation_size, stack_size,
-          replay_capacity, batch_size, update_horizon, gamma)
+          replay_capacity, batch_size, update_horizon, gamma,
+          pack_observations=pack_observations,
+          pack_legal_actions=pack_legal_actions,
+          memmap_dir=memmap_dir,
+          full_checkpoint_period=full_checkpoint_period,
+          chunked_checkpoints=chunked_checkpoints,
+          checkpoint_compression_level=checkpoint_compression_level)
 
     with tf.name_scope('replay'):
-      with tf.name_scope('add_placeholders'):
-        self.add_obs_ph = tf.placeholder(
-            tf.uint8, [observation_size], name='add_obs_ph')
-        self.add_action_ph = tf.placeholder(tf.int32, [], name='add_action_ph')
-        self.add_reward_ph = tf.placeholder(
-            tf.float32, [], name='add_reward_ph')
-        self.add_terminal_ph = tf.placeholder(
-            tf.uint8, [], name='add_terminal_ph')
-        self.add_legal_actions_ph = tf.placeholder(
-            tf.float32, [num_actions], name='add_legal_actions_ph')
-
-      add_transition_ph = [
-          self.add_obs_ph, self.add_action_ph, self.add_reward_ph,
-          self.add_terminal_ph, self.add_legal_actions_ph
-      ]
-
       with tf.device('/cpu:*'):
-        self.add_transition_op = tf.py_func(
-            self.memory.add, add_transition_ph, [], name='replay_add_py_func')
-
-        self.transition = tf.py_func(
-            self.memory.sample_transition_batch, [],
-            [tf.uint8, tf.int32, tf.float32, tf.uint8, tf.uint8, tf.int32,
-             tf.float32],
-            name='replay_sample_py_func')
+        dtypes, shapes = self._transition_spec(observation_size, stack_size,
+                                               num_actions)
+        self._sample_batch = self._sample_function()
+        if prefetch_depth:
+          # The producer thread feeds sampled batches to the queue, from which
+          # each sess.run dequeues one within the TensorFlow runtime.
+          self._enqueue_phs = [tf.placeholder(dtype, shape)
+                               for dtype, shape in zip(dtypes, shapes)]
+          prefetch_queue = tf.FIFOQueue(prefetch_depth, dtypes, shapes=shapes,
+                                        name='prefetch_queue')
+          self._enqueue_op = prefetch_queue.enqueue(self._enqueue_phs)
+          self._close_queue_op = prefetch_queue.close(
+              cancel_pending_enqueues=True)
+          self.transition = prefetch_queue.dequeue()
+          self.prefetch_batch = tf.no_op()
+        else:
+          self.transition = tf.py_func(
+              self._locked(self._sample_batch), [], dtypes,
+              name='replay_sample_py_func')
 
-        if use_staging:
+        if use_staging and not prefetch_depth:
           # To hide the py_func latency use a staging area to pre-fetch the next
           # batch of transitions.
-          (states, actions, rewards, next_states,
-           terminals, indices, next_legal_actions) = self.transition
           # StagingArea requires all the shapes to be defined.
-          states.set_shape([batch_size, observation_size, stack_size])
-          actions.set_shape([batch_size])
-          rewards.set_shape([batch_size])
-          next_states.set_shape(
-              [batch_size, observation_size, stack_size])
-          terminals.set_shape([batch_size])
-          indices.set_shape([batch_size])
-          next_legal_actions.set_shape([batch_size, num_actions])
+          for tensor, shape in zip(self.transition, shapes):
+            tensor.set_shape(shape)
 
           # Create the staging area in CPU.
-          prefetch_area = tf.contrib.staging.StagingArea(
-              [tf.uint8, tf.int32, tf.float32, tf.uint8, tf.uint8, tf.int32,
-               tf.float32])
+          prefetch_area = tf.contrib.staging.StagingArea(dtypes)
 
-          self.prefetch_batch = prefetch_area.put(
-              (states, actions, rewards, next_states, terminals, indices,
-               next_legal_actions))
-        else:
+          self.prefetch_batch = prefetch_area.put(self.transition)
+        elif not prefetch_depth:
           self.prefetch_batch = tf.no_op()
 
-      if use_staging:
+      if use_staging and not prefetch_depth:
         # Get the sample_transition_batch in GPU. This would do the copy from
         # CPU to GPU.
         self.transition = prefetch_area.get()
 
-      (self.states, self.actions, self.rewards, self.next_states,
-       self.terminals, self.indices, self.next_legal_actions) = self.transition
+      self._set_transition_fields(self.transition)
 
       # Since these are py_func tensors, no information about their shape is
       # present. Setting the shape only for the necessary tensors
       self.states.set_shape([None, observation_size, stack_size])
       self.next_states.set_shape([None, observation_size, stack_size])
 
+  def _transition_spec(self, observation_size, stack_size, num_actions):
+    """Returns the dtypes and shapes of the sampled transition tensors."""
+    sample_size = self._sample_size
+    dtypes = [tf.uint8, tf.int32, tf.float32, tf.uint8, tf.uint8, tf.int32,
+              tf.float32]
+    shapes = [[sample_size, observation_size, stack_size], [sample_size],
+              [sample_size], [sample_size, observation_size, stack_size],
+              [sample_size], [sample_size], [sample_size, num_actions]]
+    return dtypes, shapes
+
+  def _set_transition_fields(self, transition):
+    """Sets the sampling tensors from the tensors of a transition."""
+    (self.states, self.actions, self.rewards, self.next_states,
+     self.terminals, self.indices, self.next_legal_actions) = transition[:7]
+
+  def _locked(self, function):
+    """Returns a function calling `function` while holding self.lock.
+
+    The py_funcs run on TensorFlow's threads, so they take the lock like the
+    other threads reading or writing the memory.
+    """
+
+    def locked_function(*args):
+      with self.lock:
+        return function(*args)
+
+    return locked_function
+
+  def _sample_function(self):
+    """Returns the function sampling the arrays of the transition tensors."""
+    return functools.partial(self.memory.sample_transition_batch,
+                             self._sample_size)
+
+  def start_prefetching(self, session):
+    """Starts prefetching the batches consumed by the train op.
+
+    Without a prefetch queue, this stages the first batch; the following ones
+    are staged by running `prefetch_batch` along with the train op. With a
+    prefetch queue, a producer thread that is already running is kept.
+
+    Args:
+      session: `tf.Session` running the train op.
+    """
+    if not self.prefetch_depth:
+      session.run(self.prefetch_batch)
+      return
+    if self._producer is not None:
+      return
+    self._stop_producer.clear()
+    self._producer = threading.Thread(target=self._produce, args=(session,),
+                                      name='replay_producer')
+    self._producer.daemon = True
+    self._producer.start()
+
+  def stop_prefetching(self, session):
+    """Stops the producer thread and closes the prefetch queue for good.
+
+    Args:
+      session: `tf.Session` passed to `start_prefetching`.
+    """
+    if self._producer is None:
+      return
+    self._stop_producer.set()
+    session.run(self._close_queue_op)
+    self._producer.join()
+    self._producer = None
+
+  def _produce(self, session):
+    """Samples batches into the prefetch queue until stopped."""
+    while not self._stop_producer.is_set():
+      try:
+        with self.lock:
+          batch = self._sample_batch()
+        session.run(self._enqueue_op, dict(zip(self._enqueue_phs, batch)))
+      except tf.errors.CancelledError:
+        return
+      except Exception:  # pylint: disable=broad-except
+        # Closing the queue makes the train op fail rather than wait forever.
+        tf.logging.exception('Replay producer failed.')
+        session.run(self._close_queue_op)
+        return
+
+  def select_batch(self, index):
+    """Points the sampling tensors to one of the batches of a sess.run.
+
+    Only needed when `num_batches` is larger than 1, in which case the sampling
+    tensors otherwise hold all the sampled transitions.
+
+    Args:
+      index: int, index of the batch, in [0, num_batches).
+    """
+    begin = index * self._batch_size
+    end = begin + self._batch_size
+    self._set_transition_fields(
+        [tensor[begin:end] for tensor in self.transition])
+
   def save(self, checkpoint_dir, iteration_number):
     """Save the underlying replay memory's contents in a file.
 
@@ -569,7 +1198,24 @@ class WrappedReplayMemory(object):
       iteration_number: int, iteration_number to use as a suffix in naming
         numpy checkpoint files.
     """
-    self.memory.save(checkpoint_dir, iteration_number)
+    with self.lock:
+      self.memory.save(checkpoint_dir, iteration_number)
+
+  def snapshot(self, checkpoint_dir, iteration_number):
+    """Copies the underlying replay memory's contents for a deferred save.
+
+    Args:
+      checkpoint_dir: str, directory where to write the numpy checkpointed
+        files.
+      iteration_number: int, iteration_number to use as a suffix in naming
+        numpy checkpoint files.
+
+    Returns:
+      A function writing the checkpoint files, see
+        `OutOfGraphReplayMemory.snapshot`.
+    """
+    with self.lock:
+      return self.memory.snapshot(checkpoint_dir, iteration_number)
 
   def load(self, checkpoint_dir, suffix):
     """Loads the replay memory's state from a saved file.
@@ -579,4 +1225,5 @@ class WrappedReplayMemory(object):
         files.
       suffix: str, suffix to use in numpy checkpoint files.
     """
-    self.memory.load(checkpoint_dir, suffix)
+    with self.lock:
+      self.memory.load(checkpoint_dir, suffix)
@@ -0,0 +1,246 @@
+# coding=utf-8
+"""Tests for replay_memory."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+from environment_utils import ObservationStacker
+import numpy as np
+import replay_memory
+import tensorflow as tf
+
+NUM_ACTIONS = 11
+OBSERVATION_SIZE = 20
+REPLAY_CAPACITY = 50
+BUFFERS = ('observations', 'actions', 'rewards', 'terminals', 'legal_actions')
+
+
+def random_transitions(num_transitions, seed=0, episode_length=5):
+  """Returns the arrays of episodes of random transitions, as for add_batch.
+
+  Observations are binary and legal actions are 0 (legal) or -inf (illegal),
+  as in Hanabi.
+  """
+  rng = np.random.RandomState(seed)
+  terminals = np.zeros(num_transitions, dtype=np.uint8)
+  terminals[episode_length - 1::episode_length] = 1
+  legal_actions = np.where(rng.rand(num_transitions, NUM_ACTIONS) < 0.5,
+                           0.0, -np.inf).astype(np.float32)
+  return (rng.randint(0, 2, (num_transitions, OBSERVATION_SIZE)).astype(
+              np.uint8),
+          rng.randint(0, NUM_ACTIONS, num_transitions).astype(np.int32),
+          rng.uniform(-1.0, 1.0, num_transitions).astype(np.float32),
+          terminals,
+          legal_actions)
+
+
+def add_episodes(memory, num_transitions, seed=0, episode_length=5):
+  """Adds episodes of random transitions to a memory."""
+  memory.add_batch(*random_transitions(num_transitions, seed, episode_length))
+
+
+def add_one_by_one(memory, observations, actions, rewards, terminals,
+                   legal_actions):
+  """Adds transitions to a memory with `add`, as add_batch would."""
+  for transition in zip(observations, actions, rewards, terminals,
+                        legal_actions):
+    memory.add(*transition)
+
+
+def create_memory(stack_size=1, **kwargs):
+  return replay_memory.OutOfGraphReplayMemory(
+      NUM_ACTIONS, OBSERVATION_SIZE, stack_size, REPLAY_CAPACITY,
+      batch_size=8, **kwargs)
+
+
+class OutOfGraphReplayMemoryTest(tf.test.TestCase):
+
+  def assertBuffersEqual(self, memory, expected):
+    self.assertEqual(int(memory.add_count), int(expected.add_count))
+    # Rows that were never written hold whatever np.empty left in them.
+    num_rows = min(int(expected.add_count), REPLAY_CAPACITY)
+    for name in BUFFERS:
+      np.testing.assert_array_equal(getattr(memory, name)[:num_rows],
+                                    getattr(expected, name)[:num_rows])
+
+  def assertBatchesEqual(self, batch, expected):
+    self.assertEqual(len(batch), len(expected))
+    for array, expected_array in zip(batch, expected):
+      self.assertEqual(array.dtype, expected_array.dtype)
+      np.testing.assert_array_equal(array, expected_array)
+
+  def _sample_like(self, memory, expected):
+    """Asserts both memories sample the same batch at random valid indices."""
+    indices = expected.sample_index_batch(8)
+    self.assertBatchesEqual(memory.sample_transition_batch(indices=indices),
+                            expected.sample_transition_batch(indices=indices))
+
+  def testPackedObservationsSampleLikeUnpackedOnes(self):
+    for stack_size in (1, 3):
+      memory = create_memory(stack_size, pack_observations=True)
+      expected = create_memory(stack_size)
+      for seed in range(4):
+        add_episodes(memory, 20, seed=seed)
+        add_episodes(expected, 20, seed=seed)
+        self._sample_like(memory, expected)
+      self.assertEqual(memory.observations.shape,
+                       (REPLAY_CAPACITY, (OBSERVATION_SIZE + 7) // 8))
+      np.testing.assert_array_equal(
+          memory.get_observation_stack(REPLAY_CAPACITY - 1),
+          expected.get_observation_stack(REPLAY_CAPACITY - 1))
+
+  def testPackedLegalActionsSampleLikeFloatOnes(self):
+    memory = create_memory(pack_legal_actions=True)
+    expected = create_memory()
+    for seed in range(4):
+      add_episodes(memory, 20, seed=seed)
+      add_episodes(expected, 20, seed=seed)
+      self._sample_like(memory, expected)
+    self.assertEqual(memory.legal_actions.shape,
+                     (REPLAY_CAPACITY, (NUM_ACTIONS + 7) // 8))
+    self.assertEqual(memory.legal_actions.dtype, np.uint8)
+
+  def testAddBatchMatchesAdd(self):
+    for stack_size in (1, 3):
+      for kwargs in ({}, {'pack_observations': True,
+                          'pack_legal_actions': True}):
+        memory = create_memory(stack_size, **kwargs)
+        expected = create_memory(stack_size, **kwargs)
+        for seed in range(5):
+          # Episodes of 7 moves do not divide the capacity, so the batches
+          # also wrap around the end of the buffers.
+          transitions = random_transitions(23, seed=seed, episode_length=7)
+          memory.add_batch(*transitions)
+          add_one_by_one(expected, *transitions)
+          self.assertBuffersEqual(memory, expected)
+          np.testing.assert_array_equal(memory.invalid_range,
+                                        expected.invalid_range)
+
+  def testStatesMatchTheObservationStacker(self):
+    stack_size = 3
+    memory = create_memory(stack_size)
+    stacker = ObservationStacker(stack_size, OBSERVATION_SIZE, num_players=1)
+    observations = random_transitions(12, episode_length=6)[0]
+    add_episodes(memory, 12, episode_length=6)
+    for episode in range(2):
+      stacker.reset_stack()
+      for move in range(6):
+        stacker.add_observation(observations[6 * episode + move], 0)
+        # Each episode starts with stack_size - 1 padding frames.
+        index = (episode + 1) * (stack_size - 1) + 6 * episode + move
+        state = memory.get_observation_stack(index)
+        self.assertEqual(state.shape, (OBSERVATION_SIZE, stack_size))
+        np.testing.assert_array_equal(state.T.reshape(-1),
+                                      stacker.get_observation_stack(0))
+
+  def testMemoryMappedBuffersAreReopened(self):
+    memmap_dir = os.path.join(self.get_temp_dir(), 'memmap')
+    checkpoint_dir = os.path.join(self.get_temp_dir(), 'checkpoints')
+    os.makedirs(checkpoint_dir)
+    memory = create_memory(memmap_dir=memmap_dir)
+    self.assertIsInstance(memory.observations, np.memmap)
+    add_episodes(memory, 60)
+    memory.save(checkpoint_dir, 0)
+    expected = create_memory()
+    add_episodes(expected, 60)
+
+    restored = create_memory(memmap_dir=memmap_dir)
+    restored.load(checkpoint_dir, 0)
+    self.assertBuffersEqual(restored, expected)
+    self._sample_like(restored, expected)
+
+  def testMemoryMappedBuffersMustExistToLoad(self):
+    checkpoint_dir = self.get_temp_dir()
+    memory = create_memory(memmap_dir=os.path.join(checkpoint_dir, 'memmap'))
+    add_episodes(memory, 20)
+    memory.save(checkpoint_dir, 0)
+    # Buffers mapped from a fresh directory hold none of the checkpoint.
+    restored = create_memory(
+        memmap_dir=os.path.join(checkpoint_dir, 'other_memmap'))
+    with self.assertRaises(tf.errors.NotFoundError):
+      restored.load(checkpoint_dir, 0)
+
+  def testChunkedCheckpointsRestoreTheMemory(self):
+    checkpoint_dir = self.get_temp_dir()
+    memory = create_memory(chunked_checkpoints=True)
+    add_episodes(memory, 60)
+    memory.save(checkpoint_dir, 0)
+    self.assertTrue(os.path.exists(
+        os.path.join(checkpoint_dir, 'observations_ckpt.0.chunks')))
+    # Either format is loaded regardless of the setting.
+    restored = create_memory()
+    restored.load(checkpoint_dir, 0)
+    self.assertBuffersEqual(restored, memory)
+
+  def testTruncatedChunkedCheckpointsAreNotLoaded(self):
+    checkpoint_dir = self.get_temp_dir()
+    memory = create_memory(chunked_checkpoints=True)
+    add_episodes(memory, 20)
+    memory.save(checkpoint_dir, 0)
+    filename = os.path.join(checkpoint_dir, 'rewards_ckpt.0.chunks')
+    with open(filename, 'rb') as f:
+      data = f.read()
+    with open(filename, 'wb') as f:
+      f.write(data[:-4])
+    restored = create_memory(chunked_checkpoints=True)
+    add_episodes(restored, 20, seed=1)
+    observations = restored.observations.copy()
+    with self.assertRaises(tf.errors.DataLossError):
+      restored.load(checkpoint_dir, 0)
+    # Files are checked before any of them is loaded.
+    np.testing.assert_array_equal(restored.observations, observations)
+
+  def testSnapshotsWriteTheMemoryAsItWasTaken(self):
+    for full_checkpoint_period in (None, 2):
+      checkpoint_dir = os.path.join(self.get_temp_dir(),
+                                    str(full_checkpoint_period))
+      os.makedirs(checkpoint_dir)
+      memory = create_memory(full_checkpoint_period=full_checkpoint_period)
+      expected = create_memory()
+      for iteration in range(3):
+        add_episodes(memory, 20, seed=iteration)
+        add_episodes(expected, 20, seed=iteration)
+        write_checkpoint = memory.snapshot(checkpoint_dir, iteration)
+        # Transitions added before the snapshot is written are not in it.
+        add_episodes(memory, 15, seed=10 + iteration)
+        write_checkpoint()
+        restored = create_memory(full_checkpoint_period=full_checkpoint_period)
+        restored.load(checkpoint_dir, iteration)
+        self.assertBuffersEqual(restored, expected)
+        add_episodes(expected, 15, seed=10 + iteration)
+
+  def testDeltaCheckpointsRestoreTheMemory(self):
+    checkpoint_dir = self.get_temp_dir()
+    memory = create_memory(full_checkpoint_period=3)
+    for iteration in range(7):
+      # More transitions than the capacity also wrap the buffers around.
+      add_episodes(memory, 15 + 10 * (iteration % 4), seed=iteration)
+      memory.save(checkpoint_dir, iteration)
+      is_delta = iteration % 3 != 0
+      delta_file = os.path.join(checkpoint_dir,
+                                'delta_ckpt.{}.gz'.format(iteration))
+      observations_file = os.path.join(
+          checkpoint_dir, 'observations_ckpt.{}.gz'.format(iteration))
+      self.assertEqual(os.path.exists(delta_file), is_delta)
+      self.assertEqual(os.path.exists(observations_file), not is_delta)
+      restored = create_memory(full_checkpoint_period=3)
+      restored.load(checkpoint_dir, iteration)
+      self.assertBuffersEqual(restored, memory)
+
+  def testDeltaCheckpointsKeepTheFilesOfTheirChain(self):
+    checkpoint_dir = self.get_temp_dir()
+    memory = create_memory(full_checkpoint_period=10)
+    for iteration in range(replay_memory.CHECKPOINT_DURATION + 3):
+      add_episodes(memory, 5, seed=iteration)
+      memory.save(checkpoint_dir, iteration)
+    # The full checkpoint of iteration 0 starts the chain of the latest one.
+    restored = create_memory(full_checkpoint_period=10)
+    restored.load(checkpoint_dir, replay_memory.CHECKPOINT_DURATION + 2)
+    self.assertBuffersEqual(restored, memory)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,255 @@
+# coding=utf-8
+"""CPU budgets of the roles sharing a training process.
+
+A training process runs three roles which compete for cores:
+
+  learner      the TensorFlow ops of the train op, run by the session's
+               intra-op and inter-op thread pools.
+  actor        the TensorFlow ops selecting the agent's actions. They run in
+               the same session, on their own inter-op pool if given one.
+  environment  the Python thread stepping the environments and encoders,
+               along with the threads it starts once pinned (e.g. the replay
+               producer), which inherit its CPUs.
+
+`ResourceConfig` gives each role a thread budget and optionally a set of CPUs,
+and is configured from gin, e.g.:
+
+  ResourceConfig.learner_intra_op_threads = 4
+  ResourceConfig.learner_cpus = '0-3'
+  ResourceConfig.environment_cpus = '4'
+
+The TensorFlow thread pools are created with the session and inherit the CPUs
+of the creating thread, so the actor pool runs on the learner's CPUs. Creating
+the session leaves the calling thread where it was: the environment thread is
+only moved to its CPUs by an explicit `pin_environment_thread`, which
+`run_experiment` calls before the training loop. Without
+a budget TensorFlow sizes each pool for every core of the machine, which
+oversubscribes the cores as soon as several processes share a node.
+
+The layout a configuration results in can be printed with:
+
+  python resources.py --gin_files configs/hanabi_rainbow.gin
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import contextlib
+import os
+
+import gin.tf
+import tensorflow as tf
+
+
+def parse_cpus(cpus):
+  """Returns a set of CPUs given as a list or as a string like '0-3,8'.
+
+  Args:
+    cpus: None, an iterable of ints, or a comma separated string of CPUs and
+      inclusive ranges of CPUs.
+
+  Returns:
+    A frozenset of ints, or None if cpus is None.
+  """
+  if cpus is None:
+    return None
+  if isinstance(cpus, str):
+    parsed = set()
+    for part in cpus.split(','):
+      first, _, last = part.strip().partition('-')
+      parsed.update(range(int(first), int(last or first) + 1))
+    return frozenset(parsed)
+  return frozenset(int(cpu) for cpu in cpus)
+
+
+def available_cpus():
+  """Returns the CPUs the calling thread may run on."""
+  if hasattr(os, 'sched_getaffinity'):
+    return frozenset(os.sched_getaffinity(0))
+  return frozenset(range(os.cpu_count() or 1))
+
+
+def set_cpus(cpus):
+  """Restricts the calling thread, and the threads it starts, to some CPUs.
+
+  Args:
+    cpus: set of ints, or None to leave the affinity unchanged.
+  """
+  if cpus is None:
+    return
+  if not hasattr(os, 'sched_setaffinity'):
+    tf.logging.warning('CPU affinity is not supported on this platform, '
+                       'ignoring the CPUs %s.', sorted(cpus))
+    return
+  os.sched_setaffinity(0, cpus)
+
+
+@contextlib.contextmanager
+def _cpus(cpus):
+  """Restricts the calling thread to some CPUs within the context."""
+  previous = available_cpus()
+  set_cpus(cpus)
+  try:
+    yield
+  finally:
+    if cpus is not None:
+      set_cpus(previous)
+
+
+@gin.configurable
+class ResourceConfig(object):
+  """Thread counts and CPU sets of the learner, actor and environment roles."""
+
+  def __init__(self,
+               learner_intra_op_threads=0,
+               learner_inter_op_threads=0,
+               actor_inter_op_threads=0,
+               learner_cpus=None,
+               environment_cpus=None):
+    """Initializes the configuration.
+
+    Args:
+      learner_intra_op_threads: int, threads running the parallel kernels of
+        every op of the session, or 0 for one per CPU of the learner.
+      learner_inter_op_threads: int, threads running independent ops of the
+        train op, or 0 for one per CPU of the learner.
+      actor_inter_op_threads: int, if positive, threads of a separate
+        inter-op pool for action selection. Otherwise actions are selected on
+        the learner's pool.
+      learner_cpus: list of ints or str like '0-3,8', CPUs of the session's
+        threads. If None, all the CPUs available to the process.
+      environment_cpus: list of ints or str, CPUs of the thread stepping the
+        environments, applied by `pin_environment_thread`. If None, left
+        unchanged.
+    """
+    self.learner_intra_op_threads = learner_intra_op_threads
+    self.learner_inter_op_threads = learner_inter_op_threads
+    self.actor_inter_op_threads = actor_inter_op_threads
+    self.learner_cpus = parse_cpus(learner_cpus)
+    self.environment_cpus = parse_cpus(environment_cpus)
+
+  def session_config(self):
+    """Returns the `tf.ConfigProto` of the learner session."""
+    config = tf.ConfigProto(
+        allow_soft_placement=True,
+        intra_op_parallelism_threads=self.learner_intra_op_threads,
+        inter_op_parallelism_threads=self.learner_inter_op_threads)
+    if self.actor_inter_op_threads:
+      # Runs use the first pool unless their options select another one.
+      config.session_inter_op_thread_pool.add(
+          num_threads=self.learner_inter_op_threads)
+      config.session_inter_op_thread_pool.add(
+          num_threads=self.actor_inter_op_threads)
+    return config
+
+  def actor_run_options(self):
+    """Returns the `tf.RunOptions` of action selection runs, or None."""
+    if not self.actor_inter_op_threads:
+      return None
+    return tf.RunOptions(inter_op_thread_pool=1)
+
+  def create_session(self):
+    """Creates the session, leaving the CPUs of the calling thread unchanged.
+
+    Returns:
+      A `tf.Session` whose thread pools run on the learner's CPUs.
+    """
+    with _cpus(self.learner_cpus):
+      return tf.Session('', config=self.session_config())
+
+  def pin_environment_thread(self):
+    """Moves the calling thread to the environment's CPUs for good.
+
+    Threads started by the calling thread from then on inherit these CPUs,
+    while the threads it started before keep the ones they had. In a training
+    process pinned by `run_experiment`, the replay producer, which starts with
+    the first training step, runs on the environment's CPUs, while the
+    priority updater of the agent's replay memory, the `MetricsWriter` and the
+    `BackgroundCheckpointWriter` keep the CPUs of the process.
+    """
+    if self.environment_cpus is not None:
+      tf.logging.info('Pinning the environment thread to the CPUs %s.',
+                      _format_cpus(sorted(self.environment_cpus)))
+    set_cpus(self.environment_cpus)
+
+  def layout(self):
+    """Returns the effective threads and CPUs of each role.
+
+    Returns:
+      A dict mapping each role to a dict with its compute `threads` and sorted
+      `cpus`, the learner also having its `inter_op_threads`, along with the
+      `available_cpus` of the process and whether the compute threads of the
+      roles outnumber the CPUs they run on (`oversubscribed`). Inter-op
+      threads mostly dispatch ops, so they are not counted as compute
+      threads.
+    """
+    available = available_cpus()
+    learner_cpus = available & (self.learner_cpus or available)
+    environment_cpus = available & (self.environment_cpus or available)
+    # TensorFlow sizes unset pools by the CPUs the session may run on.
+    intra_op = self.learner_intra_op_threads or len(learner_cpus)
+    inter_op = self.learner_inter_op_threads or len(learner_cpus)
+    roles = {
+        'learner': {'threads': intra_op, 'inter_op_threads': inter_op,
+                    'cpus': sorted(learner_cpus)},
+        'actor': {'threads': self.actor_inter_op_threads,
+                  'cpus': sorted(learner_cpus)},
+        'environment': {'threads': 1, 'cpus': sorted(environment_cpus)},
+    }
+    threads = sum(role['threads'] for role in roles.values())
+    cpus = learner_cpus | environment_cpus
+    return {'roles': roles,
+            'available_cpus': sorted(available),
+            'oversubscribed': threads > len(cpus)}
+
+  def log_layout(self):
+    """Logs the effective layout of the roles."""
+    for line in format_layout(self.layout()).splitlines():
+      tf.logging.info(line)
+
+
+def _format_cpus(cpus):
+  """Returns sorted CPUs as a string of ranges, like '0-3,8'."""
+  ranges = []
+  for cpu in cpus:
+    if ranges and ranges[-1][1] == cpu - 1:
+      ranges[-1][1] = cpu
+    else:
+      ranges.append([cpu, cpu])
+  return ','.join(str(first) if first == last else '{}-{}'.format(first, last)
+                  for first, last in ranges)
+
+
+def format_layout(layout):
+  """Returns a layout as lines of text."""
+  lines = ['CPU layout (available: {}):'.format(
+      _format_cpus(layout['available_cpus']))]
+  for role in ('learner', 'actor', 'environment'):
+    values = layout['roles'][role]
+    threads = values['threads'] or 'shares the learner pool'
+    if 'inter_op_threads' in values:
+      threads = '{} (+{} inter-op)'.format(threads, values['inter_op_threads'])
+    lines.append('  {:<12} threads: {:<24} cpus: {}'.format(
+        role, threads, _format_cpus(values['cpus'])))
+  if layout['oversubscribed']:
+    lines.append('  The roles have more compute threads than CPUs.')
+  return '\n'.join(lines)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--gin_files', nargs='*', default=[],
+                      help='Gin configuration files.')
+  parser.add_argument('--gin_bindings', nargs='*', default=[],
+                      help='Gin bindings, e.g. "ResourceConfig.learner_cpus='
+                      '\'0-3\'".')
+  args = parser.parse_args()
+  gin.parse_config_files_and_bindings(args.gin_files, args.gin_bindings,
+                                      skip_unknown=True)
+  print(format_layout(ResourceConfig().layout()))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,37 @@
+# coding=utf-8
+"""Tests for resources."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import resources
+import tensorflow as tf
+
+
+class ResourceConfigTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(ResourceConfigTest, self).setUp()
+    cpus = resources.available_cpus()
+    self.addCleanup(resources.set_cpus, cpus)
+    self.config = resources.ResourceConfig(learner_cpus=sorted(cpus),
+                                           environment_cpus=[min(cpus)])
+
+  def testParseCpus(self):
+    self.assertEqual(resources.parse_cpus('0-3, 8'), {0, 1, 2, 3, 8})
+    self.assertEqual(resources.parse_cpus([2, 1]), {1, 2})
+    self.assertIsNone(resources.parse_cpus(None))
+
+  def testCreateSessionKeepsTheCpusOfTheCallingThread(self):
+    cpus = resources.available_cpus()
+    self.config.create_session().close()
+    self.assertEqual(resources.available_cpus(), cpus)
+
+  def testPinEnvironmentThread(self):
+    self.config.pin_environment_thread()
+    self.assertEqual(resources.available_cpus(), self.config.environment_cpus)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -30,79 +30,69 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import threading
 import time
 
 from third_party.dopamine import checkpointer
 from third_party.dopamine import iteration_statistics
-import dqn_agent
+from third_party.dopamine import logger
+# Re-exported for train.py and existing callers.
+from environment_utils import create_environment
+from environment_utils import create_obs_stacker
+from environment_utils import format_legal_moves
+from environment_utils import ObservationStacker
+from environment_utils import parse_observations
 import gin.tf
-from hanabi_learning_environment import rl_env
+from hanabi_learning_environment import instrumentation
+import memory_report
+import metrics_writer
 import numpy as np
-import rainbow_agent
+import resources
+import streaming_logger
 import tensorflow as tf
 import datetime
-from torch.utils.tensorboard import SummaryWriter
-import pandas as pd
 
 LENIENT_SCORE = False
 
-global_score_per_episode = []
 global_episode_counter = 0
 
-class ObservationStacker(object):
-  """Class for stacking agent observations."""
+class BackgroundCheckpointWriter(object):
+  """Writes checkpoints on a background thread, one at a time."""
 
-  def __init__(self, history_size, observation_size, num_players):
-    """Initializer for observation stacker.
+  def __init__(self):
+    self._thread = None
+    self._error = None
 
-    Args:
-      history_size: int, number of time steps to stack.
-      observation_size: int, size of observation vector on one time step.
-      num_players: int, number of players.
-    """
-    self._history_size = history_size
-    self._observation_size = observation_size
-    self._num_players = num_players
-    self._obs_stacks = list()
-    for _ in range(0, self._num_players):
-      self._obs_stacks.append(np.zeros(self._observation_size *
-                                       self._history_size))
-
-  def add_observation(self, observation, current_player):
-    """Adds observation for the current player.
+  def submit(self, write_fn):
+    """Starts writing a checkpoint, after the previous one has finished.
 
     Args:
-      observation: observation vector for current player.
-      current_player: int, current player id.
+      write_fn: function without arguments performing all the writes of one
+        checkpoint, in order.
     """
-    self._obs_stacks[current_player] = np.roll(self._obs_stacks[current_player],
-                                               -self._observation_size)
-    self._obs_stacks[current_player][(self._history_size - 1) *
-                                     self._observation_size:] = observation
-
-  def get_observation_stack(self, current_player):
-    """Returns the stacked observation for current player.
-
-    Args:
-      current_player: int, current player id.
+    self.wait()
+    self._thread = threading.Thread(target=self._run, args=(write_fn,),
+                                    name='checkpoint_writer')
+    self._thread.start()
+
+  def _run(self, write_fn):
+    try:
+      write_fn()
+    except Exception as e:  # pylint: disable=broad-except
+      self._error = e
+
+  def wait(self):
+    """Blocks until the checkpoint in flight, if any, has been written.
+
+    Raises:
+      Exception: the error raised while writing the last checkpoint, if any.
     """
-
-    return self._obs_stacks[current_player]
-
-  def reset_stack(self):
-    """Resets the observation stacks to all zero."""
-
-    for i in range(0, self._num_players):
-      self._obs_stacks[i].fill(0.0)
-
-  @property
-  def history_size(self):
-    """Returns number of steps to stack."""
-    return self._history_size
-
-  def observation_size(self):
-    """Returns the size of the observation vector after history stacking."""
-    return self._observation_size * self._history_size
+    if self._thread is not None:
+      self._thread.join()
+      self._thread = None
+    if self._error is not None:
+      error, self._error = self._error, None
+      raise error
 
 
 def load_gin_configs(gin_files, gin_bindings):
@@ -120,37 +110,27 @@ def load_gin_configs(gin_files, gin_bindings):
 
 
 @gin.configurable
-def create_environment(game_type='Hanabi-Full', num_players=2):
-  """Creates the Hanabi environment.
+def create_experiment_logger(logging_dir, logger_type='pickle'):
+  """Creates the experiment logger.
 
   Args:
-    game_type: Type of game to play. Currently the following are supported:
-      Hanabi-Full: Regular game.
-      Hanabi-Small: The small version of Hanabi, with 2 cards and 2 colours.
-    num_players: Int, number of players to play this game.
+    logging_dir: str, directory to which logs are written.
+    logger_type: Type of logger. Currently the following are supported:
+      pickle: pickles all the statistics so far to a new file every
+        iteration.
+      streaming: appends each iteration's statistics to a JSON lines file,
+        see `streaming_logger.load_log`. Resuming from a checkpoint written
+        with the pickle logger starts the file with the checkpoint's logs.
 
   Returns:
-    A Hanabi environment.
+    A logger object.
   """
-  return rl_env.make(
-      environment_name=game_type, num_players=num_players, pyhanabi_path=None)
-
-
-@gin.configurable
-def create_obs_stacker(environment, history_size=4):
-  """Creates an observation stacker.
-
-  Args:
-    environment: environment object.
-    history_size: int, number of steps to stack.
-
-  Returns:
-    An observation stacker object.
-  """
-
-  return ObservationStacker(history_size,
-                            environment.vectorized_observation_shape()[0],
-                            environment.players)
+  if logger_type == 'streaming':
+    return streaming_logger.StreamingLogger(logging_dir)
+  elif logger_type == 'pickle':
+    return logger.Logger(logging_dir)
+  else:
+    raise ValueError('Expected valid logger_type, got {}'.format(logger_type))
 
 
 @gin.configurable
@@ -168,11 +148,14 @@ def create_agent(environment, obs_stacker, convention_encoder, agent_type='DQN')
   Raises:
     ValueError: if an unknown agent type is requested.
   """
+  # The agents are imported on first use, as they build on tf.contrib.
   if agent_type == 'DQN':
+    import dqn_agent  # pylint: disable=g-import-not-at-top
     return dqn_agent.DQNAgent(observation_size=obs_stacker.observation_size(),
                               num_actions=convention_encoder.convention_action_space,
                               num_players=environment.players)
   elif agent_type == 'Rainbow':
+    import rainbow_agent  # pylint: disable=g-import-not-at-top
     return rainbow_agent.RainbowAgent(
         observation_size=obs_stacker.observation_size(),
         num_actions=convention_encoder.convention_action_space,
@@ -182,7 +165,8 @@ def create_agent(environment, obs_stacker, convention_encoder, agent_type='DQN')
 
 
 def initialize_checkpointing(agent, experiment_logger, checkpoint_dir,
-                             checkpoint_file_prefix='ckpt'):
+                             checkpoint_file_prefix='ckpt',
+                             logging_file_prefix='log'):
   """Reloads the latest checkpoint if it exists.
 
   The following steps will be taken:
@@ -205,6 +189,7 @@ def initialize_checkpointing(agent, experiment_logger, checkpoint_dir,
       checkpoint.
     checkpoint_dir: str, the directory containing the checkpoints.
     checkpoint_file_prefix: str, the checkpoint file prefix.
+    logging_file_prefix: str, prefix of the log files the experiment writes.
 
   Returns:
     start_iteration: int, The iteration number to start the experiment from.
@@ -226,7 +211,8 @@ def initialize_checkpointing(agent, experiment_logger, checkpoint_dir,
         checkpoint_dir, latest_checkpoint_version, dqn_dictionary):
       assert 'logs' in dqn_dictionary
       assert 'current_iteration' in dqn_dictionary
-      experiment_logger.data = dqn_dictionary['logs']
+      unbundle_logs(experiment_logger, dqn_dictionary['logs'],
+                    logging_file_prefix)
       start_iteration = dqn_dictionary['current_iteration'] + 1
       tf.logging.info('Reloaded checkpoint and will start from iteration %d',
                       start_iteration)
@@ -234,70 +220,53 @@ def initialize_checkpointing(agent, experiment_logger, checkpoint_dir,
   return start_iteration, experiment_checkpointer
 
 
-def format_legal_moves(legal_moves, action_dim):
-  """Returns formatted legal moves.
-
-  This function takes a list of actions and converts it into a fixed size vector
-  of size action_dim. If an action is legal, its position is set to 0 and -Inf
-  otherwise.
-  Ex: legal_moves = [0, 1, 3], action_dim = 5
-      returns [0, 0, -Inf, 0, -Inf]
+def bundle_logs(experiment_logger):
+  """Returns what a checkpoint stores of the experiment logs.
 
   Args:
-    legal_moves: list of legal actions.
-    action_dim: int, number of actions.
+    experiment_logger: A `Logger` or `StreamingLogger` object.
 
   Returns:
-    a vector of size action_dim.
+    A copy of the logged data, or for a `StreamingLogger` only the size of its
+      log files, as their contents are already on disk.
   """
-  new_legal_moves = np.full(action_dim, -float('inf'))
-  if legal_moves:
-    new_legal_moves[legal_moves] = 0
-  return new_legal_moves
+  if isinstance(experiment_logger, streaming_logger.StreamingLogger):
+    return experiment_logger.bundle()
+  return dict(experiment_logger.data)
 
 
-def parse_observations(observations, num_actions, obs_stacker):
-  """Deconstructs the rich observation data into relevant components.
+def unbundle_logs(experiment_logger, logs, logging_file_prefix='log'):
+  """Restores the experiment logs stored by `bundle_logs`.
 
   Args:
-    observations: dict, containing full observations.
-    num_actions: int, The number of available actions.
-    obs_stacker: Observation stacker object.
-
-  Returns:
-    current_player: int, Whose turn it is.
-    legal_moves: `np.array` of floats, of length num_actions, whose elements
-      are -inf for indices corresponding to illegal moves and 0, for those
-      corresponding to legal moves.
-    observation_vector: Vectorized observation for the current player.
+    experiment_logger: A `Logger` or `StreamingLogger` object.
+    logs: The logs from the checkpoint.
+    logging_file_prefix: str, prefix of the log files the experiment writes.
   """
-  current_player = observations['current_player']
-  current_player_observation = (
-      observations['player_observations'][current_player])
-
-  legal_moves = current_player_observation['legal_moves_as_int']
-  legal_moves = format_legal_moves(legal_moves, num_actions)
-
-  observation_vector = current_player_observation['vectorized']
-  obs_stacker.add_observation(observation_vector, current_player)
-  observation_vector = obs_stacker.get_observation_stack(current_player)
-
-  return current_player, legal_moves, observation_vector
+  if isinstance(experiment_logger, streaming_logger.StreamingLogger):
+    # Checkpoints written with a pickle logger hold the data itself, which
+    # then starts the log file of the resumed experiment.
+    if any(key.startswith('iter') for key in logs):
+      experiment_logger.import_data(logging_file_prefix, logs)
+    else:
+      experiment_logger.unbundle(logs)
+  else:
+    experiment_logger.data = logs
 
 
-def run_one_episode(agent, environment, obs_stacker, summary_writer, convention_encoder):
+def run_one_episode(agent, environment, obs_stacker, metrics, convention_encoder):
   """Runs the agent on a single game of Hanabi in self-play mode.
 
   Args:
     agent: Agent playing Hanabi.
     environment: The Hanabi environment.
     obs_stacker: Observation stacker object.
+    metrics: `MetricsWriter` recording the score of training episodes.
 
   Returns:
     step_number: int, number of actions in this episode.
     total_reward: float, undiscounted return for this episode.
   """
-  global global_score_per_episode
   global global_episode_counter
 
   ccr_gamma = 1
@@ -387,18 +356,15 @@ def run_one_episode(agent, environment, obs_stacker, summary_writer, convention_
   agent.end_episode(reward_since_last_action)
               
   if not agent.eval_mode:  
-    global_score_per_episode.append(score)
     global_episode_counter += 1
-    # summary_writer.add_event("reward_per_eps", episode_return, global_reward_per_episode)
-    # tf.summary.scalar("lr", episode_return)
-    summary_writer.add_scalar("score/eps", score, global_episode_counter)
+    metrics.record_episode(score)
 
   tf.logging.info('EPISODE: %d %g', step_number, total_reward)
   return step_number, total_reward
 
 
 def run_one_phase(agent, environment, obs_stacker, min_steps, statistics,
-                  run_mode_str, summary_writer, convention_encoder):
+                  run_mode_str, metrics, convention_encoder):
   """Runs the agent/environment loop until a desired number of steps.
 
   Args:
@@ -422,7 +388,7 @@ def run_one_phase(agent, environment, obs_stacker, min_steps, statistics,
 
   while step_count < min_steps:
     episode_length, episode_return = run_one_episode(agent, environment,
-                                                     obs_stacker, summary_writer, convention_encoder)
+                                                     obs_stacker, metrics, convention_encoder)
     statistics.append({
         '{}_episode_lengths'.format(run_mode_str): episode_length,
         '{}_episode_returns'.format(run_mode_str): episode_return
@@ -443,7 +409,7 @@ def run_one_phase(agent, environment, obs_stacker, min_steps, statistics,
 
 @gin.configurable
 def run_one_iteration(agent, environment, obs_stacker,
-                      iteration, training_steps, summary_writer, convention_encoder,
+                      iteration, training_steps, metrics, convention_encoder,
                       evaluate_every_n=100,
                       num_evaluation_games=100):
   """Runs one iteration of agent/environment interaction.
@@ -471,7 +437,7 @@ def run_one_iteration(agent, environment, obs_stacker,
   agent.eval_mode = False
   number_steps, sum_returns, num_episodes = (
       run_one_phase(agent, environment, obs_stacker, training_steps, statistics,
-                    'train', summary_writer, convention_encoder))
+                    'train', metrics, convention_encoder))
   time_delta = time.time() - start_time
   tf.logging.info('Average training steps per second: %.2f',
                   number_steps / time_delta)
@@ -486,7 +452,7 @@ def run_one_iteration(agent, environment, obs_stacker,
     agent.eval_mode = True
     # Collect episode data for all games.
     for _ in range(num_evaluation_games):
-      episode_data.append(run_one_episode(agent, environment, obs_stacker, summary_writer, convention_encoder))
+      episode_data.append(run_one_episode(agent, environment, obs_stacker, metrics, convention_encoder))
 
     eval_episode_length, eval_episode_return = map(np.mean, zip(*episode_data))
 
@@ -510,7 +476,7 @@ def log_experiment(experiment_logger, iteration, statistics,
   """Records the results of the current iteration.
 
   Args:
-    experiment_logger: A `Logger` object.
+    experiment_logger: A `Logger` or `StreamingLogger` object.
     iteration: int, iteration number.
     statistics: Object containing statistics to log.
     logging_file_prefix: str, prefix to use for the log files.
@@ -522,23 +488,45 @@ def log_experiment(experiment_logger, iteration, statistics,
 
 
 def checkpoint_experiment(experiment_checkpointer, agent, experiment_logger,
-                          iteration, checkpoint_dir, checkpoint_every_n):
+                          iteration, checkpoint_dir, checkpoint_every_n,
+                          checkpoint_writer=None):
   """Checkpoint experiment data.
 
   Args:
     experiment_checkpointer: A `Checkpointer` object.
     agent: An RL agent.
-    experiment_logger: a Logger object, to include its data in the checkpoint.
+    experiment_logger: a `Logger` or `StreamingLogger` object, to include its
+      data in the checkpoint.
     iteration: int, iteration number for checkpointing.
     checkpoint_dir: str, the directory where to save checkpoints.
     checkpoint_every_n: int, the frequency for writing checkpoints.
+    checkpoint_writer: `BackgroundCheckpointWriter`, if not None the replay
+      memory and the bundle are snapshotted and written in the background.
+      The sentinel file is still written last.
   """
-  if iteration % checkpoint_every_n == 0:
+  if iteration % checkpoint_every_n != 0:
+    return
+  if checkpoint_writer is None:
     agent_dictionary = agent.bundle_and_checkpoint(checkpoint_dir, iteration)
     if agent_dictionary:
       agent_dictionary['current_iteration'] = iteration
-      agent_dictionary['logs'] = experiment_logger.data
+      agent_dictionary['logs'] = bundle_logs(experiment_logger)
       experiment_checkpointer.save_checkpoint(iteration, agent_dictionary)
+    return
+
+  # Do not let the snapshot overlap with the previous checkpoint's writes.
+  checkpoint_writer.wait()
+  agent_dictionary, write_replay = agent.bundle_and_snapshot(checkpoint_dir,
+                                                             iteration)
+  if agent_dictionary:
+    agent_dictionary['current_iteration'] = iteration
+    agent_dictionary['logs'] = bundle_logs(experiment_logger)
+
+    def write_checkpoint():
+      write_replay()
+      experiment_checkpointer.save_checkpoint(iteration, agent_dictionary)
+
+    checkpoint_writer.submit(write_checkpoint)
 
 
 @gin.configurable
@@ -553,27 +541,76 @@ def run_experiment(agent,
                    training_steps=5000,
                    logging_file_prefix='log',
                    log_every_n=1,
-                   checkpoint_every_n=1):
-  """Runs a full experiment, spread over multiple iterations."""
+                   checkpoint_every_n=1,
+                   async_checkpointing=False,
+                   instrument=False,
+                   instrumentation_summaries=False,
+                   profiler=None,
+                   profile_start_iteration=0,
+                   log_memory_report=False):
+  """Runs a full experiment, spread over multiple iterations.
+
+  Args:
+    async_checkpointing: bool, if True checkpoints are written on a background
+      thread while training continues.
+    instrument: bool, if True the timers and counters of `instrumentation` are
+      enabled, and their aggregates are logged with each iteration's
+      statistics.
+    instrumentation_summaries: bool, if True and `instrument` is set, the
+      aggregates are also written to TensorBoard.
+    profiler: `profiling.TrainingProfiler`, if not None it is started at the
+      first iteration from `profile_start_iteration` on.
+    profile_start_iteration: int, iteration at which to start `profiler`.
+    log_memory_report: bool, if True the bytes held by the replay memory,
+      agent, observation stacker and logger are logged with each iteration's
+      statistics.
+    Other arguments are as in `run_one_iteration` and `checkpoint_experiment`.
+  """
   tf.logging.info('Beginning training...')
   if num_iterations <= start_iteration:
     tf.logging.warning('num_iterations (%d) < start_iteration(%d)',
                        num_iterations, start_iteration)
     return
   
+  # Importing torch takes seconds, so only the training process does it.
+  from torch.utils.tensorboard import SummaryWriter  # pylint: disable=g-import-not-at-top
   current_time = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
   # train_log_dir = 'logs/test/' + current_time + '/train'
   # train_summary_writer = tf.summary.FileWriter(train_log_dir)
   writer = SummaryWriter(log_dir="logs/full_hanabi_3p/rainbow_convention_encouded_official_3p_non_lenient_"+current_time)
-  df = pd.DataFrame()
-
-
+  metrics = metrics_writer.MetricsWriter(
+      writer,
+      f"data/rainbow_full_hanabi_encouded_official_3p_non_lenient_{current_time}.csv")
+  checkpoint_writer = BackgroundCheckpointWriter() if async_checkpointing else (
+      None)
+  # Only this thread and the threads it starts from now on, i.e. the replay
+  # producer, move to the environment's CPUs. The writers above and the
+  # priority updater of the agent keep the CPUs of the process.
+  resources.ResourceConfig().pin_environment_thread()
+
+  instrumentation.enable(instrument)
   for iteration in range(start_iteration, num_iterations):
+    if (profiler is not None and not profiler.started and
+        iteration >= profile_start_iteration):
+      profiler.start(iteration)
     start_time = time.time()
     statistics = run_one_iteration(agent, environment, obs_stacker, iteration,
-                                   training_steps, writer, convention_encoder)
+                                   training_steps, metrics, convention_encoder)
     tf.logging.info('Iteration %d took %d seconds', iteration,
                     time.time() - start_time)
+    if instrument:
+      aggregates = instrumentation.collect()
+      for key, value in aggregates.items():
+        statistics[key] = [value]
+      if instrumentation_summaries:
+        metrics.write_scalars(aggregates, iteration)
+    if log_memory_report:
+      report = memory_report.memory_report(agent, obs_stacker,
+                                           experiment_logger)
+      for key, value in memory_report.flatten(report).items():
+        statistics[key] = [value]
+      tf.logging.info('Memory after iteration %d:\n%s', iteration,
+                      memory_report.format_report(report))
     start_time = time.time()
     log_experiment(experiment_logger, iteration, statistics,
                    logging_file_prefix, log_every_n)
@@ -581,9 +618,17 @@ def run_experiment(agent,
                     time.time() - start_time)
     start_time = time.time()
     checkpoint_experiment(experiment_checkpointer, agent, experiment_logger,
-                          iteration, checkpoint_dir, checkpoint_every_n)
+                          iteration, checkpoint_dir, checkpoint_every_n,
+                          checkpoint_writer)
     tf.logging.info('Checkpointing iteration %d took %d seconds', iteration,
                     time.time() - start_time)
 
-  df[0] = global_score_per_episode
-  df.to_csv(f"data/rainbow_full_hanabi_encouded_official_3p_non_lenient_{current_time}.csv") 
\ No newline at end of file
+  # The replay producer thread would otherwise stay blocked on the session.
+  agent.stop_prefetching()
+  if profiler is not None:
+    # Writes the profiles if the experiment ended within the window.
+    profiler.stop()
+  if checkpoint_writer is not None:
+    checkpoint_writer.wait()
+
+  metrics.close() 
\ No newline at end of file
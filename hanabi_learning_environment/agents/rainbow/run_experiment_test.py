@@ -0,0 +1,113 @@
+# coding=utf-8
+"""Tests for the checkpointing and logging of run_experiment."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import threading
+
+from third_party.dopamine import logger
+import run_experiment
+import streaming_logger
+import tensorflow as tf
+
+
+class RecordingCheckpointer(object):
+  """Records the checkpoints `checkpoint_experiment` saves."""
+
+  def __init__(self, events):
+    self._events = events
+    self.data = {}
+
+  def save_checkpoint(self, iteration_number, data):
+    self._events.append(('bundle', iteration_number))
+    self.data[iteration_number] = data
+
+
+class SnapshottingAgent(object):
+  """Agent whose replay writes are recorded, and may be held back."""
+
+  def __init__(self, events):
+    self._events = events
+    self.release = threading.Event()
+    self.release.set()
+
+  def bundle_and_snapshot(self, checkpoint_dir, iteration_number):
+    del checkpoint_dir
+
+    def write_replay():
+      self.release.wait()
+      self._events.append(('replay', iteration_number))
+
+    return {'training_steps': iteration_number}, write_replay
+
+
+class BackgroundCheckpointWriterTest(tf.test.TestCase):
+
+  def testWaitRaisesTheWriteError(self):
+    writer = run_experiment.BackgroundCheckpointWriter()
+
+    def write():
+      raise IOError('disk full')
+
+    writer.submit(write)
+    with self.assertRaises(IOError):
+      writer.wait()
+    # The error is only raised once.
+    writer.wait()
+
+  def testCheckpointsAreWrittenInTheBackgroundInOrder(self):
+    events = []
+    agent = SnapshottingAgent(events)
+    checkpointer = RecordingCheckpointer(events)
+    experiment_logger = logger.Logger(self.get_temp_dir())
+    writer = run_experiment.BackgroundCheckpointWriter()
+    agent.release.clear()
+    run_experiment.checkpoint_experiment(checkpointer, agent,
+                                         experiment_logger, 0,
+                                         self.get_temp_dir(), 1,
+                                         checkpoint_writer=writer)
+    # The replay write is held back, so the checkpoint is still in flight.
+    self.assertEqual(events, [])
+    agent.release.set()
+    run_experiment.checkpoint_experiment(checkpointer, agent,
+                                         experiment_logger, 1,
+                                         self.get_temp_dir(), 1,
+                                         checkpoint_writer=writer)
+    writer.wait()
+    # The bundle, and so the sentinel, follow the replay files.
+    self.assertEqual(events, [('replay', 0), ('bundle', 0),
+                              ('replay', 1), ('bundle', 1)])
+    self.assertEqual(checkpointer.data[1],
+                     {'training_steps': 1, 'current_iteration': 1,
+                      'logs': {}})
+
+
+class ExperimentLoggerTest(tf.test.TestCase):
+
+  def testThePickleLoggerIsTheDefault(self):
+    self.assertIsInstance(
+        run_experiment.create_experiment_logger(self.get_temp_dir()),
+        logger.Logger)
+
+  def testPickleLogsStartTheStreamingLog(self):
+    logging_dir = self.get_temp_dir()
+    pickle_logger = logger.Logger(logging_dir)
+    for iteration in range(3):
+      run_experiment.log_experiment(pickle_logger, iteration,
+                                    {'returns': [iteration]})
+    logs = run_experiment.bundle_logs(pickle_logger)
+
+    # The experiment resumes from iteration 3 with the streaming logger.
+    experiment_logger = streaming_logger.StreamingLogger(logging_dir)
+    run_experiment.unbundle_logs(experiment_logger, logs)
+    run_experiment.log_experiment(experiment_logger, 3, {'returns': [3]})
+    data = streaming_logger.load_log(os.path.join(logging_dir, 'log.jsonl'))
+    self.assertEqual(list(data), ['iter0', 'iter1', 'iter2', 'iter3'])
+    self.assertEqual(data['iter1'], {'returns': [1]})
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -6,6 +6,7 @@
 #   to make the observation usable with the conventions. 
 
 import numpy as np
+from hanabi_learning_environment import instrumentation
 from hanabi_learning_environment import rl_env
 
 def format_legal_moves(legal_moves, action_dim):    # Extracted from run_experiment.py for ease of use and debugging
@@ -52,6 +53,7 @@ class standalone_encoder():
         self.environment_action_space = env.action_space
         self.convention_action_space = 13
 
+    @instrumentation.timed("conventions/encode_action")
     def encode_action(self, current_player, other_player, agent_action, env): 
         # This function is the output layer after an agent chooses a convention and before the action is sent to the environment. 
         # It translates the chosen action/convention into an environment action based on the convention principles. 
@@ -144,6 +146,7 @@ class standalone_encoder():
             
         return environment_action
     
+    @instrumentation.timed("conventions/available_conventions")
     def available_conventions(self, current_player, other_player, env):
         # This function is at the input of the network to extract the current available conventions based on the current observation of a player. 
         # It also incorporates action masking and formatting to allow for the Dopamine agent to interpret it correctly.
@@ -253,6 +256,7 @@ class standalone_encoder():
 
         return legal_conventions
     
+    @instrumentation.timed("conventions/make_env_usable")
     def make_env_usable(self, env):
         # This function extracts all the needed information from the current state and player observation to determine which conventions are available.
         # It receives the entire env as input to extract all the needed game features, but never gives an agent more information than it already
@@ -358,6 +362,7 @@ class simple_combined_encoder():
         # self.convention_action_space = self.environment_action_space + 13 # Full
         self.convention_action_space = self.environment_action_space + 5  # Simplified/augmented
 
+    @instrumentation.timed("conventions/encode_action")
     def encode_action(self, agent_action, env):  
         # This function is the output layer after an agent chooses a convention and before the action is sent to the environment. 
         # It translates the chosen action/convention into an environment action based on the convention principles.
@@ -455,6 +460,7 @@ class simple_combined_encoder():
             
         return environment_action
     
+    @instrumentation.timed("conventions/available_conventions")
     def available_conventions(self, env):
         # This function is at the input of the network to extract the current available conventions based on the current observation of a player. 
         # It also incorporates action masking and formatting to allow for the Dopamine agent to interpret it correctly.
@@ -558,6 +564,7 @@ class simple_combined_encoder():
 
         return legal_conventions
     
+    @instrumentation.timed("conventions/make_env_usable")
     def make_env_usable(self, env):
         # This function extracts all the needed information from the current state and player observation to determine which conventions are available.
         # It receives the entire env as input to extract all the needed game features, but never gives an agent more information than it already
@@ -655,6 +662,7 @@ class simple_transfer_encoder():
         # self.convention_action_space = self.environment_action_space + 8
         self.convention_action_space = self.environment_action_space + 5
 
+    @instrumentation.timed("conventions/encode_action")
     def encode_action(self, agent_action, env):   #other player can be extracted from env using current player, must imp later
         if agent_action < self.environment_action_space:
             return agent_action
@@ -725,6 +733,7 @@ class simple_transfer_encoder():
             
         return environment_action
     
+    @instrumentation.timed("conventions/available_conventions")
     def available_conventions(self, env, disable_encoding = False):
         legal_conventions = []      #positional arguments correlate to actions in description
 
@@ -809,6 +818,7 @@ class simple_transfer_encoder():
 
         return legal_conventions
     
+    @instrumentation.timed("conventions/make_env_usable")
     def make_env_usable(self, env):
         current_player = env.state.cur_player()
         for player in range(env.state.num_players()):
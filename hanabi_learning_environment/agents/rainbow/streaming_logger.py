@@ -0,0 +1,174 @@
+# coding=utf-8
+"""An append-only experiment logger.
+
+The dopamine `Logger` pickles its whole data dictionary to a new file every
+iteration, so both the time spent logging and the size of the log files grow
+with the length of the experiment. `StreamingLogger` instead appends the
+entries of each iteration as JSON lines to a single file, which `load_log`
+reads back into the dictionary `Logger.data` would have held. The data of a
+`Logger` can also be carried over with `import_data`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import json
+import os
+
+import tensorflow as tf
+
+
+def _to_json(value):
+  """Converts the numpy values found in iteration statistics for json."""
+  if hasattr(value, 'tolist'):
+    return value.tolist()
+  raise TypeError('Cannot log a value of type {}.'.format(type(value)))
+
+
+def load_log(log_file):
+  """Reads a log written by `StreamingLogger`.
+
+  Args:
+    log_file: str, path of the log file.
+
+  Returns:
+    An `OrderedDict` mapping each logged key to its latest value.
+  """
+  data = collections.OrderedDict()
+  with tf.gfile.GFile(log_file, 'r') as fin:
+    for line in fin:
+      if not line.strip():
+        continue
+      record = json.loads(line)
+      data[record['key']] = record['value']
+  return data
+
+
+class StreamingLogger(object):
+  """Logger appending the entries of each iteration to a JSON lines file."""
+
+  def __init__(self, logging_dir):
+    """Initializes StreamingLogger.
+
+    Args:
+      logging_dir: str, Directory to which logs are written.
+    """
+    # Entries set since the last call to log_to_file.
+    self._pending = collections.OrderedDict()
+    # Size in bytes of the log file of each filename prefix, i.e. where the
+    # next entry is appended.
+    self._offsets = {}
+    self._logging_enabled = True
+
+    if not logging_dir:
+      tf.logging.info('Logging directory not specified, will not log.')
+      self._logging_enabled = False
+      return
+    try:
+      tf.gfile.MakeDirs(logging_dir)
+    except tf.errors.PermissionDeniedError:
+      # If it already exists, ignore exception.
+      pass
+    if not tf.gfile.Exists(logging_dir):
+      tf.logging.warning(
+          'Could not create directory %s, logging will be disabled.',
+          logging_dir)
+      self._logging_enabled = False
+      return
+    self._logging_dir = logging_dir
+
+  def __setitem__(self, key, value):
+    """Sets an entry to be appended by the next call to `log_to_file`.
+
+    Args:
+      key: str, indicating key where to write the entry.
+      value: A json-serializable object to store, possibly containing numpy
+        values.
+    """
+    if self._logging_enabled:
+      self._pending[key] = value
+
+  def _generate_filename(self, filename_prefix):
+    return os.path.join(self._logging_dir, '{}.jsonl'.format(filename_prefix))
+
+  def _offset(self, filename_prefix):
+    if filename_prefix not in self._offsets:
+      log_file = self._generate_filename(filename_prefix)
+      self._offsets[filename_prefix] = (
+          tf.gfile.Stat(log_file).length if tf.gfile.Exists(log_file) else 0)
+    return self._offsets[filename_prefix]
+
+  def log_to_file(self, filename_prefix, iteration_number):
+    """Appends the entries set since the last call to the log file.
+
+    Args:
+      filename_prefix: str, name of the file to use (without extension).
+      iteration_number: int, the iteration number the entries belong to.
+    """
+    if not self._logging_enabled:
+      tf.logging.warning('Logging is disabled.')
+      return
+    log_file = self._generate_filename(filename_prefix)
+    lines = []
+    for key, value in self._pending.items():
+      record = {'key': key, 'iteration': iteration_number, 'value': value}
+      lines.append(json.dumps(record, default=_to_json) + '\n')
+    self._pending.clear()
+    encoded = ''.join(lines)
+    offset = self._offset(filename_prefix)
+    with tf.gfile.GFile(log_file, 'a') as fout:
+      fout.write(encoded)
+    self._offsets[filename_prefix] = offset + len(encoded.encode('utf-8'))
+
+  def bundle(self):
+    """Returns the log file sizes, to store in a checkpoint instead of data."""
+    return dict(self._offsets)
+
+  def unbundle(self, offsets):
+    """Truncates the log files to their size when the checkpoint was taken.
+
+    This drops the entries logged after the checkpoint, which the resumed
+    experiment is about to log again.
+
+    Args:
+      offsets: dict, as returned by `bundle`.
+    """
+    self._pending.clear()
+    self._offsets = dict(offsets)
+    if not self._logging_enabled:
+      return
+    for filename_prefix, offset in self._offsets.items():
+      log_file = self._generate_filename(filename_prefix)
+      if (not tf.gfile.Exists(log_file) or
+          tf.gfile.Stat(log_file).length == offset):
+        continue
+      with tf.gfile.GFile(log_file, 'rb') as fin:
+        contents = fin.read(offset)
+      temp_file = log_file + '.tmp'
+      with tf.gfile.GFile(temp_file, 'wb') as fout:
+        fout.write(contents)
+      tf.gfile.Rename(temp_file, log_file, overwrite=True)
+
+  def import_data(self, filename_prefix, data):
+    """Rewrites a log file with the data of a pickle `Logger`.
+
+    This carries the history of an experiment logged by the pickle logger
+    over to the log file of this logger, when the experiment is resumed.
+
+    Args:
+      filename_prefix: str, name of the file to use (without extension).
+      data: dict, the `Logger.data` of a checkpoint, holding an 'iter<i>'
+        entry for each logged iteration.
+    """
+    self.unbundle({filename_prefix: 0})
+    if not self._logging_enabled:
+      return
+    for key in sorted(data, key=lambda key: int(key[len('iter'):])):
+      self[key] = data[key]
+      self.log_to_file(filename_prefix, int(key[len('iter'):]))
+
+  def is_logging_enabled(self):
+    """Return if logging is enabled."""
+    return self._logging_enabled
@@ -0,0 +1,76 @@
+# coding=utf-8
+"""Tests for streaming_logger."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+import streaming_logger
+import tensorflow as tf
+
+
+def log_iteration(logger, iteration):
+  logger['iteration_{}'.format(iteration)] = {
+      'train_episode_returns': [np.float32(iteration), 1.5],
+      'train_episode_lengths': np.arange(iteration + 1),
+  }
+  logger.log_to_file('log', iteration)
+
+
+class StreamingLoggerTest(tf.test.TestCase):
+
+  def testLoadLogReadsTheLoggedIterations(self):
+    logging_dir = self.get_temp_dir()
+    logger = streaming_logger.StreamingLogger(logging_dir)
+    for iteration in range(3):
+      log_iteration(logger, iteration)
+    data = streaming_logger.load_log(os.path.join(logging_dir, 'log.jsonl'))
+    self.assertEqual(list(data), ['iteration_0', 'iteration_1', 'iteration_2'])
+    self.assertEqual(data['iteration_2'],
+                     {'train_episode_returns': [2.0, 1.5],
+                      'train_episode_lengths': [0, 1, 2]})
+
+  def testUnbundleDropsTheEntriesLoggedAfterTheCheckpoint(self):
+    logging_dir = self.get_temp_dir()
+    logger = streaming_logger.StreamingLogger(logging_dir)
+    for iteration in range(2):
+      log_iteration(logger, iteration)
+    offsets = logger.bundle()
+    log_iteration(logger, 2)
+
+    # The experiment resumes from the checkpoint of iteration 1.
+    resumed = streaming_logger.StreamingLogger(logging_dir)
+    resumed.unbundle(offsets)
+    log_iteration(resumed, 2)
+    log_iteration(resumed, 3)
+    log_file = os.path.join(logging_dir, 'log.jsonl')
+    with open(log_file) as f:
+      self.assertEqual(len(f.readlines()), 4)
+    data = streaming_logger.load_log(log_file)
+    self.assertEqual(list(data), ['iteration_0', 'iteration_1', 'iteration_2',
+                                  'iteration_3'])
+
+  def testImportDataRewritesTheLogFile(self):
+    logging_dir = self.get_temp_dir()
+    logger = streaming_logger.StreamingLogger(logging_dir)
+    log_iteration(logger, 5)
+    data = {'iter{}'.format(iteration): {'returns': [iteration]}
+            for iteration in (10, 2, 1)}
+    logger.import_data('log', data)
+    log_file = os.path.join(logging_dir, 'log.jsonl')
+    self.assertEqual(list(streaming_logger.load_log(log_file)),
+                     ['iter1', 'iter2', 'iter10'])
+    self.assertEqual(logger.bundle(), {'log': os.path.getsize(log_file)})
+
+  def testLoggingWithoutADirectoryIsDisabled(self):
+    logger = streaming_logger.StreamingLogger(None)
+    self.assertFalse(logger.is_logging_enabled())
+    log_iteration(logger, 0)
+    self.assertEqual(logger.bundle(), {})
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -203,3 +203,38 @@ class SumTree(object):
 
     assert node_index == 0, ('Sum tree traversal failed, final node index '
                              'is not 0.')
+
+  def set_batch(self, node_indices, values):
+    """Sets the values of several leaf nodes, as successive calls to `set`.
+
+    The internal nodes above the updated leaves are recomputed level by level,
+    which for large batches is much faster than calling `set` for each leaf.
+
+    Args:
+      node_indices: `np.array` of indices of the leaf nodes to be updated.
+      values: `np.array` of nonnegative values assigned to the nodes. The last
+        value is kept for a repeated index.
+
+    Raises:
+      ValueError: If one of the given values is negative.
+    """
+    node_indices = np.asarray(node_indices, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    if not node_indices.size:
+      return
+    if np.any(values < 0.0):
+      raise ValueError('Sum tree values should be nonnegative. Got {}'.
+                       format(values.min()))
+    self.max_recorded_priority = max(values.max(), self.max_recorded_priority)
+
+    # Keep the last occurrence of each index.
+    _, last = np.unique(node_indices[::-1], return_index=True)
+    keep = node_indices.size - 1 - last
+    node_indices = node_indices[keep]
+    self.nodes[-1][node_indices] = values[keep]
+
+    for depth in range(len(self.nodes) - 1, 0, -1):
+      children = self.nodes[depth]
+      node_indices = np.unique(node_indices // 2)
+      self.nodes[depth - 1][node_indices] = (children[2 * node_indices] +
+                                             children[2 * node_indices + 1])
@@ -0,0 +1,54 @@
+# coding=utf-8
+"""Tests for sum_tree."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import unittest
+
+import numpy as np
+from third_party.dopamine import sum_tree
+
+
+def assert_consistent(test_case, tree):
+  """Asserts every internal node of a sum tree is the sum of its children."""
+  for depth in range(len(tree.nodes) - 1, 0, -1):
+    children = tree.nodes[depth]
+    np.testing.assert_allclose(tree.nodes[depth - 1],
+                               children[0::2] + children[1::2], atol=1e-6)
+  test_case.assertGreaterEqual(tree.nodes[-1].min(), 0.0)
+
+
+class SumTreeTest(unittest.TestCase):
+
+  def testSetBatchMatchesSet(self):
+    rng = np.random.RandomState(0)
+    expected = sum_tree.SumTree(100)
+    actual = sum_tree.SumTree(100)
+    for _ in range(20):
+      # Repeated indices keep their last value, as with successive sets.
+      indices = rng.randint(0, 100, 30)
+      values = rng.uniform(0.0, 10.0, 30)
+      for index, value in zip(indices, values):
+        expected.set(index, value)
+      actual.set_batch(indices, values)
+      for expected_level, actual_level in zip(expected.nodes, actual.nodes):
+        np.testing.assert_allclose(actual_level, expected_level)
+      self.assertEqual(actual.max_recorded_priority,
+                       expected.max_recorded_priority)
+      assert_consistent(self, actual)
+
+  def testSetBatchWithoutIndices(self):
+    tree = sum_tree.SumTree(8)
+    tree.set_batch(np.array([], dtype=np.int64), np.array([]))
+    self.assertEqual(tree.nodes[0][0], 0.0)
+
+  def testSetBatchRejectsNegativeValues(self):
+    tree = sum_tree.SumTree(8)
+    with self.assertRaises(ValueError):
+      tree.set_batch(np.array([1, 2]), np.array([1.0, -1.0]))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -29,9 +29,9 @@ from __future__ import print_function
 from absl import app
 from absl import flags
 
-from third_party.dopamine import logger
 import datetime
 
+import profiling
 import run_experiment
 from small_hanabi_conventions_encoder import simple_combined_encoder, simple_transfer_encoder, standalone_encoder
 from hanabi_conventions_encoder import simple_combined_encoder_full, simple_combined_encoder_full_v2, simple_official_rules_based_encoder_2p, simple_official_rules_based_encoder
@@ -66,6 +66,11 @@ flags.DEFINE_string('logging_dir', '',
                     'no checkpoints will be saved.')
 flags.DEFINE_string('logging_file_prefix', 'log',
                     'Prefix to use for the log files.')
+flags.DEFINE_integer('profile_start_iteration', 0,
+                     'Iteration from which the training steps are profiled.')
+flags.DEFINE_integer('profile_num_steps', 0,
+                     'Number of training steps to profile, written to '
+                     'base_dir/profiles. If 0, no profile is taken.')
 
 
 def launch_experiment():
@@ -87,7 +92,8 @@ def launch_experiment():
                      'logs and checkpoints.')
 
   run_experiment.load_gin_configs(FLAGS.gin_files, FLAGS.gin_bindings)
-  experiment_logger = logger.Logger('{}/logs'.format(FLAGS.base_dir))
+  experiment_logger = run_experiment.create_experiment_logger(
+      '{}/logs'.format(FLAGS.base_dir))
 
   environment = run_experiment.create_environment()
   obs_stacker = run_experiment.create_obs_stacker(environment)
@@ -111,13 +117,21 @@ def launch_experiment():
       run_experiment.initialize_checkpointing(agent,
                                               experiment_logger,
                                               checkpoint_dir,
-                                              FLAGS.checkpoint_file_prefix))
+                                              FLAGS.checkpoint_file_prefix,
+                                              FLAGS.logging_file_prefix))
+
+  profiler = None
+  if FLAGS.profile_num_steps > 0:
+    profiler = profiling.TrainingProfiler(
+        agent, '{}/profiles'.format(FLAGS.base_dir), FLAGS.profile_num_steps)
 
   run_experiment.run_experiment(agent, environment, start_iteration,
                                 obs_stacker,
                                 experiment_logger, experiment_checkpointer,
                                 checkpoint_dir, convention_encoder = convention_encoder,
-                                logging_file_prefix=FLAGS.logging_file_prefix)
+                                logging_file_prefix=FLAGS.logging_file_prefix,
+                                profiler=profiler,
+                                profile_start_iteration=FLAGS.profile_start_iteration)
 
 
 def main(unused_argv):
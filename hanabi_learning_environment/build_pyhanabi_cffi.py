@@ -0,0 +1,71 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Builds _pyhanabi_cffi, an API-mode cffi extension wrapping libpyhanabi.
+
+pyhanabi.py uses this compiled module when it is importable. Otherwise it
+parses pyhanabi.h and opens libpyhanabi with cffi's ABI mode, which is slower
+to import and to call. The build is run by CMake with -DPYHANABI_CFFI_API=ON,
+or by hand once libpyhanabi has been built:
+
+  python build_pyhanabi_cffi.py --lib_dir <directory of libpyhanabi.so>
+"""
+import argparse
+import os
+
+import cffi
+# Run as a script next to pyhanabi.py, which parses the header.
+from pyhanabi import read_cdef
+
+MODULE_NAME = "_pyhanabi_cffi"
+HEADER_DIR = os.path.dirname(os.path.abspath(__file__))
+PYHANABI_HEADER = os.path.join(HEADER_DIR, "pyhanabi.h")
+
+
+def make_builder(lib_dir):
+  """Returns the cffi builder of the extension module.
+
+  Args:
+    lib_dir: directory containing libpyhanabi. The extension is linked
+      against it and looks for it next to itself at run time, where it is
+      installed.
+  """
+  ffibuilder = cffi.FFI()
+  ffibuilder.cdef(read_cdef(PYHANABI_HEADER))
+  # pyhanabi.h wraps its declarations in extern "C", so the generated source
+  # is compiled as C++.
+  ffibuilder.set_source(
+      MODULE_NAME,
+      "#include \"pyhanabi.h\"",
+      source_extension=".cpp",
+      include_dirs=[HEADER_DIR],
+      libraries=["pyhanabi"],
+      library_dirs=[lib_dir],
+      extra_link_args=["-Wl,-rpath,$ORIGIN"])
+  return ffibuilder
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--lib_dir", default=".",
+                      help="Directory containing libpyhanabi.")
+  parser.add_argument("--build_dir", default=".",
+                      help="Directory in which the extension is built.")
+  args = parser.parse_args()
+  make_builder(os.path.abspath(args.lib_dir)).compile(tmpdir=args.build_dir,
+                                                      verbose=True)
+
+
+if __name__ == "__main__":
+  main()
@@ -67,6 +67,10 @@ HanabiHand::HanabiHand(const HanabiHand& hand, bool hide_cards,
     cards_.resize(hand.cards_.size(), HanabiCard());
   } else {
     cards_ = hand.cards_;
+    color_bitmasks_ = hand.color_bitmasks_;
+    rank_bitmasks_ = hand.rank_bitmasks_;
+    colors_in_hand_ = hand.colors_in_hand_;
+    ranks_in_hand_ = hand.ranks_in_hand_;
   }
   if (hide_knowledge && !hand.cards_.empty()) {
     card_knowledge_.resize(hand.cards_.size(),
@@ -80,6 +84,12 @@ HanabiHand::HanabiHand(const HanabiHand& hand, bool hide_cards,
 void HanabiHand::AddCard(HanabiCard card,
                          const CardKnowledge& initial_knowledge) {
   REQUIRE(card.IsValid());
+  assert(cards_.size() < 8);  // More than 8 cards is currently not supported.
+  const uint8_t card_bit = static_cast<uint8_t>(1) << cards_.size();
+  color_bitmasks_[card.Color()] |= card_bit;
+  rank_bitmasks_[card.Rank()] |= card_bit;
+  colors_in_hand_ |= static_cast<uint8_t>(1) << card.Color();
+  ranks_in_hand_ |= static_cast<uint8_t>(1) << card.Rank();
   cards_.push_back(card);
   card_knowledge_.push_back(initial_knowledge);
 }
@@ -89,6 +99,27 @@ void HanabiHand::RemoveFromHand(int card_index,
   if (discard_pile != nullptr) {
     discard_pile->push_back(cards_[card_index]);
   }
+  // Drop the card's bit from the bitmasks, moving down the bits of the cards
+  // after it.
+  const uint8_t lower_bits = (static_cast<uint8_t>(1) << card_index) - 1;
+  auto remove_bit = [lower_bits](uint8_t mask) {
+    return static_cast<uint8_t>((mask & lower_bits) |
+                                ((mask >> 1) & ~lower_bits));
+  };
+  colors_in_hand_ = 0;
+  for (int color = 0; color < kMaxNumColors; ++color) {
+    color_bitmasks_[color] = remove_bit(color_bitmasks_[color]);
+    if (color_bitmasks_[color] != 0) {
+      colors_in_hand_ |= static_cast<uint8_t>(1) << color;
+    }
+  }
+  ranks_in_hand_ = 0;
+  for (int rank = 0; rank < kMaxNumRanks; ++rank) {
+    rank_bitmasks_[rank] = remove_bit(rank_bitmasks_[rank]);
+    if (rank_bitmasks_[rank] != 0) {
+      ranks_in_hand_ |= static_cast<uint8_t>(1) << rank;
+    }
+  }
   cards_.erase(cards_.begin() + card_index);
   card_knowledge_.erase(card_knowledge_.begin() + card_index);
 }
@@ -15,11 +15,13 @@
 #ifndef __HANABI_HAND_H__
 #define __HANABI_HAND_H__
 
+#include <array>
 #include <cstdint>
 #include <string>
 #include <vector>
 
 #include "hanabi_card.h"
+#include "util.h"
 
 namespace hanabi_learning_env {
 
@@ -90,8 +92,7 @@ class HanabiHand {
   };
 
   HanabiHand() {}
-  HanabiHand(const HanabiHand& hand)
-      : cards_(hand.cards_), card_knowledge_(hand.card_knowledge_) {}
+  HanabiHand(const HanabiHand& hand) = default;
   // Copy hand. Hide cards (set to invalid) if hide_cards is true.
   // Hide card knowledge (set to unknown) if hide_knowledge is true.
   HanabiHand(const HanabiHand& hand, bool hide_cards, bool hide_knowledge);
@@ -101,6 +102,14 @@ class HanabiHand {
   const std::vector<CardKnowledge>& Knowledge() const {
     return card_knowledge_;
   }
+  // Bitmask of the cards of the given color, bit_i set if card_i has it.
+  uint8_t ColorBitmask(int color) const { return color_bitmasks_[color]; }
+  // Bitmask of the cards of the given rank, bit_i set if card_i has it.
+  uint8_t RankBitmask(int rank) const { return rank_bitmasks_[rank]; }
+  // Bitmask of the colors in hand, bit_c set if some card has color c.
+  uint8_t ColorsInHand() const { return colors_in_hand_; }
+  // Bitmask of the ranks in hand, bit_r set if some card has rank r.
+  uint8_t RanksInHand() const { return ranks_in_hand_; }
   void AddCard(HanabiCard card, const CardKnowledge& initial_knowledge);
   // Remove card_index card from hand. Put in discard_pile if not nullptr
   // (pushes the card to the back of the discard_pile vector).
@@ -119,6 +128,12 @@ class HanabiHand {
   // A set of cards and knowledge about them.
   std::vector<HanabiCard> cards_;
   std::vector<CardKnowledge> card_knowledge_;
+  // Card bitmasks of each color and rank, and bitmasks of the colors and ranks
+  // in hand, updated as cards are added and removed. Hidden cards are in none.
+  std::array<uint8_t, kMaxNumColors> color_bitmasks_{};
+  std::array<uint8_t, kMaxNumRanks> rank_bitmasks_{};
+  uint8_t colors_in_hand_ = 0;
+  uint8_t ranks_in_hand_ = 0;
 };
 
 }  // namespace hanabi_learning_env
@@ -22,34 +22,6 @@
 
 namespace hanabi_learning_env {
 
-namespace {
-// Returns bitmask of card indices which match color.
-uint8_t HandColorBitmask(const HanabiHand& hand, int color) {
-  uint8_t mask = 0;
-  const auto& cards = hand.Cards();
-  assert(cards.size() <= 8);  // More than 8 cards is not supported.
-  for (int i = 0; i < cards.size(); ++i) {
-    if (cards[i].Color() == color) {
-      mask |= static_cast<uint8_t>(1) << i;
-    }
-  }
-  return mask;
-}
-
-// Returns bitmask of card indices which match color.
-uint8_t HandRankBitmask(const HanabiHand& hand, int rank) {
-  uint8_t mask = 0;
-  const auto& cards = hand.Cards();
-  assert(cards.size() <= 8);  // More than 8 cards is not supported.
-  for (int i = 0; i < cards.size(); ++i) {
-    if (cards[i].Rank() == rank) {
-      mask |= static_cast<uint8_t>(1) << i;
-    }
-  }
-  return mask;
-}
-}  // namespace
-
 HanabiState::HanabiDeck::HanabiDeck(const HanabiGame& game)
     : card_count_(game.NumColors() * game.NumRanks(), 0),
       total_count_(0),
@@ -190,11 +162,7 @@ bool HanabiState::MoveIsLegal(HanabiMove move) const {
       if (!HintingIsLegal(move)) {
         return false;
       }
-      const auto& cards = HandByOffset(move.TargetOffset()).Cards();
-      if (!std::any_of(cards.begin(), cards.end(),
-                       [move](const HanabiCard& card) {
-                         return card.Color() == move.Color();
-                       })) {
+      if (HandByOffset(move.TargetOffset()).ColorBitmask(move.Color()) == 0) {
         return false;
       }
       break;
@@ -203,11 +171,7 @@ bool HanabiState::MoveIsLegal(HanabiMove move) const {
       if (!HintingIsLegal(move)) {
         return false;
       }
-      const auto& cards = HandByOffset(move.TargetOffset()).Cards();
-      if (!std::any_of(cards.begin(), cards.end(),
-                       [move](const HanabiCard& card) {
-                         return card.Rank() == move.Rank();
-                       })) {
+      if (HandByOffset(move.TargetOffset()).RankBitmask(move.Rank()) == 0) {
         return false;
       }
       break;
@@ -256,14 +220,14 @@ void HanabiState::ApplyMove(HanabiMove move) {
     case HanabiMove::kRevealColor:
       DecrementInformationTokens();
       history.reveal_bitmask =
-          HandColorBitmask(*HandByOffset(move.TargetOffset()), move.Color());
+          HandByOffset(move.TargetOffset())->ColorBitmask(move.Color());
       history.newly_revealed_bitmask =
           HandByOffset(move.TargetOffset())->RevealColor(move.Color());
       break;
     case HanabiMove::kRevealRank:
       DecrementInformationTokens();
       history.reveal_bitmask =
-          HandRankBitmask(*HandByOffset(move.TargetOffset()), move.Rank());
+          HandByOffset(move.TargetOffset())->RankBitmask(move.Rank());
       history.newly_revealed_bitmask =
           HandByOffset(move.TargetOffset())->RevealRank(move.Rank());
       break;
@@ -293,16 +257,47 @@ std::vector<HanabiMove> HanabiState::LegalMoves(int player) const {
     // Turn-based game. Empty move list for other players.
     return movelist;
   }
-  int max_move_uid = ParentGame()->MaxMoves();
-  for (int uid = 0; uid < max_move_uid; ++uid) {
-    HanabiMove move = ParentGame()->GetMove(uid);
-    if (MoveIsLegal(move)) {
-      movelist.push_back(move);
+  uint64_t legal_uids = LegalMoveBitmask(player);
+  for (int uid = 0; legal_uids != 0; ++uid, legal_uids >>= 1) {
+    if (legal_uids & 1) {
+      movelist.push_back(ParentGame()->GetMove(uid));
     }
   }
   return movelist;
 }
 
+uint64_t HanabiState::LegalMoveBitmask(int player) const {
+  REQUIRE(player >= 0 && player < ParentGame()->NumPlayers());
+  if (player != cur_player_) {
+    return 0;
+  }
+  const HanabiGame& game = *ParentGame();
+  assert(game.MaxMoves() <= 64);  // Uids must fit in the bitmask.
+  // The uids of the moves of each type are contiguous, so the moves allowed
+  // by the hands are shifted to the first uid of their type, and the moves of
+  // a type disallowed by the information tokens are left out as a whole.
+  const uint64_t cards_in_hand =
+      (static_cast<uint64_t>(1) << hands_[cur_player_].Cards().size()) - 1;
+  uint64_t legal_uids =
+      cards_in_hand << game.GetMoveUid(HanabiMove::kPlay, 0, -1, -1, -1);
+  if (InformationTokens() < game.MaxInformationTokens()) {
+    legal_uids |=
+        cards_in_hand << game.GetMoveUid(HanabiMove::kDiscard, 0, -1, -1, -1);
+  }
+  if (InformationTokens() > 0) {
+    for (int offset = 1; offset < game.NumPlayers(); ++offset) {
+      const HanabiHand& hand = HandByOffset(offset);
+      legal_uids |= static_cast<uint64_t>(hand.ColorsInHand())
+                    << game.GetMoveUid(HanabiMove::kRevealColor, -1, offset,
+                                       0, -1);
+      legal_uids |= static_cast<uint64_t>(hand.RanksInHand())
+                    << game.GetMoveUid(HanabiMove::kRevealRank, -1, offset,
+                                       -1, 0);
+    }
+  }
+  return legal_uids;
+}
+
 bool HanabiState::CardPlayableOnFireworks(int color, int rank) const {
   if (color < 0 || color >= ParentGame()->NumColors()) {
     return false;
@@ -15,6 +15,7 @@
 #ifndef __HANABI_STATE_H__
 #define __HANABI_STATE_H__
 
+#include <cstdint>
 #include <random>
 #include <string>
 #include <vector>
@@ -76,6 +77,10 @@ class HanabiState {
   void ApplyMove(HanabiMove move);
   // Legal moves for state. Moves point into an unchanging list in parent_game.
   std::vector<HanabiMove> LegalMoves(int player) const;
+  // Legal moves for state as a bitmask of move uids, bit_i set if the move
+  // with uid i is legal. Computed from the hands' color and rank bitmasks
+  // without allocating.
+  uint64_t LegalMoveBitmask(int player) const;
   // Returns true if card with color and rank can be played on fireworks pile.
   bool CardPlayableOnFireworks(int color, int rank) const;
   bool CardPlayableOnFireworks(HanabiCard card) const {
@@ -0,0 +1,122 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Named timers and counters for the environment and training hot paths.
+
+Instrumentation is disabled by default, in which case a timed function costs
+one extra call and a flag test, and `increment` returns immediately. Once
+enabled with `enable()`, the calls and total time of each timer and the value
+of each counter accumulate until `collect()` returns and resets them:
+
+  @instrumentation.timed("env/step")
+  def step(self, action):
+    ...
+
+  instrumentation.increment("replay/transitions_added", num_transitions)
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import functools
+import threading
+import time
+
+_enabled = False
+# Guards the aggregates, which the replay py_funcs update from TensorFlow
+# threads.
+_lock = threading.Lock()
+# Timer name -> [number of calls, total seconds].
+_timers = {}
+# Counter name -> total.
+_counters = {}
+
+
+def enable(enabled=True):
+  """Turns instrumentation on or off.
+
+  Args:
+    enabled: bool, whether timers and counters should record.
+  """
+  global _enabled
+  _enabled = enabled
+
+
+def is_enabled():
+  """Returns whether timers and counters are recording."""
+  return _enabled
+
+
+def timed(name):
+  """Returns a decorator recording the calls and duration of a function.
+
+  Args:
+    name: str, name of the timer, shared by all functions decorated with it.
+  """
+  def decorator(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+      if not _enabled:
+        return fn(*args, **kwargs)
+      start = time.perf_counter()
+      try:
+        return fn(*args, **kwargs)
+      finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+          aggregate = _timers.setdefault(name, [0, 0.0])
+          aggregate[0] += 1
+          aggregate[1] += elapsed
+    return wrapper
+  return decorator
+
+
+def increment(name, amount=1):
+  """Adds to a counter.
+
+  Args:
+    name: str, name of the counter.
+    amount: number, added to the counter.
+  """
+  if not _enabled:
+    return
+  with _lock:
+    _counters[name] = _counters.get(name, 0) + amount
+
+
+def collect(reset=True):
+  """Returns the aggregates recorded so far.
+
+  Args:
+    reset: bool, whether to clear the aggregates, so that the next call only
+      returns what was recorded in between.
+
+  Returns:
+    A dict with, for each timer, the keys `time/<name>` (total seconds),
+    `calls/<name>` and `mean_us/<name>` (microseconds per call), and for each
+    counter the key `count/<name>`.
+  """
+  with _lock:
+    timers = dict(_timers)
+    counters = dict(_counters)
+    if reset:
+      _timers.clear()
+      _counters.clear()
+  aggregates = {}
+  for name, (calls, seconds) in sorted(timers.items()):
+    aggregates["time/" + name] = seconds
+    aggregates["calls/" + name] = calls
+    aggregates["mean_us/" + name] = 1e6 * seconds / calls
+  for name, total in sorted(counters.items()):
+    aggregates["count/" + name] = total
+  return aggregates
@@ -15,7 +15,6 @@
 """Python interface to Hanabi code."""
 import os
 import re
-import cffi
 import enum
 import sys
 
@@ -26,10 +25,22 @@ PYHANABI_LIB = ["libpyhanabi.so", "libpyhanabi.dylib"]
 COLOR_CHAR = ["R", "Y", "G", "W", "B"]  # consistent with hanabi_lib/util.cc
 CHANCE_PLAYER_ID = -1
 
-ffi = cffi.FFI()
-lib = None
-cdef_loaded_flag = False
-lib_loaded_flag = False
+# Number of wrapper objects currently holding a C++ allocation, by class.
+_live_objects = {"HanabiMove": 0, "HanabiObservation": 0}
+
+try:
+  # Compiled API-mode module, only present if built with PYHANABI_CFFI_API (see
+  # build_pyhanabi_cffi.py). It needs neither the header nor dlopen, and its
+  # calls are cheaper than in ABI mode.
+  from hanabi_learning_environment._pyhanabi_cffi import ffi, lib
+  cdef_loaded_flag = True
+  lib_loaded_flag = True
+except ImportError:
+  import cffi
+  ffi = cffi.FFI()
+  lib = None
+  cdef_loaded_flag = False
+  lib_loaded_flag = False
 
 
 if sys.version_info < (3,):
@@ -39,6 +50,29 @@ else:
   def encode_ffi_string(x):
     return str(ffi.string(x), 'ascii')
 
+def read_cdef(cdef_file):
+  """Returns the declarations in the extern "C" block of a header file.
+
+  Args:
+    cdef_file: path of pyhanabi header file.
+  Returns:
+    The declarations, one per line, to pass to cffi's cdef.
+  """
+  reading_cdef = False
+  cdef_string = ""
+  for line in open(cdef_file).readlines():
+    line = line.rstrip()
+    if re.match("extern *\"C\" *{", line):
+      reading_cdef = True
+      continue
+    elif re.match("} */[*] *extern *\"C\" *[*]/", line):
+      reading_cdef = False
+      continue
+    if reading_cdef:
+      cdef_string = cdef_string + line + "\n"
+  return cdef_string
+
+
 def try_cdef(header=PYHANABI_HEADER, prefixes=DEFAULT_CDEF_PREFIXES):
   """Try parsing library header file. Must be called before any pyhanabi calls.
 
@@ -53,20 +87,7 @@ def try_cdef(header=PYHANABI_HEADER, prefixes=DEFAULT_CDEF_PREFIXES):
   for prefix in prefixes:
     try:
       cdef_file = header if prefix is None else prefix + "/" + header
-      lines = open(cdef_file).readlines()
-      reading_cdef = False
-      cdef_string = ""
-      for line in lines:
-        line = line.rstrip()
-        if re.match("extern *\"C\" *{", line):
-          reading_cdef = True
-          continue
-        elif re.match("} */[*] *extern *\"C\" *[*]/", line):
-          reading_cdef = False
-          continue
-        if reading_cdef:
-          cdef_string = cdef_string + line + "\n"
-      ffi.cdef(cdef_string)
+      ffi.cdef(read_cdef(cdef_file))
       cdef_loaded_flag = True
       return True
     except IOError:
@@ -114,6 +135,15 @@ def lib_loaded():
   return lib_loaded_flag
 
 
+def live_object_counts():
+  """Returns the number of live HanabiMove and HanabiObservation wrappers.
+
+  Each of them holds a C++ allocation, which is freed when it is garbage
+  collected, so a count that keeps growing points to leaked references.
+  """
+  return dict(_live_objects)
+
+
 def color_idx_to_char(color_idx):
   """Helper function for converting color index to a character.
 
@@ -302,6 +332,7 @@ class HanabiMove(object):
   def __init__(self, move):
     assert move is not None
     self._move = move
+    _live_objects["HanabiMove"] += 1
 
   @property
   def c_move(self):
@@ -365,6 +396,7 @@ class HanabiMove(object):
     if self._move is not None:
       lib.DeleteMove(self._move)
       self._move = None
+      _live_objects["HanabiMove"] -= 1
     del self
 
   def to_dict(self):
@@ -801,6 +833,7 @@ class HanabiObservation(object):
     self._observation = ffi.new("pyhanabi_observation_t*")
     self._game = game
     lib.NewObservation(state, player, self._observation)
+    _live_objects["HanabiObservation"] += 1
 
   def __str__(self):
     c_string = lib.ObsToString(self._observation)
@@ -815,6 +848,7 @@ class HanabiObservation(object):
     if self._observation is not None:
       lib.DeleteObservation(self._observation)
       self._observation = None
+      _live_objects["HanabiObservation"] -= 1
     del self
 
   def observation(self):
@@ -0,0 +1,70 @@
+# coding=utf-8
+"""Tests for the legal moves generated by hanabi_lib through pyhanabi."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import random
+import unittest
+
+from hanabi_learning_environment import pyhanabi
+
+
+def brute_force_legal_moves(game, state):
+  """Returns the legal moves of the current player, scanning every move uid.
+
+  This is how hanabi_lib used to generate legal moves, with the legality of
+  each move worked out from the hands and information tokens.
+  """
+  hands = state.player_hands()
+  player = state.cur_player()
+  tokens = state.information_tokens()
+  legal_moves = []
+  for uid in range(game.max_moves()):
+    move = game.get_move(uid)
+    move_type = move.type()
+    if move_type == pyhanabi.HanabiMoveType.PLAY:
+      legal = move.card_index() < len(hands[player])
+    elif move_type == pyhanabi.HanabiMoveType.DISCARD:
+      legal = (tokens < game.max_information_tokens() and
+               move.card_index() < len(hands[player]))
+    else:
+      target = hands[(player + move.target_offset()) % game.num_players()]
+      if move_type == pyhanabi.HanabiMoveType.REVEAL_COLOR:
+        matches = [card.color() == move.color() for card in target]
+      else:
+        matches = [card.rank() == move.rank() for card in target]
+      legal = tokens > 0 and any(matches)
+    if legal:
+      legal_moves.append(move)
+  return legal_moves
+
+
+class LegalMovesTest(unittest.TestCase):
+
+  def testLegalMovesMatchTheBruteForceScan(self):
+    for num_players in range(2, 6):
+      for seed in range(10):
+        game = pyhanabi.HanabiGame({'players': num_players, 'seed': seed})
+        rng = random.Random(seed)
+        state = game.new_initial_state()
+        while not state.is_terminal():
+          if state.cur_player() == pyhanabi.CHANCE_PLAYER_ID:
+            state.deal_random_card()
+            continue
+          expected = [str(move) for move in
+                      brute_force_legal_moves(game, state)]
+          legal_moves = state.legal_moves()
+          self.assertEqual([str(move) for move in legal_moves], expected)
+          observation = state.observation(state.cur_player())
+          self.assertEqual([str(move) for move in observation.legal_moves()],
+                           expected)
+          for uid in range(game.max_moves()):
+            move = game.get_move(uid)
+            self.assertEqual(state.move_is_legal(move), str(move) in expected)
+          state.apply_move(rng.choice(legal_moves))
+
+
+if __name__ == '__main__':
+  unittest.main()
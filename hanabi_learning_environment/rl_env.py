@@ -16,6 +16,7 @@
 from __future__ import absolute_import
 from __future__ import division
 
+from hanabi_learning_environment import instrumentation
 from hanabi_learning_environment import pyhanabi
 from hanabi_learning_environment.pyhanabi import color_char_to_idx
 
@@ -232,6 +233,7 @@ class HanabiEnv(Environment):
     """
     return self.game.max_moves()
 
+  @instrumentation.timed("env/step")
   def step(self, action):
     """Take one step in the game.
 
@@ -1,10 +1,19 @@
+import os
+
 from skbuild import setup
 
+# PYHANABI_CFFI_API=1 pip install . also builds the compiled cffi extension,
+# see hanabi_learning_environment/build_pyhanabi_cffi.py.
+cmake_args = []
+if os.environ.get('PYHANABI_CFFI_API'):
+  cmake_args.append('-DPYHANABI_CFFI_API=ON')
+
 setup(
     name='hanabi_learning_environment',
     version='0.0.1',
     description='Learning environment for the game of hanabi.',
     author='deepmind/hanabi-learning-environment',
     packages=['hanabi_learning_environment', 'hanabi_learning_environment.agents'],
-    install_requires=['cffi']
+    install_requires=['cffi'],
+    cmake_args=cmake_args
 )